@@ -146,6 +146,12 @@ DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL')
 
 SITE_URL = "http://127.0.0.1:8000"
 
+# Chat storage
+MESSAGE_COMPRESSION_THRESHOLD = 1024  # characters, shorter messages are stored uncompressed
+MESSAGE_COMPRESSION_CODEC = 'zlib'  # 'zstd' requires the zstandard package
+CONVERSATION_ARCHIVE_DIR = BASE_DIR / 'archive'
+CONVERSATION_ARCHIVE_SEGMENT_SIZE = 64 * 1024 * 1024  # bytes
+
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'home'  # Redirect after login
 LOGOUT_REDIRECT_URL = 'login'  # Redirect after logout
@@ -0,0 +1,247 @@
+"""
+ORM query-count and query-plan regression benchmarks for chat storage and chat views.
+
+Synthetic users, conversations and message pairs are seeded at several scales. Every storage
+method and read-only chat view is executed at each scale while the issued queries are captured,
+explained and timed. A case fails when its query count exceeds its budget, when its query count
+changes with the data size (an N+1), or when any of its queries plans a full table scan or an
+unindexed sort.
+
+Run it with `python manage.py benchmark_queries`, which works on a throwaway test database.
+"""
+import random
+import re
+import statistics
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List, Optional
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from core_web.models import Conversation, MessagePair
+from src.globals.configs import ChatStorageType
+from src.storage.chat_search import get_search_backend
+from src.storage.chat_storage import MessageData, StorageManager
+
+MESSAGES_PER_CONVERSATION = 10
+CONVERSATIONS_PER_USER = 20
+SEED_BATCH_SIZE = 2000
+WORDS = (
+    "python django query index vector embedding summary conversation model token latency cache "
+    "deploy error docker kubernetes proxy certificate timeout retry memory thread async database"
+).split()
+
+# Transaction bookkeeping is not a query the code asked for
+_IGNORED_STATEMENT = re.compile(r'^\s*(SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT|BEGIN|COMMIT)', re.IGNORECASE)
+_SQLITE_FULL_SCAN = re.compile(r'^SCAN (?!.*(VIRTUAL TABLE|USING (COVERING )?INDEX|USING INTEGER PRIMARY KEY))')
+_SQLITE_TEMP_SORT = 'USE TEMP B-TREE FOR ORDER BY'
+
+
+@dataclass
+class BenchmarkCase:
+    """A storage method or view exercised at every scale"""
+    name: str
+    run: Callable[[], object]
+    max_queries: int
+    # Ranking queries (full-text search) have to sort their matches
+    allow_sort: bool = False
+
+
+@dataclass
+class CaseResult:
+    name: str
+    scale: int
+    queries: int
+    latency_ms: float
+    plans: Dict[str, List[str]] = field(default_factory=dict)
+    issues: List[str] = field(default_factory=list)
+
+
+@dataclass
+class BenchmarkReport:
+    scales: List[int]
+    results: List[CaseResult] = field(default_factory=list)
+    failures: List[str] = field(default_factory=list)
+
+    def as_dict(self) -> Dict:
+        return asdict(self)
+
+
+@dataclass
+class SeedData:
+    user_id: int
+    conversation_id: int
+    message_pairs: int
+
+
+def _executed_queries(captured: CaptureQueriesContext) -> List[str]:
+    return [query['sql'] for query in captured.captured_queries if not _IGNORED_STATEMENT.match(query['sql'])]
+
+
+def explain(sql: str) -> List[str]:
+    """Return the query plan lines of a captured SELECT statement"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+        cursor.execute(f'EXPLAIN {sql}')
+        return [row[0] for row in cursor.fetchall()]
+
+
+def plan_issues(plan: List[str], allow_sort: bool = False) -> List[str]:
+    """Full scans and unindexed sorts found in a query plan"""
+    issues = []
+    for line in plan:
+        if connection.vendor == 'sqlite':
+            if _SQLITE_FULL_SCAN.match(line):
+                issues.append(f"full scan: {line}")
+            elif _SQLITE_TEMP_SORT in line and not allow_sort:
+                issues.append(f"unindexed sort: {line}")
+        elif 'Seq Scan' in line:
+            issues.append(f"full scan: {line.strip()}")
+    return issues
+
+
+class StorageQueryBenchmark:
+    """Seeds synthetic chat data and checks every storage path at several scales"""
+
+    def __init__(self, repeats: int = 5, seed: int = 7):
+        self.repeats = repeats
+        self.random = random.Random(seed)
+        self.storage = StorageManager(storage_type=ChatStorageType.DJANGO)
+
+    def _text(self, words: int) -> str:
+        return ' '.join(self.random.choice(WORDS) for _ in range(words))
+
+    def clear(self) -> None:
+        # Benchmark users are reused across scales, only the chat data is reset
+        MessagePair.objects.all().delete()
+        Conversation.objects.all().delete()
+
+    def seed(self, message_pairs: int) -> SeedData:
+        """Create users, conversations and message pairs totalling `message_pairs` pairs"""
+        User = get_user_model()
+        conversation_count = max(1, message_pairs // MESSAGES_PER_CONVERSATION)
+        user_count = max(2, conversation_count // CONVERSATIONS_PER_USER)
+
+        emails = [f'user{i}@benchmark.local' for i in range(user_count)]
+        User.objects.bulk_create([User(email=email, is_active=True) for email in emails], ignore_conflicts=True)
+        users_by_email = {user.email: user for user in User.objects.filter(email__in=emails)}
+        users = [users_by_email[email] for email in emails]
+        now = timezone.now()
+        conversations = Conversation.objects.bulk_create([
+            Conversation(user=users[i % user_count], title=self._text(3), last_message_at=now)
+            for i in range(conversation_count)
+        ], batch_size=SEED_BATCH_SIZE)
+
+        batch = []
+        for i in range(message_pairs):
+            conversation = conversations[i % conversation_count]
+            batch.append(MessagePair(
+                conversation=conversation,
+                user_message=self._text(12),
+                ai_message=self._text(60),
+                status='completed',
+            ))
+            conversation.message_count += 1
+            if len(batch) >= SEED_BATCH_SIZE:
+                MessagePair.objects.bulk_create(batch)
+                batch = []
+        MessagePair.objects.bulk_create(batch)
+        Conversation.objects.bulk_update(conversations, ['message_count'], batch_size=SEED_BATCH_SIZE)
+
+        search_backend = get_search_backend()
+        if search_backend:
+            search_backend.rebuild()
+        # Keep the planner statistics realistic for the seeded size
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        return SeedData(user_id=users[0].pk, conversation_id=conversations[0].conversation_id, message_pairs=message_pairs)
+
+    def cases(self, seed_data: SeedData) -> List[BenchmarkCase]:
+        storage, user_id, conversation_id = self.storage, seed_data.user_id, seed_data.conversation_id
+        client = Client()
+        client.force_login(get_user_model().objects.get(pk=user_id))
+
+        return [
+            # The SQLite search index takes two statements: the id row, then the contentless FTS row
+            BenchmarkCase('storage.save_message', lambda: async_to_sync(storage.save_message)(
+                conversation_id, MessageData(user_message=self._text(12), ai_message=self._text(60))), max_queries=5),
+            BenchmarkCase('storage.load_conversation(limit=1)',
+                          lambda: async_to_sync(storage.load_conversation)(conversation_id, 1), max_queries=2),
+            BenchmarkCase('storage.load_conversation',
+                          lambda: async_to_sync(storage.load_conversation)(conversation_id), max_queries=2),
+            BenchmarkCase('storage.get_conversation_state',
+                          lambda: async_to_sync(storage.get_conversation_state)(conversation_id), max_queries=1),
+            BenchmarkCase('storage.get_user_conversations',
+                          lambda: async_to_sync(storage.get_user_conversations)(user_id), max_queries=1),
+            BenchmarkCase('storage.search_messages',
+                          lambda: async_to_sync(storage.search_messages)(user_id, 'docker proxy'), max_queries=1,
+                          allow_sort=True),
+            BenchmarkCase('view.get_conversations',
+                          lambda: client.get(reverse('get_all_conversations', args=[conversation_id])), max_queries=4),
+            BenchmarkCase('view.get_conversation_history',
+                          lambda: client.get(reverse('conversation_history', args=[conversation_id])), max_queries=4),
+            BenchmarkCase('view.search_messages',
+                          lambda: client.get(reverse('search_messages'), {'q': 'docker proxy'}), max_queries=3,
+                          allow_sort=True),
+        ]
+
+    def run_case(self, case: BenchmarkCase, scale: int) -> CaseResult:
+        with CaptureQueriesContext(connection) as captured:
+            case.run()
+        queries = _executed_queries(captured)
+
+        result = CaseResult(name=case.name, scale=scale, queries=len(queries), latency_ms=0.0)
+        for sql in queries:
+            if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+                continue
+            plan = explain(sql)
+            result.plans[sql] = plan
+            result.issues.extend(plan_issues(plan, allow_sort=case.allow_sort))
+        if result.queries > case.max_queries:
+            result.issues.append(f"{result.queries} queries, budget is {case.max_queries}")
+
+        timings = []
+        for _ in range(self.repeats):
+            start_time = time.perf_counter()
+            case.run()
+            timings.append((time.perf_counter() - start_time) * 1000)
+        result.latency_ms = statistics.median(timings)
+        return result
+
+    def run(self, scales: List[int]) -> BenchmarkReport:
+        report = BenchmarkReport(scales=scales)
+        query_counts: Dict[str, Dict[int, int]] = {}
+
+        for scale in scales:
+            self.clear()
+            seed_data = self.seed(scale)
+            for case in self.cases(seed_data):
+                result = self.run_case(case, scale)
+                report.results.append(result)
+                query_counts.setdefault(case.name, {})[scale] = result.queries
+                report.failures.extend(f"{case.name} @ {scale}: {issue}" for issue in result.issues)
+        self.clear()
+
+        for name, counts in query_counts.items():
+            if len(set(counts.values())) > 1:
+                report.failures.append(f"{name}: query count grows with data size {counts}")
+        return report
+
+    @staticmethod
+    def format_report(report: BenchmarkReport) -> str:
+        """Latency table with one column per scale"""
+        names = list(dict.fromkeys(result.name for result in report.results))
+        header = f"{'case':40}" + ''.join(f"{scale:>12}" for scale in report.scales) + f"{'queries':>10}"
+        lines = [header, '-' * len(header)]
+        for name in names:
+            results = {result.scale: result for result in report.results if result.name == name}
+            latencies = ''.join(f"{results[scale].latency_ms:>10.2f}ms" for scale in report.scales)
+            lines.append(f"{name:40}{latencies}{results[report.scales[-1]].queries:>10}")
+        return '\n'.join(lines)
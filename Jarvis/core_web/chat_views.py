@@ -2,7 +2,7 @@ import json
 import logging
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_protect
 from asgiref.sync import sync_to_async
@@ -10,9 +10,11 @@ from django.conf import settings
 from core_web.models import Conversation
 from core_web.services.chat_service import ChatService
 from src.llm.llm_manager import GroqModelName
-from src.globals.configs import ModelProvider
+from src.globals.configs import ModelProvider, ChatStorageType
 from src.llm.utils import generate_chat_title
 from core_web.services.chat_service import get_chatbot_instance
+from src.storage.chat_storage import StorageManager
+from src.storage.conversation_transfer import iter_export_lines
 import traceback
 
 logger = logging.getLogger(__name__)
@@ -40,18 +42,18 @@ async def get_conversations(request, conversation_id):
     """
     API endpoint to get all conversations and the current conversation.
     """
-    # Accessing request.user in an async context requires sync_to_async
-    user = await sync_to_async(lambda: request.user, thread_sensitive=True)()
+    # The user was already loaded by login_required, auser() returns the cached instance
+    user = await request.auser()
 
-    # Fetch all conversations asynchronously
+    # Fetch all conversations asynchronously, most recently active first (served by the user/last_message_at index)
     conversations = await sync_to_async(
-        lambda: list(Conversation.objects.filter(user=user).order_by('-updated_at')),
+        lambda: list(Conversation.objects.filter(user=user).order_by('-last_message_at')),
         thread_sensitive=True
     )()
 
     # Fetch the current conversation asynchronously
     current_conversation = await sync_to_async(
-        lambda: Conversation.objects.filter(user=user, conversation_id=conversation_id).order_by('-updated_at').first(),
+        lambda: Conversation.objects.filter(user=user, conversation_id=conversation_id).first(),
         thread_sensitive=True
     )()
 
@@ -62,6 +64,8 @@ async def get_conversations(request, conversation_id):
                 'id': str(conv.conversation_id),
                 'title': conv.title,
                 'updated_at': conv.updated_at,
+                'last_message_at': conv.last_message_at,
+                'message_count': conv.message_count,
             } for conv in conversations
         ],
         'current_conversation': {
@@ -166,7 +170,8 @@ async def chat_api(request):
 
         if conversation.title == "New Chat":
             conversation.title = await generate_chat_title(user_message)
-            await conversation.asave()  # Changed to await
+            # Only write the title so the message counters updated by save_message are not overwritten
+            await conversation.asave(update_fields=['title', 'updated_at'])
 
         return JsonResponse({
             'status': 'success',
@@ -196,13 +201,9 @@ async def get_conversation_history(request, conversation_id):
     """Get the history of a specific conversation"""
     try:
 
-        # Retrieve or create chatbot instance
-        temperature = 0.0
-        model_provider = ModelProvider.GROQ
-        model_name = GroqModelName.LLAMA_3_3_70B
-        chatbot = await get_chatbot_instance(model_provider, model_name, temperature)
-
-        messages = await chatbot.storage.load_conversation(conversation_id)
+        # Reading history only needs the storage, not a chatbot (and its model client)
+        storage = StorageManager(storage_type=ChatStorageType.DJANGO)
+        messages = await storage.load_conversation(conversation_id)
         
         return JsonResponse({
             'status': 'success',
@@ -220,6 +221,15 @@ async def get_conversation_history(request, conversation_id):
         return JsonResponse({
             'error': f'Error fetching conversation history: {str(e)}'
         }, status=500)
-    
 
 
+@login_required
+@require_http_methods(["GET"])
+def export_conversations(request):
+    """Stream all conversations of the current user as NDJSON"""
+    response = StreamingHttpResponse(
+        iter_export_lines(user_ids=[request.user.id]),
+        content_type='application/x-ndjson'
+    )
+    response['Content-Disposition'] = 'attachment; filename="conversations.ndjson"'
+    return response
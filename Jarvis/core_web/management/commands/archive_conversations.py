@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from src.storage.conversation_archive import archive_idle_conversations, compress_existing_messages
+
+
+class Command(BaseCommand):
+    help = "Move idle conversations into compressed archive segments and optionally compress stored messages"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--idle-days', type=int, default=90, help="Archive conversations idle for longer than this")
+        parser.add_argument('--batch-size', type=int, default=100, help="Conversations (or message pairs) per write transaction")
+        parser.add_argument('--compress-existing', action='store_true', help="Also compress already stored large messages")
+
+    def handle(self, *args, **options):
+        if options['compress_existing']:
+            start_time = time.time()
+            compressed = compress_existing_messages(batch_size=options['batch_size'])
+            self.stdout.write(f"Compressed {compressed} message pairs in {time.time() - start_time:.2f}s")
+
+        start_time = time.time()
+        archived = archive_idle_conversations(idle_days=options['idle_days'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} conversations in {time.time() - start_time:.2f}s"))
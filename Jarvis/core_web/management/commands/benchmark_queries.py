@@ -0,0 +1,34 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from core_web.benchmarks import StorageQueryBenchmark
+
+
+class Command(BaseCommand):
+    help = "Run the ORM query-count and query-plan regression benchmarks on a throwaway test database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='1000,10000,100000', help="Comma separated message pair counts")
+        parser.add_argument('--repeats', type=int, default=5, help="Timed runs per case")
+        parser.add_argument('--output', help="Write the full report, including query plans, as JSON")
+
+    def handle(self, *args, **options):
+        scales = [int(scale) for scale in options['scales'].split(',')]
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            report = StorageQueryBenchmark(repeats=options['repeats']).run(scales)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(StorageQueryBenchmark.format_report(report))
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump(report.as_dict(), handle, indent=2, default=str)
+
+        if report.failures:
+            raise CommandError("Query regressions found:\n" + '\n'.join(report.failures))
+        self.stdout.write(self.style.SUCCESS("No query regressions"))
@@ -0,0 +1,38 @@
+import gzip
+import sys
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from src.storage.conversation_transfer import export_conversations
+
+
+class Command(BaseCommand):
+    help = "Stream conversations and their message pairs to an NDJSON file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='-', help="Output file, '-' for stdout. A .gz suffix enables gzip")
+        parser.add_argument('--gzip', action='store_true', help="Gzip the output")
+        parser.add_argument('--user', action='append', default=[], help="Only export conversations of this email (repeatable)")
+        parser.add_argument('--chunk-size', type=int, default=500, help="Conversations read per chunk")
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['user']:
+            User = get_user_model()
+            user_ids = list(User.objects.filter(email__in=options['user']).values_list('pk', flat=True))
+            if len(user_ids) != len(set(options['user'])):
+                raise CommandError("One or more users do not exist")
+
+        output = options['output']
+        use_gzip = options['gzip'] or output.endswith('.gz')
+        if output == '-':
+            stream = gzip.open(sys.stdout.buffer, 'wt', encoding='utf-8') if use_gzip else sys.stdout
+        else:
+            stream = gzip.open(output, 'wt', encoding='utf-8') if use_gzip else open(output, 'w', encoding='utf-8')
+
+        try:
+            stats = export_conversations(stream, user_ids=user_ids, chunk_size=options['chunk_size'])
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+        self.stderr.write(self.style.SUCCESS(f"Exported {stats}"))
@@ -0,0 +1,39 @@
+import gzip
+import sys
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from src.storage.conversation_transfer import import_conversations
+
+
+class Command(BaseCommand):
+    help = "Stream an NDJSON conversation export into the database with batched inserts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="Export file, '-' for stdin. A .gz suffix enables gzip")
+        parser.add_argument('--gzip', action='store_true', help="The input is gzipped")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows per bulk_create batch")
+        parser.add_argument('--user', help="Import every conversation for this email instead of matching by email")
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            User = get_user_model()
+            try:
+                user = User.objects.get(email=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']} does not exist")
+
+        source = options['input']
+        use_gzip = options['gzip'] or source.endswith('.gz')
+        if source == '-':
+            stream = gzip.open(sys.stdin.buffer, 'rt', encoding='utf-8') if use_gzip else sys.stdin
+        else:
+            stream = gzip.open(source, 'rt', encoding='utf-8') if use_gzip else open(source, encoding='utf-8')
+
+        try:
+            stats = import_conversations(stream, batch_size=options['batch_size'], user=user)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        self.stdout.write(self.style.SUCCESS(f"Imported {stats}"))
@@ -0,0 +1,19 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from src.storage.chat_search import REBUILD_BATCH_SIZE, get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index from the decoded message text, archived conversations included"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=REBUILD_BATCH_SIZE, help="Message pairs decoded and indexed per batch")
+
+    def handle(self, *args, **options):
+        search_backend = get_search_backend()
+        if search_backend is None:
+            raise CommandError("Full-text search is not supported on this database")
+
+        start_time = time.time()
+        indexed = search_backend.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} message pairs in {time.time() - start_time:.2f}s"))
@@ -0,0 +1,61 @@
+# Full-text search index over MessagePair (FTS5 on SQLite, tsvector + GIN on PostgreSQL)
+
+from django.db import migrations
+
+
+SQLITE_FORWARD = [
+    'CREATE VIRTUAL TABLE "MessagePairSearch" USING fts5('
+    "user_message, ai_message, owner, conversation_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')",
+    # Rank on message text only, the owner token is used for scoping
+    "INSERT INTO \"MessagePairSearch\" (\"MessagePairSearch\", rank) VALUES ('rank', 'bm25(1.0, 1.0, 0.0, 0.0)')",
+    'CREATE TRIGGER "MessagePairSearch_ad" AFTER DELETE ON "MessagePair" BEGIN '
+    'DELETE FROM "MessagePairSearch" WHERE rowid = old.message_pair_id; END',
+    'INSERT INTO "MessagePairSearch" (rowid, user_message, ai_message, owner, conversation_id) '
+    "SELECT m.message_pair_id, m.user_message, m.ai_message, 'u' || c.user_id, m.conversation_id "
+    'FROM "MessagePair" m JOIN "conversations" c ON c.conversation_id = m.conversation_id',
+]
+
+SQLITE_REVERSE = [
+    'DROP TRIGGER IF EXISTS "MessagePairSearch_ad"',
+    'DROP TABLE IF EXISTS "MessagePairSearch"',
+]
+
+POSTGRES_FORWARD = [
+    'CREATE TABLE "MessagePairSearch" ('
+    'message_pair_id bigint PRIMARY KEY REFERENCES "MessagePair" (message_pair_id) ON DELETE CASCADE, '
+    'user_id bigint NOT NULL, user_message text NOT NULL, ai_message text NOT NULL, document tsvector NOT NULL)',
+    'CREATE INDEX "MessagePairSearch_document_idx" ON "MessagePairSearch" USING GIN (document)',
+    'CREATE INDEX "MessagePairSearch_user_idx" ON "MessagePairSearch" (user_id)',
+    'INSERT INTO "MessagePairSearch" (message_pair_id, user_id, user_message, ai_message, document) '
+    'SELECT m.message_pair_id, c.user_id, m.user_message, m.ai_message, '
+    "setweight(to_tsvector('english', m.user_message), 'A') || to_tsvector('english', m.ai_message) "
+    'FROM "MessagePair" m JOIN "conversations" c ON c.conversation_id = m.conversation_id',
+]
+
+POSTGRES_REVERSE = [
+    'DROP TABLE IF EXISTS "MessagePairSearch"',
+]
+
+
+def _run(schema_editor, statements_by_vendor):
+    for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    _run(schema_editor, {'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD})
+
+
+def drop_search_index(apps, schema_editor):
+    _run(schema_editor, {'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRES_REVERSE})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core_web", "0002_remove_messagepair_id_messagepair_message_pair_id_and_more"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
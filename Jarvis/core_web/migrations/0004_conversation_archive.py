@@ -0,0 +1,33 @@
+# Generated by Django 5.1.5 on 2026-10-19 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core_web", "0003_message_pair_search"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="archived_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="archive_segment",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="archive_offset",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="archive_length",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
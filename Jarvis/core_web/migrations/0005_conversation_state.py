@@ -0,0 +1,86 @@
+# Generated by Django 5.1.5 on 2026-10-19 11:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+BACKFILL_BATCH_SIZE = 500
+
+
+def _token_count(tokens_used):
+    if not tokens_used:
+        return 0
+    if 'total_tokens' in tokens_used:
+        return int(tokens_used['total_tokens'] or 0)
+    return int(tokens_used.get('input_tokens') or 0) + int(tokens_used.get('output_tokens') or 0)
+
+
+def backfill_conversation_state(apps, schema_editor):
+    Conversation = apps.get_model('core_web', 'Conversation')
+    MessagePair = apps.get_model('core_web', 'MessagePair')
+
+    pending = []
+    current = None
+    pairs = (
+        MessagePair.objects
+        .order_by('conversation_id', 'message_pair_id')
+        .values('conversation_id', 'summary', 'created_at', 'tokens_used')
+        .iterator(chunk_size=2000)
+    )
+    for pair in pairs:
+        if current is None or current.conversation_id != pair['conversation_id']:
+            current = Conversation(conversation_id=pair['conversation_id'], message_count=0, token_total=0)
+            pending.append(current)
+        current.message_count += 1
+        current.token_total += _token_count(pair['tokens_used'])
+        current.latest_summary = pair['summary']
+        current.last_message_at = pair['created_at']
+
+        if len(pending) > BACKFILL_BATCH_SIZE:
+            Conversation.objects.bulk_update(
+                pending[:-1], ['message_count', 'token_total', 'latest_summary', 'last_message_at']
+            )
+            pending = pending[-1:]
+
+    Conversation.objects.bulk_update(pending, ['message_count', 'token_total', 'latest_summary', 'last_message_at'])
+    # Conversations without messages: last activity is their creation
+    Conversation.objects.filter(message_count=0).update(last_message_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core_web", "0004_conversation_archive"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="latest_summary",
+            field=models.TextField(
+                blank=True, help_text="Summary carried by the latest message pair", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="message_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="last_message_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="token_total",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="conversation",
+            index=models.Index(
+                fields=["user", "-last_message_at"], name="conversatio_user_id_22c68a_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_conversation_state, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,79 @@
+# Keep no copy of the message text in the full-text index: a contentless FTS5 table plus a
+# side table of indexed ids on SQLite, the tsvector only on PostgreSQL.
+#
+# The backfill indexes the pairs stored as plain text. Compressed pairs (prefixed with
+# "\x02c:") and archived conversations can only be decoded by the application: run
+# `manage.py rebuild_message_search` after migrating to index them too.
+
+from django.db import migrations
+
+
+SQLITE_FORWARD = [
+    'DROP TRIGGER IF EXISTS "MessagePairSearch_ad"',
+    'DROP TABLE IF EXISTS "MessagePairSearch"',
+    'CREATE TABLE "MessagePairSearch" ('
+    'message_pair_id integer NOT NULL PRIMARY KEY, '
+    'conversation_id integer NOT NULL REFERENCES "conversations" (conversation_id) ON DELETE CASCADE)',
+    'CREATE INDEX "MessagePairSearch_conversation_idx" ON "MessagePairSearch" (conversation_id)',
+    'CREATE VIRTUAL TABLE "MessagePairSearchIndex" USING fts5('
+    "user_message, ai_message, owner, content = '', tokenize = 'unicode61 remove_diacritics 2')",
+    # Rank on message text only, the owner token is used for scoping
+    "INSERT INTO \"MessagePairSearchIndex\" (\"MessagePairSearchIndex\", rank) VALUES ('rank', 'bm25(1.0, 1.0, 0.0)')",
+    'INSERT INTO "MessagePairSearch" (message_pair_id, conversation_id) '
+    'SELECT message_pair_id, conversation_id FROM "MessagePair" '
+    "WHERE substr(user_message, 1, 3) <> char(2) || 'c:' AND substr(ai_message, 1, 3) <> char(2) || 'c:'",
+    'INSERT INTO "MessagePairSearchIndex" (rowid, user_message, ai_message, owner) '
+    "SELECT m.message_pair_id, m.user_message, m.ai_message, 'u' || c.user_id "
+    'FROM "MessagePairSearch" s JOIN "MessagePair" m ON m.message_pair_id = s.message_pair_id '
+    'JOIN "conversations" c ON c.conversation_id = m.conversation_id',
+]
+
+SQLITE_REVERSE = [
+    'DROP TABLE IF EXISTS "MessagePairSearchIndex"',
+    'DROP TABLE IF EXISTS "MessagePairSearch"',
+]
+
+POSTGRES_FORWARD = [
+    'DROP TABLE IF EXISTS "MessagePairSearch"',
+    'CREATE TABLE "MessagePairSearch" ('
+    'message_pair_id bigint PRIMARY KEY, user_id bigint NOT NULL, '
+    'conversation_id bigint NOT NULL REFERENCES "conversations" (conversation_id) ON DELETE CASCADE, '
+    'document tsvector NOT NULL)',
+    'CREATE INDEX "MessagePairSearch_document_idx" ON "MessagePairSearch" USING GIN (document)',
+    'CREATE INDEX "MessagePairSearch_user_idx" ON "MessagePairSearch" (user_id)',
+    'CREATE INDEX "MessagePairSearch_conversation_idx" ON "MessagePairSearch" (conversation_id)',
+    'INSERT INTO "MessagePairSearch" (message_pair_id, user_id, conversation_id, document) '
+    'SELECT m.message_pair_id, c.user_id, m.conversation_id, '
+    "setweight(to_tsvector('english', m.user_message), 'A') || to_tsvector('english', m.ai_message) "
+    'FROM "MessagePair" m JOIN "conversations" c ON c.conversation_id = m.conversation_id '
+    "WHERE left(m.user_message, 3) <> chr(2) || 'c:' AND left(m.ai_message, 3) <> chr(2) || 'c:'",
+]
+
+POSTGRES_REVERSE = [
+    'DROP TABLE IF EXISTS "MessagePairSearch"',
+]
+
+
+def _run(schema_editor, statements_by_vendor):
+    for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def create_contentless_index(apps, schema_editor):
+    _run(schema_editor, {'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD})
+
+
+def drop_contentless_index(apps, schema_editor):
+    # The index is not rebuilt with text copied from the stored rows, which may be compressed
+    _run(schema_editor, {'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRES_REVERSE})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core_web", "0005_conversation_state"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_contentless_index, drop_contentless_index),
+    ]
@@ -16,6 +16,18 @@ class Conversation(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='conversations')
     title = models.CharField(max_length=255, blank=True)
 
+    # cold-tier archive location, set while the message pairs live in a segment file
+    archived_at = models.DateTimeField(null=True, blank=True)
+    archive_segment = models.CharField(max_length=255, blank=True)
+    archive_offset = models.BigIntegerField(null=True, blank=True)
+    archive_length = models.IntegerField(null=True, blank=True)
+
+    # denormalized conversation state, updated in the same transaction as each saved message pair
+    latest_summary = models.TextField(null=True, blank=True, help_text="Summary carried by the latest message pair")
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_at = models.DateTimeField(default=timezone.now)
+    token_total = models.BigIntegerField(default=0)
+
     # metadata
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
@@ -23,7 +35,8 @@ class Conversation(models.Model):
     class Meta:
         db_table = 'conversations'
         indexes = [
-            models.Index(fields=['user', 'conversation_id'])
+            models.Index(fields=['user', 'conversation_id']),
+            models.Index(fields=['user', '-last_message_at']),
         ]
         ordering = ['-updated_at']
 
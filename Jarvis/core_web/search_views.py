@@ -1,7 +1,68 @@
+import logging
+import traceback
+from dataclasses import asdict
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+from django.views.decorators.http import require_http_methods
+from src.globals.configs import ChatStorageType
+from src.storage.chat_storage import StorageManager
+
+logger = logging.getLogger(__name__)
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 50
+
+
+def _parse_positive_int(value, default: int, maximum: int = None) -> int:
+    """Parse a positive integer query parameter, falling back to the default"""
+    try:
+        parsed = int(value)
+    except (TypeError, ValueError):
+        return default
+    if parsed < 1:
+        return default
+    return min(parsed, maximum) if maximum else parsed
+
+
+async def _search_history(request):
+    """Run the full-text search described by the request query parameters"""
+    # The user was already loaded by login_required, auser() returns the cached instance
+    user_id = (await request.auser()).id
+    query = request.GET.get('q', '').strip()
+    page = _parse_positive_int(request.GET.get('page'), 1)
+    page_size = _parse_positive_int(request.GET.get('page_size'), SEARCH_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE)
+
+    storage = StorageManager(storage_type=ChatStorageType.DJANGO)
+    return await storage.search_messages(user_id, query, page, page_size)
+
 
 # Search with LLM
 @login_required
-def search_with_llm_view(request):
-    return render(request, 'search_with_llm.html')
+async def search_with_llm_view(request):
+    search_page = await _search_history(request) if request.GET.get('q') else None
+    return render(request, 'search_with_llm.html', {'search_page': search_page})
+
+
+@login_required
+@require_http_methods(["GET"])
+async def search_messages_api(request):
+    """
+    API endpoint for ranked, paginated full-text search over the user's conversations.
+
+    Query parameters:
+        q: search text
+        page: 1-based page number (default 1)
+        page_size: results per page (default 20, max 50)
+    """
+    try:
+        search_page = await _search_history(request)
+        return JsonResponse({
+            'status': 'success',
+            **asdict(search_page),
+        })
+    except Exception as e:
+        logger.error(f"Error searching conversation history: {str(e)}\n{traceback.format_exc()}")
+        return JsonResponse({
+            'error': f'Error searching conversation history: {str(e)}'
+        }, status=500)
@@ -1,3 +1,211 @@
+import io
+import tempfile
+from datetime import timedelta
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from asgiref.sync import sync_to_async
+from core_web.benchmarks import StorageQueryBenchmark
+from core_web.models import Conversation, MessagePair
+from src.storage.chat_search import get_search_backend
+from src.storage.chat_storage import DjangoStorage, MessageData
+from src.storage.conversation_archive import ConversationArchive, archive_idle_conversations
+from src.storage.conversation_transfer import export_conversations, import_conversations
+from src.storage.message_codec import MessageCodec
 
 # Create your tests here.
+
+User = get_user_model()
+
+
+class MessageSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='search@example.com', password='secret', is_active=True)
+        self.other_user = User.objects.create_user(email='other@example.com', password='secret', is_active=True)
+        self.conversation = Conversation.objects.create(user=self.user, title='Deploy notes')
+        self.other_conversation = Conversation.objects.create(user=self.other_user, title='Other')
+        self.storage = DjangoStorage()
+
+    async def test_search_is_ranked_highlighted_and_scoped_to_user(self):
+        await self.storage.save_message(self.conversation.conversation_id, MessageData(
+            user_message='Why does the build fail with ERR_SSL_PROTOCOL?',
+            ai_message='The proxy rewrites TLS, so <script> tags are not the issue.'))
+        await self.storage.save_message(self.conversation.conversation_id, MessageData(
+            user_message='What is a good pasta recipe?', ai_message='Try carbonara.'))
+        await self.storage.save_message(self.other_conversation.conversation_id, MessageData(
+            user_message='ERR_SSL_PROTOCOL again', ai_message='Check the proxy.'))
+
+        search_page = await self.storage.search_messages(self.user.id, 'err_ssl_protocol proxy')
+
+        self.assertEqual(len(search_page.results), 1)
+        hit = search_page.results[0]
+        self.assertEqual(hit.conversation_id, self.conversation.conversation_id)
+        self.assertIn('<mark>ERR_SSL_PROTOCOL</mark>', hit.user_snippet)
+        self.assertIn('&lt;script&gt;', hit.ai_snippet)
+
+    async def test_search_paginates_and_follows_deletes(self):
+        for i in range(3):
+            await self.storage.save_message(self.conversation.conversation_id, MessageData(
+                user_message=f'kubernetes question {i}', ai_message='answer'))
+
+        first_page = await self.storage.search_messages(self.user.id, 'kubern', page=1, page_size=2)
+        second_page = await self.storage.search_messages(self.user.id, 'kubern', page=2, page_size=2)
+        self.assertEqual(len(first_page.results), 2)
+        self.assertTrue(first_page.has_next)
+        self.assertEqual(len(second_page.results), 1)
+        self.assertFalse(second_page.has_next)
+
+        await self.conversation.adelete()
+        self.assertEqual((await self.storage.search_messages(self.user.id, 'kubernetes')).results, [])
+
+    async def test_index_keeps_no_copy_of_the_message_text(self):
+        await self.storage.save_message(self.conversation.conversation_id, MessageData(
+            user_message='where are the deploy keys?', ai_message='In the vault, under ops/deploy.'))
+
+        def indexed_text():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT user_message, ai_message FROM "MessagePairSearchIndex"')
+                return cursor.fetchall()
+
+        self.assertEqual(await sync_to_async(indexed_text)(), [(None, None)])
+        hit = (await self.storage.search_messages(self.user.id, 'vault')).results[0]
+        self.assertEqual(hit.ai_snippet, 'In the <mark>vault</mark>, under ops/deploy.')
+
+
+class ConversationStateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='state@example.com', password='secret', is_active=True)
+        self.conversation = Conversation.objects.create(user=self.user, title='Counters')
+        self.storage = DjangoStorage()
+
+    async def test_save_message_updates_conversation_state(self):
+        await self.storage.save_message(self.conversation.conversation_id, MessageData(
+            user_message='hi', ai_message='hello', tokens_used={'total_tokens': 12}))
+        await self.storage.save_message(self.conversation.conversation_id, MessageData(
+            user_message='more', ai_message='sure', summary='greetings', tokens_used={'input_tokens': 3, 'output_tokens': 4}))
+
+        state = await self.storage.get_conversation_state(self.conversation.conversation_id)
+        latest = await MessagePair.objects.filter(conversation=self.conversation).alatest('message_pair_id')
+        self.assertEqual(state.message_count, 2)
+        self.assertEqual(state.token_total, 19)
+        self.assertEqual(state.latest_summary, 'greetings')
+        self.assertEqual(state.last_message_at, latest.created_at)
+
+        conversations = await self.storage.get_user_conversations(self.user.id)
+        self.assertEqual([(c['id'], c['message_count']) for c in conversations],
+                         [(str(self.conversation.conversation_id), 2)])
+
+
+class MessageArchiveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='archive@example.com', password='secret', is_active=True)
+        self.conversation = Conversation.objects.create(user=self.user, title='Long answers')
+        self.storage = DjangoStorage()
+        self.archive = ConversationArchive(archive_dir=tempfile.mkdtemp())
+
+    def test_codec_round_trip(self):
+        codec = MessageCodec(threshold=64)
+        long_text = 'I hope this helps! ' * 200
+        encoded = codec.encode(long_text)
+        self.assertTrue(MessageCodec.is_compressed(encoded))
+        self.assertLess(len(encoded), len(long_text) / 4)
+        self.assertEqual(codec.decode(encoded), long_text)
+        self.assertEqual(codec.encode('short'), 'short')
+        # Raw text that looks like a compressed payload is escaped
+        tricky = '\x02c:z1:not really'
+        self.assertEqual(codec.decode(codec.encode(tricky)), tricky)
+
+    async def test_idle_conversation_is_archived_and_rehydrated_on_access(self):
+        long_answer = 'The difference between the two approaches is subtle. ' * 100
+        await self.storage.save_message(self.conversation.conversation_id, MessageData(
+            user_message='compare approaches', ai_message=long_answer, summary='comparison'))
+        stored = await MessagePair.objects.aget(conversation=self.conversation)
+        self.assertTrue(MessageCodec.is_compressed(stored.ai_message))
+
+        old = timezone.now() - timedelta(days=120)
+        await Conversation.objects.filter(pk=self.conversation.pk).aupdate(last_message_at=old)
+
+        archived = await sync_to_async(archive_idle_conversations)(idle_days=90, archive=self.archive)
+        self.assertEqual(archived, 1)
+        self.assertFalse(await MessagePair.objects.filter(conversation=self.conversation).aexists())
+
+        with self.settings(CONVERSATION_ARCHIVE_DIR=self.archive.archive_dir):
+            messages = await self.storage.load_conversation(self.conversation.conversation_id)
+        self.assertEqual([(m.user_message, m.ai_message, m.summary) for m in messages],
+                         [('compare approaches', long_answer, 'comparison')])
+        conversation = await Conversation.objects.aget(pk=self.conversation.pk)
+        self.assertIsNone(conversation.archived_at)
+        self.assertEqual(len((await self.storage.search_messages(self.user.id, 'approaches')).results), 1)
+
+    async def test_rebuild_indexes_decoded_text(self):
+        long_answer = 'Rotate the signing keys before the release. ' * 40 + 'Finally restart nginx.'
+        await self.storage.save_message(self.conversation.conversation_id, MessageData(
+            user_message='release checklist', ai_message=long_answer))
+        stored = await MessagePair.objects.aget(conversation=self.conversation)
+        self.assertTrue(MessageCodec.is_compressed(stored.ai_message))
+
+        output = io.StringIO()
+        await sync_to_async(call_command)('rebuild_message_search', stdout=output)
+        self.assertIn('Indexed 1 message pairs', output.getvalue())
+        hits = (await self.storage.search_messages(self.user.id, 'nginx')).results
+        self.assertEqual(len(hits), 1)
+        self.assertIn('<mark>nginx</mark>', hits[0].ai_snippet)
+
+    async def test_archived_conversation_stays_searchable(self):
+        await self.storage.save_message(self.conversation.conversation_id, MessageData(
+            user_message='how do I tune postgres autovacuum?', ai_message='Lower the scale factor. ' * 60))
+        old = timezone.now() - timedelta(days=120)
+        await Conversation.objects.filter(pk=self.conversation.pk).aupdate(last_message_at=old)
+        await sync_to_async(archive_idle_conversations)(idle_days=90, archive=self.archive)
+
+        with self.settings(CONVERSATION_ARCHIVE_DIR=self.archive.archive_dir):
+            for rebuild in (False, True):
+                if rebuild:
+                    self.assertEqual(await sync_to_async(get_search_backend().rebuild)(), 1)
+                hits = (await self.storage.search_messages(self.user.id, 'autovacuum')).results
+                self.assertEqual(len(hits), 1)
+                self.assertTrue(hits[0].archived)
+                self.assertEqual(hits[0].conversation_title, 'Long answers')
+                self.assertIn('<mark>autovacuum</mark>', hits[0].user_snippet)
+                self.assertIsNotNone(hits[0].created_at)
+
+            await self.storage.load_conversation(self.conversation.conversation_id)
+        hits = (await self.storage.search_messages(self.user.id, 'autovacuum')).results
+        self.assertEqual([hit.archived for hit in hits], [False])
+
+
+class ConversationTransferTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='export@example.com', password='secret', is_active=True)
+        self.target = User.objects.create_user(email='import@example.com', password='secret', is_active=True)
+        self.storage = DjangoStorage()
+
+    async def test_export_then_import_round_trip(self):
+        for title in ('first', 'second'):
+            conversation = await Conversation.objects.acreate(user=self.user, title=title)
+            for i in range(3):
+                await self.storage.save_message(conversation.conversation_id, MessageData(
+                    user_message=f'{title} question {i}', ai_message='answer ' * 400, tokens_used={'total_tokens': 2}))
+
+        stream = io.StringIO()
+        export_stats = await sync_to_async(export_conversations)(stream, user_ids=[self.user.id], chunk_size=1)
+        self.assertEqual((export_stats.conversations, export_stats.message_pairs), (2, 6))
+
+        stream.seek(0)
+        import_stats = await sync_to_async(import_conversations)(stream, batch_size=2, user=self.target)
+        self.assertEqual((import_stats.conversations, import_stats.message_pairs), (2, 6))
+
+        imported = [conversation async for conversation in Conversation.objects.filter(user=self.target).order_by('title')]
+        self.assertEqual([(c.title, c.message_count, c.token_total) for c in imported], [('first', 3, 6), ('second', 3, 6)])
+        messages = await self.storage.load_conversation(imported[1].conversation_id)
+        self.assertEqual([m.user_message for m in messages], [f'second question {i}' for i in range(3)])
+        self.assertEqual(messages[0].ai_message, 'answer ' * 400)
+        self.assertEqual(len((await self.storage.search_messages(self.target.id, 'second question')).results), 3)
+
+
+class QueryRegressionTests(TestCase):
+    def test_storage_and_views_are_indexed_and_scale_free(self):
+        report = StorageQueryBenchmark(repeats=1).run([50, 500])
+        self.assertEqual(report.failures, [])
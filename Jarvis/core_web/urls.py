@@ -16,6 +16,7 @@ urlpatterns += [
 
     # APIs
     path('api/chat/new/', chat_views.create_new_chat, name='new_chat'),
+    path('api/conversations/export/', chat_views.export_conversations, name='export_conversations'),
     path('api/chat/', chat_views.chat_api, name='chat_api'),
     path('api/conversations/<str:conversation_id>/', chat_views.get_conversations, name='get_all_conversations'),
     path('api/conversation/<str:conversation_id>/', chat_views.get_conversation_history, name='conversation_history'),
@@ -27,4 +28,7 @@ urlpatterns += [
 
     # views
     path('search/', search_views.search_with_llm_view, name='search_with_llm'),
+
+    # APIs
+    path('api/search/messages/', search_views.search_messages_api, name='search_messages'),
 ]
\ No newline at end of file
@@ -39,21 +39,23 @@ class ChatBotWorkflowBuilder:
         thread_id = state.get("thread_id")
         logger.info(f"Processing thread ID: {thread_id}")
             
-        # Fetch messages from storage
+        # Fetch the conversation state and the latest exchange from storage
         existing_messages = []
-        summary = ""
-        thread_history = await self.storage.load_conversation(thread_id, limit=1)
+        conversation_state = await self.storage.get_conversation_state(thread_id)
+        summary = conversation_state.latest_summary or "" if conversation_state else ""
+        if summary:
+            logger.debug(f"Retrieved summary: {summary}")
+
+        thread_history = []
+        if conversation_state and conversation_state.message_count:
+            thread_history = await self.storage.load_conversation(thread_id, limit=1)
         logger.info(f"Retrieved {len(thread_history)} messages from storage")
 
-        if thread_history:
-            for msg_pair in thread_history:
-                if msg_pair.user_message:
-                    existing_messages.append(HumanMessage(content=msg_pair.user_message))
-                if msg_pair.ai_message:
-                    existing_messages.append(AIMessage(content=msg_pair.ai_message))
-                if msg_pair.summary:
-                    summary = msg_pair.summary
-                    logger.debug(f"Retrieved summary: {summary}")
+        for msg_pair in thread_history:
+            if msg_pair.user_message:
+                existing_messages.append(HumanMessage(content=msg_pair.user_message))
+            if msg_pair.ai_message:
+                existing_messages.append(AIMessage(content=msg_pair.ai_message))
 
         # Update state with messages
         delete_messages = [RemoveMessage(id=m.id) for m in state["messages"]] \
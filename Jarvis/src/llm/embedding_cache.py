@@ -0,0 +1,212 @@
+"""
+Content-addressed embedding cache.
+
+Embeddings are keyed by sha256 of the model name and the normalized text, so re-ingesting
+a page or a PDF only pays the provider for chunks that changed. Lookups go through an
+in-memory LRU first and a SQLite file second; a bulk call sends all of its misses to the
+wrapped generator in a single request and stores the results in both tiers.
+"""
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from src.llm.llm_embeddings import EmbeddingsGenerator
+
+
+DEFAULT_MAX_ENTRIES = 10000
+# Keys per SELECT, below SQLite's bound parameter limit
+LOOKUP_CHUNK = 500
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize text before hashing: Unicode NFC and collapsed whitespace, so the same chunk
+    extracted twice with different line breaks or spacing maps to the same key.
+    """
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def embedding_key(model_name: str, text: str) -> str:
+    """
+    Cache key of a text embedded by a model.
+
+    :param model_name: The name of the embedding model.
+    :param text: The input text, normalized before hashing.
+    :return: The hex sha256 digest.
+    """
+    return hashlib.sha256(f"{model_name}\x00{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+
+@dataclass
+class EmbeddingCacheStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    # Requests sent to the wrapped generator
+    provider_calls: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+
+
+class EmbeddingStore:
+    """
+    SQLite table of float32 embedding blobs keyed by embedding_key().
+    """
+
+    def __init__(self, path: str):
+        """
+        Open (and create) the store.
+
+        :param path: The SQLite database file.
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS embeddings ('
+            'key TEXT PRIMARY KEY, model TEXT NOT NULL, dimension INTEGER NOT NULL, vector BLOB NOT NULL)'
+        )
+        self.connection.commit()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        """
+        Fetch stored embeddings.
+
+        :param keys: The keys to look up.
+        :return: A dict of the keys found to their embedding.
+        """
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), LOOKUP_CHUNK):
+                chunk = list(keys[start:start + LOOKUP_CHUNK])
+                rows = self.connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                )
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, model_name: str, items: Dict[str, np.ndarray]) -> None:
+        """
+        Store embeddings in one transaction.
+
+        :param model_name: The name of the embedding model, kept for inspection and cleanup.
+        :param items: A dict of keys to embeddings.
+        """
+        with self._lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO embeddings (key, model, dimension, vector) VALUES (?, ?, ?, ?)',
+                [(key, model_name, len(vector), np.asarray(vector, dtype=np.float32).tobytes())
+                 for key, vector in items.items()],
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.connection.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class CachedEmbeddingsGenerator(EmbeddingsGenerator):
+    """
+    Embeddings generator that answers repeated texts from an LRU and a SQLite store and only
+    sends the misses to the wrapped generator.
+    """
+
+    def __init__(self, generator: EmbeddingsGenerator, model_name: str, path: Optional[str] = None,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        """
+        Wrap a generator.
+
+        :param generator: The generator computing embeddings on a miss.
+        :param model_name: The name of the embedding model, part of every key.
+        :param path: The SQLite file of the persistent tier; None keeps the cache in memory only.
+        :param max_entries: The number of embeddings kept in the in-memory LRU.
+        """
+        self.generator = generator
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.store = EmbeddingStore(path) if path else None
+        self.entries: 'OrderedDict[str, np.ndarray]' = OrderedDict()
+        self.stats = EmbeddingCacheStats()
+        self._lock = threading.Lock()
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        with self._lock:
+            self.entries[key] = vector
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def _recall(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self.entries.get(key)
+            if vector is not None:
+                self.entries.move_to_end(key)
+            return vector
+
+    def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        Generate embeddings for a list of input texts, reusing cached ones.
+
+        :param texts: A list of input strings to generate embeddings for.
+        :return: A list of embeddings, where each embedding is a list of floats.
+        """
+        return self.embed(texts).tolist()
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Generate embeddings as a float32 matrix, reusing cached ones.
+
+        :param texts: A list of input strings to generate embeddings for.
+        :return: An array of shape (len(texts), dimension).
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        keys = [embedding_key(self.model_name, text) for text in texts]
+        vectors: Dict[str, np.ndarray] = {}
+        for key in dict.fromkeys(keys):
+            vector = self._recall(key)
+            if vector is not None:
+                vectors[key] = vector
+        self.stats.memory_hits += len(vectors)
+
+        missing = [key for key in dict.fromkeys(keys) if key not in vectors]
+        if missing and self.store is not None:
+            stored = self.store.get_many(missing)
+            for key, vector in stored.items():
+                vectors[key] = vector
+                self._remember(key, vector)
+            self.stats.disk_hits += len(stored)
+            missing = [key for key in missing if key not in stored]
+
+        if missing:
+            # One provider request for the distinct missing texts
+            first_text = {}
+            for key, text in zip(keys, texts):
+                first_text.setdefault(key, text)
+            embeddings = self.generator.embed([first_text[key] for key in missing])
+            self.stats.provider_calls += 1
+            self.stats.misses += len(missing)
+            # Copies, so the cached rows do not keep the whole batch alive
+            computed = {key: embedding.copy() for key, embedding in zip(missing, embeddings)}
+            for key, vector in computed.items():
+                vectors[key] = vector
+                self._remember(key, vector)
+            if self.store is not None:
+                self.store.put_many(self.model_name, computed)
+        return np.stack([vectors[key] for key in keys])
+
+    def close(self) -> None:
+        if self.store is not None:
+            self.store.close()
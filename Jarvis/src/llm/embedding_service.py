@@ -0,0 +1,248 @@
+"""
+Async micro-batching front for an EmbeddingsGenerator.
+
+`EmbeddingsGenerator.generate_embeddings` is blocking and every caller sends its own
+request. EmbeddingService queues texts from any number of coroutines, packs them into
+provider-sized batches and runs up to `max_concurrency` batches at a time in worker
+threads, handing each caller back its own embeddings.
+
+Two lanes feed the batches: INTERACTIVE (query embeddings a user is waiting on) is always
+drained before BULK (ingestion). A batch is sent once it is full, once `batch_window`
+seconds passed since it started filling, or right away when an interactive request is
+queued. Large requests are split across batches.
+
+Batches are computed with `generator.embed`, as float32 matrices; `embed_array` hands
+callers one contiguous matrix and `embed` converts it to lists.
+
+`stats` reports the batch fill ratio and the queue latency of each lane.
+"""
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Deque, Dict, List, Optional, Tuple
+import numpy as np
+from src.llm.llm_embeddings import EmbeddingsGenerator
+
+
+DEFAULT_MAX_BATCH_SIZE = 100
+DEFAULT_BATCH_WINDOW = 0.01
+DEFAULT_MAX_CONCURRENCY = 4
+# Queue latencies kept per lane for the percentiles
+LATENCY_SAMPLES = 1000
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BULK = 1
+
+
+@dataclass
+class EmbeddingRequest:
+    texts: List[str]
+    priority: Priority
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.perf_counter)
+    # Row views of the batch matrices, stacked once the request is complete
+    results: List[Optional[np.ndarray]] = field(default_factory=list)
+    # Texts handed to batches so far, and texts embedded
+    dispatched: int = 0
+    completed: int = 0
+
+    def __post_init__(self):
+        self.results = [None] * len(self.texts)
+
+
+@dataclass
+class EmbeddingServiceStats:
+    batches: int = 0
+    texts: int = 0
+    failed_batches: int = 0
+    max_batch_size: int = DEFAULT_MAX_BATCH_SIZE
+    # Lane -> seconds between enqueueing a request and sending its first text
+    queue_latencies: Dict[Priority, Deque[float]] = field(
+        default_factory=lambda: {priority: deque(maxlen=LATENCY_SAMPLES) for priority in Priority})
+
+    @property
+    def fill_ratio(self) -> float:
+        '''Average share of max_batch_size used by the batches sent'''
+        return self.texts / (self.batches * self.max_batch_size) if self.batches else 0.0
+
+    def queue_latency_ms(self, priority: Priority, percentile: float = 50) -> float:
+        samples = self.queue_latencies[priority]
+        return float(np.percentile(samples, percentile)) * 1000 if samples else 0.0
+
+    def summary(self) -> Dict[str, float]:
+        report = {'batches': self.batches, 'texts': self.texts, 'failed_batches': self.failed_batches,
+                  'fill_ratio': self.fill_ratio}
+        for priority in Priority:
+            name = priority.name.lower()
+            report[f'{name}_queue_p50_ms'] = self.queue_latency_ms(priority, 50)
+            report[f'{name}_queue_p95_ms'] = self.queue_latency_ms(priority, 95)
+        return report
+
+
+class EmbeddingService:
+    """
+    Micro-batching, priority-aware async embedding service.
+    """
+
+    def __init__(self, generator: EmbeddingsGenerator, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+                 batch_window: float = DEFAULT_BATCH_WINDOW, max_concurrency: int = DEFAULT_MAX_CONCURRENCY):
+        """
+        Initialize the service; its dispatcher starts with the first request.
+
+        :param generator: The generator computing the embeddings.
+        :param max_batch_size: The number of texts per provider request.
+        :param batch_window: Seconds a partially filled bulk batch waits for more texts.
+        :param max_concurrency: The number of provider requests in flight.
+        """
+        self.generator = generator
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.max_concurrency = max_concurrency
+        self.stats = EmbeddingServiceStats(max_batch_size=max_batch_size)
+        self.lanes: Dict[Priority, Deque[EmbeddingRequest]] = {priority: deque() for priority in Priority}
+        self._wake: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._running: set = set()
+
+    async def embed(self, texts: List[str], priority: Priority = Priority.BULK) -> List[List[float]]:
+        """
+        Embed texts through the shared batches.
+
+        :param texts: A list of input strings to generate embeddings for.
+        :param priority: Priority.INTERACTIVE for latency-sensitive callers, Priority.BULK otherwise.
+        :return: A list of embeddings in the order of `texts`.
+        """
+        return (await self.embed_array(texts, priority)).tolist()
+
+    async def embed_array(self, texts: List[str], priority: Priority = Priority.BULK) -> np.ndarray:
+        """
+        Embed texts through the shared batches, as one float32 matrix.
+
+        :param texts: A list of input strings to generate embeddings for.
+        :param priority: Priority.INTERACTIVE for latency-sensitive callers, Priority.BULK otherwise.
+        :return: An array of shape (len(texts), dimension) in the order of `texts`.
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        self._start()
+        request = EmbeddingRequest(list(texts), priority, asyncio.get_running_loop().create_future())
+        self.lanes[priority].append(request)
+        self._wake.set()
+        return await request.future
+
+    async def embed_query(self, text: str) -> List[float]:
+        """
+        Embed one query ahead of any queued ingestion.
+
+        :param text: The query text.
+        :return: Its embedding.
+        """
+        return (await self.embed([text], Priority.INTERACTIVE))[0]
+
+    async def close(self) -> None:
+        """
+        Stop the dispatcher once the queued requests have been sent, and wait for the batches in flight.
+        """
+        if self._dispatcher is None:
+            return
+        # A dispatcher that died would never send the queued texts
+        while self._pending_texts() and not self._dispatcher.done():
+            await asyncio.sleep(self.batch_window or 0.001)
+        self._dispatcher.cancel()
+        try:
+            await self._dispatcher
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Error in embedding dispatcher: {e}")
+        self._dispatcher = None
+        for lane in self.lanes.values():
+            while lane:
+                request = lane.popleft()
+                if not request.future.done():
+                    request.future.set_exception(RuntimeError("Embedding service closed before the request was sent"))
+        await asyncio.gather(*self._running, return_exceptions=True)
+
+    def _start(self) -> None:
+        if self._dispatcher is None:
+            self._wake = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    def _pending_texts(self) -> int:
+        return sum(len(request.texts) - request.dispatched for lane in self.lanes.values() for request in lane)
+
+    async def _dispatch(self) -> None:
+        while True:
+            await self._wake.wait()
+            # Take a slot before packing, so requests arriving while every slot is busy still join
+            await self._slots.acquire()
+            if (self.batch_window and not self.lanes[Priority.INTERACTIVE]
+                    and self._pending_texts() < self.max_batch_size):
+                deadline = time.perf_counter() + self.batch_window
+                while (time.perf_counter() < deadline and not self.lanes[Priority.INTERACTIVE]
+                       and self._pending_texts() < self.max_batch_size):
+                    self._wake.clear()
+                    try:
+                        await asyncio.wait_for(self._wake.wait(), deadline - time.perf_counter())
+                    except asyncio.TimeoutError:
+                        break
+            batch = self._take_batch()
+            if self._pending_texts():
+                self._wake.set()
+            else:
+                self._wake.clear()
+            if not batch:
+                self._slots.release()
+                continue
+            task = asyncio.get_running_loop().create_task(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    def _take_batch(self) -> List[Tuple[EmbeddingRequest, int, int]]:
+        '''Parts (request, start, end) filling one batch, interactive lane first'''
+        batch, size, now = [], 0, time.perf_counter()
+        for priority in Priority:
+            lane = self.lanes[priority]
+            while lane and size < self.max_batch_size:
+                request = lane[0]
+                if request.future.done():
+                    # Cancelled by its caller
+                    lane.popleft()
+                    continue
+                if request.dispatched == 0:
+                    self.stats.queue_latencies[priority].append(now - request.enqueued_at)
+                end = min(len(request.texts), request.dispatched + self.max_batch_size - size)
+                batch.append((request, request.dispatched, end))
+                size += end - request.dispatched
+                request.dispatched = end
+                if end == len(request.texts):
+                    lane.popleft()
+        return batch
+
+    async def _run(self, batch: List[Tuple[EmbeddingRequest, int, int]]) -> None:
+        texts = [text for request, start, end in batch for text in request.texts[start:end]]
+        try:
+            embeddings = await asyncio.to_thread(self.generator.embed, texts)
+            self.stats.batches += 1
+            self.stats.texts += len(texts)
+            offset = 0
+            for request, start, end in batch:
+                request.results[start:end] = embeddings[offset:offset + end - start]
+                offset += end - start
+                request.completed += end - start
+                if request.completed == len(request.texts) and not request.future.done():
+                    request.future.set_result(np.stack(request.results))
+        except Exception as e:
+            self.stats.failed_batches += 1
+            print(f"Error generating embeddings: {e}")
+            for request, _, _ in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+        finally:
+            self._slots.release()
@@ -1,5 +1,7 @@
+import re
 from abc import ABC, abstractmethod
-from typing import List
+from typing import List, Optional
+import numpy as np
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from dotenv import load_dotenv
 
@@ -23,6 +25,18 @@ class EmbeddingsGenerator(ABC):
         """
         pass
 
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Generate embeddings as one contiguous float32 matrix. Providers answering with lists
+        are converted once here; generators computing arrays override this.
+
+        :param texts: A list of input strings to generate embeddings for.
+        :return: An array of shape (len(texts), dimension).
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.array(self.generate_embeddings(texts), dtype=np.float32)
+
 
 # Concrete Implementation of EmbeddingsGenerator using Gemini
 class GeminiEmbeddingsGenerator(EmbeddingsGenerator):
@@ -48,6 +62,94 @@ class GeminiEmbeddingsGenerator(EmbeddingsGenerator):
         return self.embedding_model.embed_documents(texts)
 
 
+# Offline implementation of EmbeddingsGenerator using the hashing trick
+class LocalEmbeddingsGenerator(EmbeddingsGenerator):
+    """
+    Deterministic embeddings computed with NumPy, without any provider: word unigrams and
+    bigrams are hashed (FNV-1a over their code points) into `dimension` signed buckets,
+    weighted by 1 + log(tf) and L2-normalised. Texts sharing words get similar vectors, which is enough for CI, load tests
+    and low-value content such as conversation titles.
+    """
+
+    DEFAULT_DIMENSION = 384
+    MAX_TOKEN_CHARS = 64
+    TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+    def __init__(self, model_name: str = "hashing", dimension: Optional[int] = None):
+        """
+        Initialize the local embeddings generator.
+
+        :param model_name: The name of the model; a trailing number (e.g. "hashing-768") sets the dimension.
+        :param dimension: The embedding dimension, overriding the one in the model name.
+        """
+        suffix = re.search(r"(\d+)$", model_name)
+        self.dimension = dimension or (int(suffix.group(1)) if suffix else self.DEFAULT_DIMENSION)
+        self.model_name = model_name
+
+    @staticmethod
+    def hash_tokens(tokens: List[str]) -> np.ndarray:
+        """
+        64-bit FNV-1a hashes over the code points of tokens, computed for all tokens at once one
+        character column at a time. Tokens are cut at MAX_TOKEN_CHARS.
+
+        :param tokens: The tokens to hash.
+        :return: An array of uint64 hashes.
+        """
+        characters = np.array(tokens, dtype=np.str_)
+        width = min(characters.dtype.itemsize // 4, LocalEmbeddingsGenerator.MAX_TOKEN_CHARS)
+        characters = characters.astype(f"<U{width}")
+        codes = characters.view(np.uint32).reshape(len(tokens), width).astype(np.uint64)
+        lengths = (codes != 0).sum(axis=1)
+        hashes = np.full(len(tokens), 0xcbf29ce484222325, dtype=np.uint64)
+        prime = np.uint64(0x100000001b3)
+        with np.errstate(over="ignore"):
+            for position in range(width):
+                mixed = (hashes ^ codes[:, position]) * prime
+                hashes = np.where(lengths > position, mixed, hashes)
+        return hashes
+
+    def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        Generate embeddings for a list of input texts locally.
+
+        :param texts: A list of input strings to generate embeddings for.
+        :return: A list of embeddings, where each embedding is a list of floats.
+        """
+        return self.embed(texts).tolist()
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Generate embeddings as a float32 matrix, one row per text.
+
+        :param texts: A list of input strings to generate embeddings for.
+        :return: An array of shape (len(texts), dimension).
+        """
+        documents, tokens = [], []
+        for row, text in enumerate(texts):
+            words = self.TOKEN_PATTERN.findall(text.lower())
+            features = words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+            tokens.extend(features)
+            documents.extend([row] * len(features))
+        matrix = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        if not tokens:
+            return matrix
+
+        hashes = self.hash_tokens(tokens)
+        documents = np.asarray(documents, dtype=np.int64)
+        # Term frequency of every distinct (text, feature) pair, keyed on the hash mixed with the text's row
+        with np.errstate(over="ignore"):
+            pairs = hashes ^ (documents.astype(np.uint64) * np.uint64(0x9e3779b97f4a7c15))
+        _, first, counts = np.unique(pairs, return_index=True, return_counts=True)
+        hashes = hashes[first]
+        buckets = (hashes % np.uint64(self.dimension)).astype(np.int64)
+        # The top bit picks the sign, so colliding features tend to cancel out instead of adding up
+        signs = np.where(hashes >> np.uint64(63), -1.0, 1.0)
+        np.add.at(matrix, (documents[first], buckets), (signs * (1 + np.log(counts))).astype(np.float32))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+        return matrix
+
+
 # Factory Class for LLM and Embedding Client
 class LLMEmbeddingsClientFactory:
     """
@@ -55,19 +157,29 @@ class LLMEmbeddingsClientFactory:
     """
 
     @staticmethod
-    def create_embeddings_generator(provider: str, model_name: str) -> EmbeddingsGenerator:
+    def create_embeddings_generator(provider: str, model_name: str, cache_path: Optional[str] = None,
+                                    cache_max_entries: Optional[int] = None) -> EmbeddingsGenerator:
         """
         Create an embeddings generator based on the provider (e.g., Gemini).
 
-        :param provider: The provider for the embeddings generation (e.g., "gemini").
+        :param provider: The provider for the embeddings generation ("gemini", or "local" for offline hashing embeddings).
         :param model_name: The name of the model for embeddings generation.
+        :param cache_path: SQLite file of a persistent embedding cache in front of the provider.
+        :param cache_max_entries: Size of the in-memory cache; with no cache_path it enables an in-memory cache only.
         :return: An instance of a class implementing the EmbeddingsGenerator interface.
         """
         if provider == "gemini":
-            return GeminiEmbeddingsGenerator(model_name)
+            generator = GeminiEmbeddingsGenerator(model_name)
+        elif provider == "local":
+            generator = LocalEmbeddingsGenerator(model_name)
         else:
             raise ValueError(f"Unsupported embeddings provider: {provider}")
 
+        if cache_path or cache_max_entries:
+            from src.llm.embedding_cache import CachedEmbeddingsGenerator, DEFAULT_MAX_ENTRIES
+            return CachedEmbeddingsGenerator(generator, model_name, cache_path, cache_max_entries or DEFAULT_MAX_ENTRIES)
+        return generator
+
 
 
 # Example usage
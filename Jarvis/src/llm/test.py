@@ -0,0 +1,214 @@
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from typing import List
+import numpy as np
+from src.llm.embedding_cache import CachedEmbeddingsGenerator
+from src.llm.embedding_service import EmbeddingService, Priority
+from src.llm.llm_embeddings import EmbeddingsGenerator, LLMEmbeddingsClientFactory, LocalEmbeddingsGenerator
+
+
+class FakeEmbeddingsGenerator(EmbeddingsGenerator):
+    '''Embeds a text as [len(text), index in its request, ...] and records every request'''
+
+    def __init__(self, dimension: int = 4, delay: float = 0.0):
+        self.dimension = dimension
+        self.delay = delay
+        self.requests: List[List[str]] = []
+
+    def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        self.requests.append(list(texts))
+        time.sleep(self.delay)
+        if "boom" in texts:
+            raise RuntimeError("provider failed")
+        return [[float(len(text)), float(index)] + [0.0] * (self.dimension - 2) for index, text in enumerate(texts)]
+
+
+class EmbeddingCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "embeddings.sqlite3")
+        self.generator = FakeEmbeddingsGenerator()
+
+    def test_memory_then_disk_hits(self):
+        cache = CachedEmbeddingsGenerator(self.generator, "fake", self.path)
+        first = cache.embed(["alpha", "beta"])
+        again = cache.embed(["alpha", "beta"])
+        np.testing.assert_array_equal(first, again)
+        self.assertEqual(len(self.generator.requests), 1)
+        self.assertEqual((cache.stats.memory_hits, cache.stats.disk_hits, cache.stats.misses), (2, 0, 2))
+        cache.close()
+
+        # A new instance on the same file starts with an empty LRU and reads from disk
+        reopened = CachedEmbeddingsGenerator(self.generator, "fake", self.path)
+        np.testing.assert_array_equal(reopened.embed(["beta", "alpha"]), first[::-1])
+        self.assertEqual(len(self.generator.requests), 1)
+        self.assertEqual((reopened.stats.memory_hits, reopened.stats.disk_hits, reopened.stats.misses), (0, 2, 0))
+        reopened.close()
+
+    def test_duplicates_and_whitespace_variants_share_one_call(self):
+        cache = CachedEmbeddingsGenerator(self.generator, "fake")
+        texts = ["the quick fox", "the  quick\nfox ", "the quick fox", "\tthe quick fox"]
+        embeddings = cache.embed(texts)
+        self.assertEqual(self.generator.requests, [["the quick fox"]])
+        self.assertEqual(embeddings.shape, (4, 4))
+        for row in embeddings[1:]:
+            np.testing.assert_array_equal(row, embeddings[0])
+        self.assertEqual(cache.stats.misses, 1)
+
+    def test_misses_are_sent_in_a_single_request(self):
+        cache = CachedEmbeddingsGenerator(self.generator, "fake")
+        cache.embed(["a", "bb"])
+        embeddings = cache.embed(["a", "ccc", "bb", "dddd", "ccc"])
+        self.assertEqual(self.generator.requests, [["a", "bb"], ["ccc", "dddd"]])
+        self.assertEqual(cache.stats.provider_calls, 2)
+        self.assertEqual(embeddings[:, 0].tolist(), [1.0, 3.0, 2.0, 4.0, 3.0])
+        self.assertEqual(cache.generate_embeddings([]), [])
+
+    def test_lru_evicts_least_recently_used(self):
+        cache = CachedEmbeddingsGenerator(self.generator, "fake", max_entries=2)
+        cache.embed(["one"])
+        cache.embed(["two"])
+        cache.embed(["one"])
+        cache.embed(["three"])
+        self.assertEqual(len(cache.entries), 2)
+
+        cache.embed(["one", "three"])
+        self.assertEqual(len(self.generator.requests), 3)
+        cache.embed(["two"])
+        self.assertEqual(self.generator.requests[-1], ["two"])
+        self.assertEqual(cache.stats.memory_hits, 3)
+
+
+
+class EmbeddingServiceTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_requests_share_a_batch(self):
+        generator = FakeEmbeddingsGenerator()
+        service = EmbeddingService(generator, max_batch_size=10, batch_window=0.05)
+        results = await asyncio.gather(
+            service.embed(["a", "bb"]), service.embed(["ccc"]), service.embed(["dddd", "eeeee", "ffffff"]))
+        await service.close()
+
+        self.assertEqual(generator.requests, [["a", "bb", "ccc", "dddd", "eeeee", "ffffff"]])
+        self.assertEqual([[row[0] for row in result] for result in results], [[1.0, 2.0], [3.0], [4.0, 5.0, 6.0]])
+        # Callers get their rows back in order, whatever their position in the batch
+        self.assertEqual([row[1] for row in results[2]], [3.0, 4.0, 5.0])
+
+    async def test_interactive_lane_is_sent_first(self):
+        generator = FakeEmbeddingsGenerator(delay=0.05)
+        service = EmbeddingService(generator, max_batch_size=2, batch_window=0, max_concurrency=1)
+        bulk = asyncio.create_task(service.embed(["b0", "b1", "b2", "b3", "b4", "b5"]))
+        await asyncio.sleep(0.02)
+        query = await service.embed_query("query")
+        await bulk
+        await service.close()
+
+        self.assertEqual(query[0], 5.0)
+        self.assertEqual(generator.requests, [["b0", "b1"], ["query", "b2"], ["b3", "b4"], ["b5"]])
+
+    async def test_large_requests_are_split_across_batches(self):
+        generator = FakeEmbeddingsGenerator()
+        service = EmbeddingService(generator, max_batch_size=4, batch_window=0)
+        texts = ["x" * length for length in range(1, 11)]
+        embeddings = await service.embed_array(texts)
+        await service.close()
+
+        self.assertEqual([len(request) for request in generator.requests], [4, 4, 2])
+        self.assertEqual(embeddings.shape, (10, 4))
+        self.assertEqual(embeddings.dtype, np.float32)
+        self.assertEqual(embeddings[:, 0].tolist(), [float(length) for length in range(1, 11)])
+
+    async def test_failed_batch_fails_its_requests_only(self):
+        generator = FakeEmbeddingsGenerator()
+        service = EmbeddingService(generator, max_batch_size=10, batch_window=0.05)
+        results = await asyncio.gather(service.embed(["boom"]), service.embed(["fine"]), return_exceptions=True)
+        self.assertEqual([type(result) for result in results], [RuntimeError, RuntimeError])
+        self.assertEqual(len(generator.requests), 1)
+
+        self.assertEqual((await service.embed(["later"]))[0][0], 5.0)
+        await service.close()
+        self.assertEqual((service.stats.batches, service.stats.failed_batches), (1, 1))
+
+    async def test_stats(self):
+        generator = FakeEmbeddingsGenerator()
+        service = EmbeddingService(generator, max_batch_size=4, batch_window=0)
+        await service.embed(["a"] * 10)
+        await service.embed_query("q")
+        await service.close()
+
+        self.assertEqual((service.stats.batches, service.stats.texts), (4, 11))
+        self.assertAlmostEqual(service.stats.fill_ratio, 11 / 16)
+        self.assertEqual([len(service.stats.queue_latencies[priority]) for priority in Priority], [1, 1])
+        summary = service.stats.summary()
+        self.assertEqual(summary["batches"], 4)
+        self.assertGreaterEqual(summary["bulk_queue_p95_ms"], summary["bulk_queue_p50_ms"])
+
+    async def test_close_returns_when_the_dispatcher_died(self):
+        service = EmbeddingService(FakeEmbeddingsGenerator(), batch_window=0)
+        service._start()
+        service._dispatcher.cancel()
+        await asyncio.sleep(0)
+        request = asyncio.create_task(service.embed(["never sent"]))
+        await asyncio.sleep(0)
+
+        await asyncio.wait_for(service.close(), timeout=1)
+        with self.assertRaises(RuntimeError):
+            await request
+
+
+
+class LocalEmbeddingsGeneratorTestCase(unittest.TestCase):
+    TEXTS = ["The quick brown fox", "jumps over the lazy dog", "Ünïcödé wörds and naïve café"]
+
+    def test_fnv1a_hashes(self):
+        # Reference 64-bit FNV-1a values
+        hashes = LocalEmbeddingsGenerator.hash_tokens(["a", "foobar"])
+        self.assertEqual([int(value) for value in hashes], [0xaf63dc4c8601ec8c, 0x85944171f73967e8])
+
+    def test_deterministic_across_instances_and_processes(self):
+        embeddings = LocalEmbeddingsGenerator().embed(self.TEXTS)
+        np.testing.assert_array_equal(LocalEmbeddingsGenerator().embed(self.TEXTS), embeddings)
+
+        # Python's string hash is salted per process, the embeddings must not depend on it
+        script = ("import sys; from src.llm.llm_embeddings import LocalEmbeddingsGenerator; "
+                  f"sys.stdout.write(LocalEmbeddingsGenerator().embed({self.TEXTS!r}).tobytes().hex())")
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        output = subprocess.run([sys.executable, "-c", script], cwd=root, capture_output=True, text=True, check=True,
+                                env={**os.environ, "PYTHONHASHSEED": "random"}).stdout
+        self.assertEqual(output, embeddings.tobytes().hex())
+
+    def test_dimension(self):
+        self.assertEqual(LocalEmbeddingsGenerator().dimension, LocalEmbeddingsGenerator.DEFAULT_DIMENSION)
+        self.assertEqual(LocalEmbeddingsGenerator("hashing-768").dimension, 768)
+        self.assertEqual(LocalEmbeddingsGenerator("hashing-768", dimension=64).dimension, 64)
+        self.assertEqual(LocalEmbeddingsGenerator("hashing-768").embed(self.TEXTS).shape, (3, 768))
+
+    def test_rows_have_unit_norm_and_empty_texts_are_zero(self):
+        embeddings = LocalEmbeddingsGenerator().embed(["", *self.TEXTS, "?!"])
+        self.assertEqual(embeddings.dtype, np.float32)
+        np.testing.assert_allclose(np.linalg.norm(embeddings[1:4], axis=1), 1.0, rtol=1e-6)
+        self.assertFalse(embeddings[0].any())
+        self.assertFalse(embeddings[4].any())
+
+    def test_shared_words_give_similar_vectors(self):
+        first, close, unrelated = LocalEmbeddingsGenerator().embed(
+            ["the quick brown fox", "a quick brown fox", "tax returns are due in april"])
+        self.assertGreater(float(first @ close), float(first @ unrelated))
+
+    def test_factory(self):
+        generator = LLMEmbeddingsClientFactory.create_embeddings_generator("local", "hashing-128")
+        self.assertIsInstance(generator, LocalEmbeddingsGenerator)
+        self.assertEqual(generator.dimension, 128)
+
+        cached = LLMEmbeddingsClientFactory.create_embeddings_generator("local", "hashing-128", cache_max_entries=10)
+        self.assertIsInstance(cached, CachedEmbeddingsGenerator)
+        self.assertIsInstance(cached.generator, LocalEmbeddingsGenerator)
+        with self.assertRaises(ValueError):
+            LLMEmbeddingsClientFactory.create_embeddings_generator("unknown", "hashing")
+
+
+if __name__ == '__main__':
+    unittest.main()
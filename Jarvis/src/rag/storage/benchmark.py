@@ -0,0 +1,211 @@
+"""
+Benchmark harness for any AsyncVectorDBStrategy.
+
+Generates a synthetic clustered dataset, computes the exact top-k of every query with
+NumPy, then measures against the chosen backend:
+
+    insert      vectors per second through upsert_vectors
+    query       QPS and p50/p95/p99 latency at each concurrency level
+    recall@k    share of the exact top-k ids returned by the backend
+    memory      resident set growth of this process and, for local namespaces, their
+                own accounting (remote backends hold their data server side)
+
+The report is printed as JSON so runs can be stored and compared. Run it from the Jarvis
+directory, extra strategy config keys are passed as a JSON object:
+
+    python -m src.rag.storage.benchmark --backend local --vectors 100000 --dimension 384
+    python -m src.rag.storage.benchmark --backend local --config '{"index": "hnsw", "hnsw_threshold": 0}'
+    python -m src.rag.storage.benchmark --backend pinecone --vectors 10000 --settle 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from dotenv import load_dotenv
+from src.storage.local_vector_store import prepare_vectors, query_blocks, score_matrix, top_k_rows
+from src.storage.vector_store import AsyncVectorDBFactory, AsyncVectorDBStrategy, VectorDBConfig, vectors_from_array
+
+load_dotenv()
+
+
+def generate_dataset(vectors: int, dimension: int, queries: int, clusters: int = 64, spread: float = 1.0,
+                     seed: int = 7) -> Tuple[np.ndarray, np.ndarray]:
+    '''Gaussian clusters around random centroids; queries are drawn from the same clusters'''
+    generator = np.random.default_rng(seed)
+    centroids = generator.normal(size=(clusters, dimension)).astype(np.float32)
+    data = centroids[generator.integers(0, clusters, vectors)] \
+        + generator.normal(scale=spread, size=(vectors, dimension)).astype(np.float32)
+    query_data = centroids[generator.integers(0, clusters, queries)] \
+        + generator.normal(scale=spread, size=(queries, dimension)).astype(np.float32)
+    return data, query_data
+
+
+def exact_ground_truth(data: np.ndarray, queries: np.ndarray, top_k: int, metric: str = 'cosine') -> List[List[int]]:
+    '''Exact top_k row numbers of every query'''
+    matrix = prepare_vectors(data, data.shape[1], metric)
+    prepared = prepare_vectors(queries, data.shape[1], metric)
+    norms = np.einsum('ij,ij->i', matrix, matrix)
+    truth = []
+    for block in query_blocks(prepared, len(matrix)):
+        truth.extend(top_k_rows(scores, top_k).tolist() for scores in score_matrix(block, matrix, norms, metric))
+    return truth
+
+
+def percentile(latencies: Sequence[float], q: float) -> float:
+    return float(np.percentile(latencies, q)) if len(latencies) else 0.0
+
+
+def resident_bytes() -> Optional[int]:
+    '''Current resident set size of the process, None where it cannot be read'''
+    try:
+        with open('/proc/self/statm') as handle:
+            return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def peak_resident_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if platform.system() == 'Darwin' else peak * 1024
+
+
+async def measure_inserts(strategy: AsyncVectorDBStrategy, namespace: str, data: np.ndarray,
+                          insert_batch: int) -> Dict[str, Any]:
+    elapsed, failed = 0.0, 0
+    for start in range(0, len(data), insert_batch):
+        rows = range(start, min(start + insert_batch, len(data)))
+        vectors = vectors_from_array([str(row) for row in rows], data[start:start + insert_batch],
+                                     [{'row': row} for row in rows])
+        start_time = time.perf_counter()
+        if not await strategy.upsert_vectors(namespace, vectors):
+            failed += len(vectors)
+        elapsed += time.perf_counter() - start_time
+    return {'vectors': len(data), 'failed': failed, 'seconds': elapsed,
+            'vectors_per_second': len(data) / elapsed if elapsed else 0.0}
+
+
+async def measure_queries(strategy: AsyncVectorDBStrategy, namespace: str, queries: np.ndarray, top_k: int,
+                          concurrency: int) -> Tuple[Dict[str, Any], List[List[int]]]:
+    '''Run every query with `concurrency` workers; returns the stats and the returned row numbers'''
+    latencies: List[float] = [0.0] * len(queries)
+    found: List[List[int]] = [[] for _ in range(len(queries))]
+    query_lists = queries.tolist()
+    next_query = iter(range(len(queries)))
+
+    async def worker() -> None:
+        for position in next_query:
+            start_time = time.perf_counter()
+            results = await strategy.query_vectors(namespace, query_lists[position], top_k)
+            latencies[position] = (time.perf_counter() - start_time) * 1000
+            found[position] = [int(result.id) for result in results]
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start_time
+    return {
+        'concurrency': concurrency,
+        'queries': len(queries),
+        'qps': len(queries) / elapsed if elapsed else 0.0,
+        'latency_p50_ms': percentile(latencies, 50),
+        'latency_p95_ms': percentile(latencies, 95),
+        'latency_p99_ms': percentile(latencies, 99),
+    }, found
+
+
+def recall_at_k(truth: List[List[int]], found: List[List[int]], top_k: int) -> float:
+    hits = sum(len(set(expected[:top_k]) & set(returned[:top_k])) for expected, returned in zip(truth, found))
+    expected_total = sum(min(len(expected), top_k) for expected in truth)
+    return hits / expected_total if expected_total else 0.0
+
+
+async def run_benchmark(config_dict: Dict[str, Any], vectors: int = 10000, dimension: int = 128, queries: int = 200,
+                        top_k: int = 10, concurrency_levels: Sequence[int] = (1, 4, 16), clusters: int = 64,
+                        metric: str = 'cosine', insert_batch: int = 1000, settle: float = 0.0,
+                        seed: int = 7) -> Dict[str, Any]:
+    '''Benchmark the strategy built from `config_dict` and return the report as a dict'''
+    data, query_data = generate_dataset(vectors, dimension, queries, clusters, seed=seed)
+    start_time = time.perf_counter()
+    truth = exact_ground_truth(data, query_data, top_k, metric)
+    ground_truth_seconds = time.perf_counter() - start_time
+
+    strategy = AsyncVectorDBFactory.create_strategy(VectorDBConfig(config_dict=dict(config_dict)))
+    namespace = f"benchmark-{uuid.uuid4().hex[:8]}"
+    report: Dict[str, Any] = {
+        'backend': config_dict.get('db_type'),
+        'config': {key: value for key, value in config_dict.items() if key not in ('api_key', 'token')},
+        'dataset': {'vectors': vectors, 'dimension': dimension, 'queries': queries, 'clusters': clusters,
+                    'metric': metric, 'top_k': top_k, 'seed': seed},
+        'ground_truth_seconds': ground_truth_seconds,
+    }
+    await strategy.initialize()
+    try:
+        await strategy.create_namespace(namespace, dimension=dimension, metric=metric)
+        rss_before = resident_bytes()
+        report['insert'] = await measure_inserts(strategy, namespace, data, insert_batch)
+        rss_after = resident_bytes()
+        if settle:
+            # Remote indexes are eventually consistent
+            await asyncio.sleep(settle)
+
+        report['query'] = []
+        for concurrency in concurrency_levels:
+            stats, found = await measure_queries(strategy, namespace, query_data, top_k, concurrency)
+            stats['recall_at_k'] = recall_at_k(truth, found, top_k)
+            report['query'].append(stats)
+
+        memory: Dict[str, Any] = {
+            'raw_vectors_bytes': int(data.nbytes),
+            'rss_growth_bytes': rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+            'peak_rss_bytes': peak_resident_bytes(),
+        }
+        store = getattr(strategy, 'namespaces', {}).get(namespace)
+        if store is not None and hasattr(store, 'memory_usage'):
+            memory['namespace'] = store.memory_usage()
+        report['memory'] = memory
+    finally:
+        await strategy.delete_namespace(namespace)
+        await strategy.cleanup()
+    return report
+
+
+def backend_config(backend: str, extra: Dict[str, Any]) -> Dict[str, Any]:
+    config_dict: Dict[str, Any] = {'db_type': backend}
+    if backend == 'pinecone':
+        config_dict.update({'api_key': os.environ.get('PINECONE_API_KEY'), 'host': os.environ.get('PINECONE_HOST')})
+    config_dict.update(extra)
+    return config_dict
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark a vector DB strategy on synthetic clustered data")
+    parser.add_argument('--backend', default='local', help="db_type passed to AsyncVectorDBFactory")
+    parser.add_argument('--config', default='{}', help="Extra strategy config keys as a JSON object")
+    parser.add_argument('--vectors', type=int, default=10000)
+    parser.add_argument('--dimension', type=int, default=128)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--clusters', type=int, default=64)
+    parser.add_argument('--metric', default='cosine', choices=['cosine', 'dot', 'l2'])
+    parser.add_argument('--insert-batch', type=int, default=1000)
+    parser.add_argument('--settle', type=float, default=0.0, help="Seconds to wait between inserts and queries")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_benchmark(
+        backend_config(args.backend, json.loads(args.config)), args.vectors, args.dimension, args.queries,
+        args.top_k, args.concurrency, args.clusters, args.metric, args.insert_batch, args.settle, args.seed,
+    ))
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output)
@@ -0,0 +1,139 @@
+"""
+End-to-end benchmark of the ingestion path: embed chunks, wrap them in VectorData and
+upsert them, once with embeddings as lists of floats and once as float32 arrays.
+
+    array   embed() into one preallocated float32 matrix -> VectorData per row view
+    list    generate_embeddings() -> List[List[float]] -> VectorData per list
+
+Embeddings come from the offline LocalEmbeddingsGenerator so the run needs no provider,
+and vectors go to an in-memory local namespace. For each mode the report gives the seconds
+of every stage and the resident set growth while the embeddings and VectorData are held
+(tracemalloc would need a trace per boxed float). Run it from the Jarvis directory:
+
+    python -m src.rag.storage.pipeline_benchmark --chunks 100000 --dimension 384
+"""
+import argparse
+import asyncio
+import gc
+import json
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+import numpy as np
+from src.llm.llm_embeddings import LocalEmbeddingsGenerator
+from src.rag.storage.benchmark import peak_resident_bytes, resident_bytes
+from src.storage.vector_store import AsyncVectorDBFactory, VectorDBConfig, VectorData, vectors_from_array
+
+# Arrays first, so the float objects freed by the list mode cannot hide its growth
+MODES = ('array', 'list')
+
+
+def generate_chunks(chunks: int, words: int = 40, vocabulary: int = 20000, seed: int = 7) -> List[str]:
+    '''Synthetic chunks of `words` words drawn from a Zipf-like vocabulary'''
+    generator = np.random.default_rng(seed)
+    ranks = np.minimum(generator.zipf(1.3, size=(chunks, words)), vocabulary)
+    return [' '.join(f"w{rank}" for rank in row) for row in ranks.tolist()]
+
+
+def embed_chunks(generator: LocalEmbeddingsGenerator, texts: Sequence[str], mode: str,
+                 embed_batch: int) -> Union[List[List[float]], np.ndarray]:
+    '''Embed texts in provider-sized batches, as lists or into one float32 matrix'''
+    if mode == 'list':
+        embeddings: List[List[float]] = []
+        for start in range(0, len(texts), embed_batch):
+            embeddings.extend(generator.generate_embeddings(list(texts[start:start + embed_batch])))
+        return embeddings
+    matrix = np.empty((len(texts), generator.dimension), dtype=np.float32)
+    for start in range(0, len(texts), embed_batch):
+        matrix[start:start + embed_batch] = generator.embed(list(texts[start:start + embed_batch]))
+    return matrix
+
+
+def build_vectors(embeddings: Union[List[List[float]], np.ndarray], mode: str) -> List[VectorData]:
+    ids = [str(row) for row in range(len(embeddings))]
+    metadata = [{'row': row} for row in range(len(embeddings))]
+    if mode == 'list':
+        return [VectorData(vector_id, values, meta) for vector_id, values, meta in zip(ids, embeddings, metadata)]
+    return vectors_from_array(ids, embeddings, metadata)
+
+
+async def timed_run(generator: LocalEmbeddingsGenerator, texts: Sequence[str], mode: str, embed_batch: int,
+                    config_dict: Dict[str, Any]) -> Tuple[Dict[str, float], Optional[int], bool]:
+    '''Seconds of every stage, resident set growth of the built vectors, and whether the upsert succeeded'''
+    gc.collect()
+    rss_before = resident_bytes()
+    seconds: Dict[str, float] = {}
+    start_time = time.perf_counter()
+    embeddings = embed_chunks(generator, texts, mode, embed_batch)
+    seconds['embed'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    vectors = build_vectors(embeddings, mode)
+    seconds['build'] = time.perf_counter() - start_time
+    rss_after = resident_bytes()
+    held = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+
+    strategy = AsyncVectorDBFactory.create_strategy(VectorDBConfig(config_dict=dict(config_dict)))
+    namespace = f"pipeline-{uuid.uuid4().hex[:8]}"
+    await strategy.initialize()
+    try:
+        await strategy.create_namespace(namespace, dimension=generator.dimension)
+        start_time = time.perf_counter()
+        succeeded = await strategy.upsert_vectors(namespace, vectors)
+        seconds['upsert'] = time.perf_counter() - start_time
+    finally:
+        await strategy.delete_namespace(namespace)
+        await strategy.cleanup()
+    seconds['total'] = seconds['embed'] + seconds['build'] + seconds['upsert']
+    return seconds, held, succeeded
+
+
+async def run_pipeline_benchmark(chunks: int = 100000, dimension: int = 384, embed_batch: int = 100,
+                                 modes: Sequence[str] = MODES, config_dict: Optional[Dict[str, Any]] = None,
+                                 seed: int = 7) -> Dict[str, Any]:
+    '''Benchmark every mode on the same chunks and return the report as a dict'''
+    config_dict = config_dict or {'db_type': 'local'}
+    texts = generate_chunks(chunks, seed=seed)
+    generator = LocalEmbeddingsGenerator(dimension=dimension)
+    report: Dict[str, Any] = {
+        'dataset': {'chunks': chunks, 'dimension': dimension, 'embed_batch': embed_batch, 'seed': seed},
+        'config': config_dict,
+        'modes': {},
+    }
+    for mode in modes:
+        if mode not in MODES:
+            raise ValueError(f"Unsupported mode: {mode}")
+        seconds, held, succeeded = await timed_run(generator, texts, mode, embed_batch, config_dict)
+        report['modes'][mode] = {
+            'succeeded': succeeded,
+            'seconds': seconds,
+            'chunks_per_second': chunks / seconds['total'] if seconds['total'] else 0.0,
+            'rss_growth_bytes': held,
+        }
+    report['peak_rss_bytes'] = peak_resident_bytes()
+    if set(MODES) <= set(report['modes']):
+        listed, arrays = report['modes']['list'], report['modes']['array']
+        report['speedup'] = listed['seconds']['total'] / arrays['seconds']['total']
+        if listed['rss_growth_bytes'] and arrays['rss_growth_bytes']:
+            report['memory_ratio'] = listed['rss_growth_bytes'] / arrays['rss_growth_bytes']
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark list and float32 array embeddings through ingestion")
+    parser.add_argument('--chunks', type=int, default=100000)
+    parser.add_argument('--dimension', type=int, default=384)
+    parser.add_argument('--embed-batch', type=int, default=100, help="Texts per embedding request")
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=MODES)
+    parser.add_argument('--config', default='{"db_type": "local"}', help="Strategy config as a JSON object")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_pipeline_benchmark(args.chunks, args.dimension, args.embed_batch, args.modes,
+                                                json.loads(args.config), args.seed))
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output)
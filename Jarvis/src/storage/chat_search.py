@@ -0,0 +1,403 @@
+import html
+import logging
+import re
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+from src.storage.message_codec import get_message_codec
+
+logger = logging.getLogger(__name__)
+
+
+# Private-use markers wrapped around matched terms when building snippets. The snippet
+# text is HTML-escaped afterwards and the markers are swapped for <mark> tags,
+# so user content can never inject markup into the results page.
+_HIGHLIGHT_START = '\ue000'
+_HIGHLIGHT_END = '\ue001'
+_TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+_ELLIPSIS = '…'
+# Snippet lengths in words for the user and the AI side of a message pair
+USER_SNIPPET_WORDS = 12
+AI_SNIPPET_WORDS = 24
+# Message pairs decoded and inserted per batch by rebuild()
+REBUILD_BATCH_SIZE = 1000
+
+# (message_pair_id, user_id, conversation_id, user_message, ai_message) with decoded text
+IndexRow = Tuple[int, int, int, str, str]
+
+
+@dataclass
+class SearchHit:
+    """A single ranked match from the conversation history"""
+    message_pair_id: int
+    conversation_id: int
+    conversation_title: str
+    user_snippet: str
+    ai_snippet: str
+    rank: float
+    created_at: Optional[datetime] = None
+    # The conversation is archived, the snippets of moved pairs come from its archive frame
+    archived: bool = False
+
+
+@dataclass
+class SearchPage:
+    """One page of search results"""
+    query: str
+    page: int
+    page_size: int
+    has_next: bool = False
+    results: List[SearchHit] = field(default_factory=list)
+
+
+def _render_snippet(raw: Optional[str]) -> str:
+    """Escape a snippet and turn the highlight markers into <mark> tags"""
+    escaped = html.escape(raw or '')
+    return escaped.replace(_HIGHLIGHT_START, '<mark>').replace(_HIGHLIGHT_END, '</mark>')
+
+
+def _query_terms(query: str) -> List[str]:
+    """Split a free-text query into word tokens"""
+    return _TOKEN_PATTERN.findall(query or '')
+
+
+def _term_matches(word: str, terms: List[str]) -> bool:
+    """Whether a word matches the query terms, the last term being a prefix"""
+    if not terms:
+        return False
+    word = word.casefold()
+    return word in terms[:-1] or word.startswith(terms[-1])
+
+
+def build_snippet(text: str, terms: List[str], words: int) -> str:
+    """
+    Highlighted excerpt of at most `words` words of the text, taken around the window
+    holding the most query terms. The index keeps no copy of the text, so snippets are
+    built from the (decoded) message itself for the rows of the page only.
+    """
+    tokens = list(_TOKEN_PATTERN.finditer(text or ''))
+    if not tokens:
+        return ''
+    terms = [term.casefold() for term in terms]
+    matched = [index for index, token in enumerate(tokens) if _term_matches(token.group(), terms)]
+
+    start = 0
+    if matched:
+        best = max(matched, key=lambda first: sum(1 for index in matched if first <= index < first + words))
+        start = max(0, min(best, len(tokens) - words))
+    end = min(len(tokens), start + words)
+
+    parts = [_ELLIPSIS] if start > 0 else []
+    # Keep the punctuation around the text when the excerpt reaches its start or end
+    position = tokens[start].start() if start > 0 else 0
+    for token in tokens[start:end]:
+        parts.append(text[position:token.start()])
+        if _term_matches(token.group(), terms):
+            parts.append(f"{_HIGHLIGHT_START}{token.group()}{_HIGHLIGHT_END}")
+        else:
+            parts.append(token.group())
+        position = token.end()
+    parts.append(_ELLIPSIS if end < len(tokens) else text[position:])
+    return _render_snippet(''.join(parts))
+
+
+def _snippets(user_message: str, ai_message: str, terms: List[str]) -> Tuple[str, str]:
+    return (build_snippet(user_message, terms, USER_SNIPPET_WORDS),
+            build_snippet(ai_message, terms, AI_SNIPPET_WORDS))
+
+
+def _read_archived_pairs(archive, segment: str, offset: int, length: int) -> Dict[int, Dict]:
+    """Message pairs of an archive frame by id, empty if the frame cannot be read"""
+    try:
+        document = archive.read(segment, offset, length)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Error reading archive frame {segment}@{offset}: {e}")
+        return {}
+    return {row['message_pair_id']: row for row in document['message_pairs']}
+
+
+def iter_index_rows(batch_size: int = REBUILD_BATCH_SIZE) -> Iterator[List[IndexRow]]:
+    """
+    Batches of every message pair to index, with the stored text decoded by the message codec.
+    Pairs of archived conversations are read from their archive frames.
+    """
+    # Imported here, the archive module depends on this one
+    from src.storage.conversation_archive import ConversationArchive
+
+    codec = get_message_codec()
+    live_archived_ids = set()
+    last_id = 0
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT m.message_pair_id, c.user_id, m.conversation_id, m.user_message, m.ai_message, '
+                'c.archived_at IS NOT NULL '
+                'FROM "MessagePair" m JOIN "conversations" c ON c.conversation_id = m.conversation_id '
+                'WHERE m.message_pair_id > %s ORDER BY m.message_pair_id LIMIT %s',
+                [last_id, batch_size]
+            )
+            rows = cursor.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        # Messages saved while their conversation was being archived are still in the table
+        live_archived_ids.update(row[0] for row in rows if row[5])
+        yield [(row[0], row[1], row[2], codec.decode(row[3]), codec.decode(row[4])) for row in rows]
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT conversation_id, user_id, archive_segment, archive_offset, archive_length '
+            'FROM "conversations" WHERE archived_at IS NOT NULL ORDER BY conversation_id'
+        )
+        archived_conversations = cursor.fetchall()
+    if not archived_conversations:
+        return
+
+    archive = ConversationArchive()
+    batch: List[IndexRow] = []
+    for conversation_id, user_id, segment, offset, length in archived_conversations:
+        for message_pair_id, row in _read_archived_pairs(archive, segment, offset, length).items():
+            if message_pair_id not in live_archived_ids:
+                batch.append((message_pair_id, user_id, conversation_id, row['user_message'], row['ai_message']))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ChatSearchBackend(ABC):
+    """Abstract interface for the full-text index over message pairs"""
+
+    @abstractmethod
+    def index_message_pair(self, message_pair_id: int, user_id: int, conversation_id: int,
+                           user_message: str, ai_message: str) -> None:
+        """Add a message pair to the index. Must be called inside the saving transaction."""
+        pass
+
+    @abstractmethod
+    def clear(self) -> None:
+        """Remove every entry from the index"""
+        pass
+
+    @abstractmethod
+    def bulk_index(self, rows: List[IndexRow]) -> None:
+        """Add message pairs that are not indexed yet, with their text already decoded"""
+        pass
+
+    @abstractmethod
+    def search(self, user_id: int, query: str, page: int = 1, page_size: int = 20) -> SearchPage:
+        """Ranked, paginated search restricted to the conversations of one user"""
+        pass
+
+    def rebuild(self, batch_size: int = REBUILD_BATCH_SIZE) -> int:
+        """
+        Re-index every message pair, archived conversations included, from the decoded
+        message text and return the number of indexed rows
+        """
+        indexed = 0
+        with transaction.atomic():
+            self.clear()
+            for rows in iter_index_rows(batch_size):
+                self.bulk_index(rows)
+                indexed += len(rows)
+        return indexed
+
+    @staticmethod
+    def _build_hits(rows: Sequence[tuple], terms: List[str]) -> List[SearchHit]:
+        """
+        Turn result rows into hits. Rows are (message_pair_id, conversation_id, title,
+        user_message, ai_message, rank, created_at, archived, archive_segment, archive_offset,
+        archive_length); the message columns are NULL once the pair has moved to the archive,
+        in which case the text is read from the frame, once per conversation.
+        """
+        codec = get_message_codec()
+        archive, frames = None, {}
+        hits = []
+        for (message_pair_id, conversation_id, title, user_message, ai_message, rank, created_at,
+             archived, segment, offset, length) in rows:
+            if user_message is None:
+                if conversation_id not in frames:
+                    if archive is None:
+                        # Imported here, the archive module depends on this one
+                        from src.storage.conversation_archive import ConversationArchive
+                        archive = ConversationArchive()
+                    frames[conversation_id] = _read_archived_pairs(archive, segment, offset, length)
+                row = frames[conversation_id].get(message_pair_id)
+                if row is None:
+                    continue
+                user_message, ai_message = row['user_message'], row['ai_message']
+                created_at = parse_datetime(row['created_at']) if row.get('created_at') else None
+            else:
+                user_message, ai_message = codec.decode(user_message), codec.decode(ai_message)
+            user_snippet, ai_snippet = _snippets(user_message, ai_message, terms)
+            hits.append(SearchHit(
+                message_pair_id=message_pair_id,
+                conversation_id=conversation_id,
+                conversation_title=title,
+                user_snippet=user_snippet,
+                ai_snippet=ai_snippet,
+                rank=rank,
+                created_at=created_at,
+                archived=bool(archived),
+            ))
+        return hits
+
+
+class SQLiteFTS5SearchBackend(ChatSearchBackend):
+    """
+    SQLite FTS5 implementation.
+
+    The FTS5 table is contentless (content=''): it stores the postings only, never a copy of
+    the message text, and its rowid is the message pair id. A plain side table records which
+    pairs are indexed and their conversation; its foreign key removes the rows of deleted
+    conversations, and the postings left behind are skipped by the join and dropped by rebuild().
+    Pairs moved to the conversation archive stay indexed and are searched from their frame.
+    The owner of each row is stored as an indexed token ("u<id>") so the per-user
+    restriction is resolved by the FTS index itself instead of filtering every match.
+    """
+
+    table = 'MessagePairSearch'
+    index_table = 'MessagePairSearchIndex'
+
+    @staticmethod
+    def _owner_token(user_id: int) -> str:
+        return f"u{user_id}"
+
+    @staticmethod
+    def _match_expression(user_id: int, terms: List[str]) -> str:
+        quoted = [f'"{term}"' for term in terms]
+        # Treat the last term as a prefix so partially typed words still match
+        quoted[-1] = f"{quoted[-1]}*"
+        return f'owner : "{SQLiteFTS5SearchBackend._owner_token(user_id)}" AND ({" ".join(quoted)})'
+
+    def index_message_pair(self, message_pair_id, user_id, conversation_id, user_message, ai_message):
+        with connection.cursor() as cursor:
+            # A contentless table cannot replace a row, so a pair is only ever indexed once
+            cursor.execute(
+                f'INSERT OR IGNORE INTO "{self.table}" (message_pair_id, conversation_id) VALUES (%s, %s)',
+                [message_pair_id, conversation_id]
+            )
+            if cursor.rowcount:
+                cursor.execute(
+                    f'INSERT INTO "{self.index_table}" (rowid, user_message, ai_message, owner) VALUES (%s, %s, %s, %s)',
+                    [message_pair_id, user_message, ai_message, self._owner_token(user_id)]
+                )
+
+    def clear(self) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(f'INSERT INTO "{self.index_table}" ("{self.index_table}") VALUES (\'delete-all\')')
+            cursor.execute(f'DELETE FROM "{self.table}"')
+
+    def bulk_index(self, rows):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO "{self.table}" (message_pair_id, conversation_id) VALUES (%s, %s)',
+                [(row[0], row[2]) for row in rows]
+            )
+            cursor.executemany(
+                f'INSERT INTO "{self.index_table}" (rowid, user_message, ai_message, owner) VALUES (%s, %s, %s, %s)',
+                [(row[0], row[3], row[4], self._owner_token(row[1])) for row in rows]
+            )
+
+    def search(self, user_id, query, page=1, page_size=20) -> SearchPage:
+        result_page = SearchPage(query=query, page=page, page_size=page_size)
+        terms = _query_terms(query)
+        if not terms:
+            return result_page
+
+        with connection.cursor() as cursor:
+            # Fetch one extra row to know whether a next page exists without a COUNT(*).
+            # FTS5 ranks are negative bm25 scores, lower is better
+            cursor.execute(
+                f'SELECT f.rowid, s.conversation_id, c.title, m.user_message, m.ai_message, -f.rank, m.created_at, '
+                f'c.archived_at IS NOT NULL, c.archive_segment, c.archive_offset, c.archive_length '
+                f'FROM "{self.index_table}" f '
+                f'JOIN "{self.table}" s ON s.message_pair_id = f.rowid '
+                f'JOIN "conversations" c ON c.conversation_id = s.conversation_id '
+                f'LEFT JOIN "MessagePair" m ON m.message_pair_id = f.rowid '
+                f'WHERE "{self.index_table}" MATCH %s '
+                f'AND (m.message_pair_id IS NOT NULL OR c.archived_at IS NOT NULL) '
+                f'ORDER BY f.rank LIMIT %s OFFSET %s',
+                [self._match_expression(user_id, terms), page_size + 1, (page - 1) * page_size]
+            )
+            rows = cursor.fetchall()
+
+        result_page.has_next = len(rows) > page_size
+        result_page.results = self._build_hits(rows[:page_size], terms)
+        return result_page
+
+
+class PostgresFullTextSearchBackend(ChatSearchBackend):
+    """
+    PostgreSQL tsvector implementation backed by a GIN index.
+    The side table keeps the tsvector only, snippets are built from the message pair itself
+    or, once the conversation is archived, from its archive frame.
+    Deletes are propagated by the ON DELETE CASCADE foreign key to the conversation.
+    """
+
+    table = 'MessagePairSearch'
+
+    def index_message_pair(self, message_pair_id, user_id, conversation_id, user_message, ai_message):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO "{self.table}" (message_pair_id, user_id, conversation_id, document) '
+                "VALUES (%s, %s, %s, setweight(to_tsvector('english', %s), 'A') || to_tsvector('english', %s)) "
+                'ON CONFLICT (message_pair_id) DO UPDATE SET document = EXCLUDED.document',
+                [message_pair_id, user_id, conversation_id, user_message, ai_message]
+            )
+
+    def clear(self) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE "{self.table}"')
+
+    def bulk_index(self, rows):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO "{self.table}" (message_pair_id, user_id, conversation_id, document) '
+                "VALUES (%s, %s, %s, setweight(to_tsvector('english', %s), 'A') || to_tsvector('english', %s))",
+                rows
+            )
+
+    def search(self, user_id, query, page=1, page_size=20) -> SearchPage:
+        result_page = SearchPage(query=query, page=page, page_size=page_size)
+        terms = _query_terms(query)
+        if not terms:
+            return result_page
+
+        with connection.cursor() as cursor:
+            # Rank and paginate on the index first, then load the message pairs of the page only
+            cursor.execute(
+                'WITH q AS (SELECT websearch_to_tsquery(\'english\', %s) AS query), '
+                'ranked AS ('
+                f'  SELECT s.message_pair_id, s.conversation_id, ts_rank_cd(s.document, q.query) AS rank '
+                f'  FROM "{self.table}" s, q '
+                '  WHERE s.user_id = %s AND s.document @@ q.query '
+                '  ORDER BY rank DESC LIMIT %s OFFSET %s'
+                ') '
+                'SELECT r.message_pair_id, r.conversation_id, c.title, m.user_message, m.ai_message, r.rank, '
+                'm.created_at, c.archived_at IS NOT NULL, c.archive_segment, c.archive_offset, c.archive_length '
+                'FROM ranked r '
+                'JOIN "conversations" c ON c.conversation_id = r.conversation_id '
+                'LEFT JOIN "MessagePair" m ON m.message_pair_id = r.message_pair_id '
+                'WHERE m.message_pair_id IS NOT NULL OR c.archived_at IS NOT NULL '
+                'ORDER BY r.rank DESC',
+                [query, user_id, page_size + 1, (page - 1) * page_size]
+            )
+            rows = cursor.fetchall()
+
+        result_page.has_next = len(rows) > page_size
+        result_page.results = self._build_hits(rows[:page_size], terms)
+        return result_page
+
+
+def get_search_backend() -> Optional[ChatSearchBackend]:
+    """Return the search backend for the active database, or None if full-text search is unsupported"""
+    if connection.vendor == 'sqlite':
+        return SQLiteFTS5SearchBackend()
+    if connection.vendor == 'postgresql':
+        return PostgresFullTextSearchBackend()
+    return None
@@ -1,12 +1,18 @@
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import F
 from asgiref.sync import sync_to_async
 from typing import List, Dict
 from abc import ABC, abstractmethod
 from typing import List, Dict, Optional
 from dataclasses import dataclass
+from datetime import datetime
 from src.globals.configs import ChatStorageType
 from core_web.models import Conversation, MessagePair
+from src.storage.chat_search import SearchPage, get_search_backend
+from src.storage.conversation_archive import rehydrate_conversation
+from src.storage.message_codec import get_message_codec
 
 
 @dataclass
@@ -22,6 +28,26 @@ class MessageData:
     error_message: str = ""
 
 
+@dataclass
+class ConversationState:
+    """Data class to represent the denormalized state of a conversation"""
+    conversation_id: int
+    title: str
+    latest_summary: Optional[str]
+    message_count: int
+    last_message_at: datetime
+    token_total: int
+
+
+def count_tokens(tokens_used: Optional[Dict]) -> int:
+    """Total number of tokens recorded in a tokens_used breakdown"""
+    if not tokens_used:
+        return 0
+    if 'total_tokens' in tokens_used:
+        return int(tokens_used['total_tokens'] or 0)
+    return int(tokens_used.get('input_tokens') or 0) + int(tokens_used.get('output_tokens') or 0)
+
+
 class ChatStorageInterface(ABC):
     """Abstract interface for chat storage operations"""
     
@@ -47,11 +73,21 @@ class ChatStorageInterface(ABC):
         """
         pass
     
+    @abstractmethod
+    async def get_conversation_state(self, conversation_id: str) -> Optional[ConversationState]:
+        """Get the summary, counters and last activity of a conversation"""
+        pass
+    
     @abstractmethod
     async def get_user_conversations(self, user_id: int) -> List[Dict]:
         """Get all conversations for a user"""
         pass
 
+    @abstractmethod
+    async def search_messages(self, user_id: int, query: str, page: int = 1, page_size: int = 20) -> SearchPage:
+        """Full-text search over the message history of a user, ranked and paginated"""
+        pass
+
 class DjangoStorage(ChatStorageInterface):
     """Django implementation of chat storage"""
     
@@ -69,12 +105,22 @@ class DjangoStorage(ChatStorageInterface):
         """Save a message pair to the conversation"""
         try:
             conversation = await Conversation.objects.aget(conversation_id=conversation_id)
-            
-            # Create message pair
-            await sync_to_async(MessagePair.objects.create)(
+            if conversation.archived_at:
+                await sync_to_async(rehydrate_conversation)(conversation)
+            await sync_to_async(self._create_message_pair)(conversation, message_data)
+            return True
+        except ObjectDoesNotExist:
+            return False
+
+    @staticmethod
+    def _create_message_pair(conversation: Conversation, message_data: MessageData) -> MessagePair:
+        """Create the message pair, its search index entry and the conversation state in a single transaction"""
+        codec = get_message_codec()
+        with transaction.atomic():
+            pair = MessagePair.objects.create(
                 conversation=conversation,
-                user_message=message_data.user_message,
-                ai_message=message_data.ai_message,
+                user_message=codec.encode(message_data.user_message),
+                ai_message=codec.encode(message_data.ai_message),
                 summary=message_data.summary,
                 tokens_used=message_data.tokens_used or {},
                 model_version=message_data.model_version,
@@ -82,9 +128,24 @@ class DjangoStorage(ChatStorageInterface):
                 processing_time=message_data.processing_time,
                 error_message=message_data.error_message
             )
-            return True
-        except ObjectDoesNotExist:
-            return False
+
+            search_backend = get_search_backend()
+            if search_backend:
+                search_backend.index_message_pair(
+                    message_pair_id=pair.message_pair_id,
+                    user_id=conversation.user_id,
+                    conversation_id=conversation.conversation_id,
+                    user_message=message_data.user_message,
+                    ai_message=message_data.ai_message,
+                )
+
+            Conversation.objects.filter(conversation_id=conversation.conversation_id).update(
+                latest_summary=pair.summary,
+                message_count=F('message_count') + 1,
+                last_message_at=pair.created_at,
+                token_total=F('token_total') + count_tokens(pair.tokens_used),
+            )
+        return pair
     
     async def load_conversation(self, conversation_id: str, limit: Optional[int] = None) -> List[MessageData]:
         """
@@ -97,19 +158,23 @@ class DjangoStorage(ChatStorageInterface):
         """
         try:
             conversation = await Conversation.objects.aget(conversation_id=conversation_id)
-            messages = []
+            if conversation.archived_at:
+                await sync_to_async(rehydrate_conversation)(conversation)
 
-            # Get message pairs ordered by creation time, newest first
-            message_pairs = await sync_to_async(list)(conversation.message_pairs.all().order_by('-created_at'))
+            codec = get_message_codec()
+            messages = []
 
-            # Apply limit if specified
+            # Get message pairs newest first. Ids are assigned in insertion order, so ordering by
+            # message_pair_id walks the (conversation, message_pair_id) index and the limit is
+            # applied in SQL instead of loading the whole thread
+            message_pairs = MessagePair.objects.filter(conversation_id=conversation.conversation_id).order_by('-message_pair_id')
             if limit is not None:
                 message_pairs = message_pairs[:limit]
 
-            for pair in message_pairs:
+            async for pair in message_pairs:
                 messages.append(MessageData(
-                    user_message=pair.user_message,
-                    ai_message=pair.ai_message,
+                    user_message=codec.decode(pair.user_message),
+                    ai_message=codec.decode(pair.ai_message),
                     summary=pair.summary,
                     tokens_used=pair.tokens_used,
                     model_version=pair.model_version,
@@ -124,23 +189,34 @@ class DjangoStorage(ChatStorageInterface):
         except ObjectDoesNotExist:
             return []
         
+    async def get_conversation_state(self, conversation_id: str) -> Optional[ConversationState]:
+        """Get the summary, counters and last activity of a conversation"""
+        state = await Conversation.objects.filter(conversation_id=conversation_id).values(
+            'conversation_id', 'title', 'latest_summary', 'message_count', 'last_message_at', 'token_total'
+        ).afirst()
+        return ConversationState(**state) if state else None
+
     async def get_user_conversations(self, user_id: int) -> List[Dict]:
-        """Get all conversations for a user"""
-        User = get_user_model()
-        try:
-            user = await User.objects.aget(id=user_id)
-            return [
-                {
-                    'id': str(conv.id),
-                    'title': conv.title or 'Untitled',
-                    'created_at': conv.created_at,
-                    'updated_at': conv.updated_at,
-                    'message_count': await conv.message_pairs.count()
-                }
-                for conv in await user.conversations.all()
-            ]
-        except ObjectDoesNotExist:
-            return []
+        """Get all conversations for a user, most recently active first"""
+        conversations = Conversation.objects.filter(user_id=user_id).order_by('-last_message_at')
+        return [
+            {
+                'id': str(conv.conversation_id),
+                'title': conv.title or 'Untitled',
+                'created_at': conv.created_at,
+                'updated_at': conv.updated_at,
+                'last_message_at': conv.last_message_at,
+                'message_count': conv.message_count,
+            }
+            async for conv in conversations
+        ]
+
+    async def search_messages(self, user_id: int, query: str, page: int = 1, page_size: int = 20) -> SearchPage:
+        """Full-text search over the message history of a user, ranked and paginated"""
+        search_backend = get_search_backend()
+        if search_backend is None:
+            raise ValueError("Full-text search is not supported on this database")
+        return await sync_to_async(search_backend.search)(user_id, query, page, page_size)
         
 class StorageManager:
     """Interface to manage chat storage operations"""
@@ -170,7 +246,14 @@ class StorageManager:
         """
         return await self.storage.load_conversation(conversation_id, limit)
     
+    async def get_conversation_state(self, conversation_id: str) -> Optional[ConversationState]:
+        """Get the summary, counters and last activity of a conversation"""
+        return await self.storage.get_conversation_state(conversation_id)
+    
     async def get_user_conversations(self, user_id: int) -> List[Dict]:
         """Get all conversations for a user"""
         return await self.storage.get_user_conversations(user_id)
-    
\ No newline at end of file
+
+    async def search_messages(self, user_id: int, query: str, page: int = 1, page_size: int = 20) -> SearchPage:
+        """Full-text search over the message history of a user, ranked and paginated"""
+        return await self.storage.search_messages(user_id, query, page, page_size)
@@ -0,0 +1,144 @@
+"""
+Connection reuse benchmark for AsyncPineconeStrategy.
+
+A local aiohttp server stands in for the Pinecone data plane. Every new TCP connection is
+delayed by `connect_delay` seconds on its first request to model connection and TLS setup.
+The same query workload is run once opening a fresh async index per call (the previous
+behaviour) and once through the strategy's shared index, and the number of connections
+accepted by the server is reported next to the latencies.
+
+Run it from the Jarvis directory:
+    python -m src.storage.connection_benchmark --requests 200 --concurrency 16
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from dataclasses import dataclass, field
+from typing import List, Set
+from aiohttp import web
+from src.storage.vector_store import AsyncPineconeStrategy, VectorDBConfig
+
+
+@dataclass
+class BenchmarkResult:
+    mode: str
+    latencies_ms: List[float] = field(default_factory=list)
+    connections: int = 0
+    elapsed: float = 0.0
+
+    def __str__(self):
+        latencies = sorted(self.latencies_ms)
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        return (
+            f"{self.mode:10} requests={len(latencies):5} connections={self.connections:5} "
+            f"p50={statistics.median(latencies):7.2f}ms p95={p95:7.2f}ms "
+            f"throughput={len(latencies) / self.elapsed:8.1f} req/s"
+        )
+
+
+class PineconeStandIn:
+    """Minimal HTTP server answering the data plane routes used by the strategy"""
+
+    def __init__(self, dimension: int = 8, connect_delay: float = 0.02):
+        self.dimension = dimension
+        self.connect_delay = connect_delay
+        self.transports: Set[int] = set()
+        self.runner = None
+        self.url = None
+
+    async def _on_request(self, request: web.Request) -> None:
+        transport_id = id(request.transport)
+        if transport_id not in self.transports:
+            self.transports.add(transport_id)
+            await asyncio.sleep(self.connect_delay)
+
+    async def query(self, request: web.Request) -> web.Response:
+        await self._on_request(request)
+        body = await request.json()
+        matches = [
+            {"id": str(i), "score": 1.0 - i / 100, "values": [0.1] * self.dimension, "metadata": {"rank": i}}
+            for i in range(body.get("topK", 5))
+        ]
+        return web.json_response({"matches": matches, "namespace": body.get("namespace", "")})
+
+    async def upsert(self, request: web.Request) -> web.Response:
+        await self._on_request(request)
+        body = await request.json()
+        return web.json_response({"upsertedCount": len(body.get("vectors", []))})
+
+    async def delete(self, request: web.Request) -> web.Response:
+        await self._on_request(request)
+        return web.json_response({})
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post('/query', self.query)
+        app.router.add_post('/vectors/upsert', self.upsert)
+        app.router.add_post('/vectors/delete', self.delete)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    async def stop(self) -> None:
+        await self.runner.cleanup()
+
+
+async def _run(mode: str, strategy: AsyncPineconeStrategy, server: PineconeStandIn,
+               requests: int, concurrency: int, dimension: int) -> BenchmarkResult:
+    result = BenchmarkResult(mode=mode)
+    semaphore = asyncio.Semaphore(concurrency)
+    query_vector = [0.1] * dimension
+
+    async def one_query():
+        async with semaphore:
+            start_time = time.perf_counter()
+            if mode == 'per-call':
+                async with strategy.pc.IndexAsyncio(host=strategy.config.config_dict['host']) as idx:
+                    await idx.query(namespace='bench', vector=query_vector, top_k=5, include_values=True,
+                                    include_metadata=True)
+            else:
+                await strategy.query_vectors('bench', query_vector, top_k=5)
+            result.latencies_ms.append((time.perf_counter() - start_time) * 1000)
+
+    server.transports.clear()
+    start_time = time.perf_counter()
+    await asyncio.gather(*(one_query() for _ in range(requests)))
+    result.elapsed = time.perf_counter() - start_time
+    result.connections = len(server.transports)
+    return result
+
+
+async def run_benchmark(requests: int = 200, concurrency: int = 16, pool_size: int = 16,
+                        dimension: int = 8, connect_delay: float = 0.02) -> List[BenchmarkResult]:
+    server = PineconeStandIn(dimension=dimension, connect_delay=connect_delay)
+    host = await server.start()
+    strategy = AsyncPineconeStrategy(VectorDBConfig(config_dict={
+        'api_key': 'benchmark', 'host': host, 'db_type': 'pinecone', 'connection_pool_maxsize': pool_size,
+    }))
+    await strategy.initialize()
+    try:
+        return [
+            await _run('per-call', strategy, server, requests, concurrency, dimension),
+            await _run('shared', strategy, server, requests, concurrency, dimension),
+        ]
+    finally:
+        await strategy.cleanup()
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-call and shared async index connections")
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--pool-size', type=int, default=16)
+    parser.add_argument('--connect-delay', type=float, default=0.02, help="Simulated connection setup in seconds")
+    args = parser.parse_args()
+
+    for benchmark_result in asyncio.run(run_benchmark(args.requests, args.concurrency, args.pool_size,
+                                                      connect_delay=args.connect_delay)):
+        print(benchmark_result)
@@ -0,0 +1,266 @@
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from core_web.models import Conversation, MessagePair
+from src.storage.chat_search import get_search_backend
+from src.storage.message_codec import CURRENT_DICTIONARY_VERSION, SHARED_DICTIONARIES, get_message_codec
+
+logger = logging.getLogger(__name__)
+
+# Frame layout: magic, dictionary version, payload length, crc32 of payload, payload
+FRAME_MAGIC = b'JCA1'
+FRAME_HEADER = struct.Struct('<4sHII')
+
+# Message pair columns carried in archive frames and streamed exports
+MESSAGE_PAIR_FIELDS = [
+    'message_pair_id', 'user_message', 'user_message_timestamp', 'ai_message', 'ai_message_timestamp',
+    'summary', 'tokens_used', 'model_version', 'status', 'processing_time', 'error_message',
+    'created_at', 'updated_at',
+]
+DATETIME_FIELDS = ('user_message_timestamp', 'ai_message_timestamp', 'created_at', 'updated_at')
+
+
+def serialize_message_pair(pair: MessagePair) -> Dict:
+    """Plain-JSON representation of a message pair with decoded message text"""
+    codec = get_message_codec()
+    row = {name: getattr(pair, name) for name in MESSAGE_PAIR_FIELDS}
+    row['user_message'] = codec.decode(row['user_message'])
+    row['ai_message'] = codec.decode(row['ai_message'])
+    for name in DATETIME_FIELDS:
+        row[name] = row[name].isoformat() if row[name] else None
+    return row
+
+
+def restore_message_pairs(conversation: Conversation, rows: List[Dict], batch_size: int = 500) -> List[MessagePair]:
+    """
+    Recreate message pairs from serialized rows, keeping their ids and timestamps.
+    Rows whose id already exists are left untouched. Must run inside a transaction.
+    """
+    codec = get_message_codec()
+    pairs, timestamps = [], []
+    for row in rows:
+        values = dict(row)
+        for name in DATETIME_FIELDS:
+            values[name] = parse_datetime(values[name]) if values.get(name) else None
+        values['user_message'] = codec.encode(values['user_message'])
+        values['ai_message'] = codec.encode(values['ai_message'])
+        timestamps.append((values.get('ai_message_timestamp'), values.get('updated_at')))
+        pairs.append(MessagePair(
+            conversation=conversation,
+            **{name: values[name] for name in MESSAGE_PAIR_FIELDS if values.get(name) is not None},
+        ))
+    if not pairs:
+        return []
+
+    MessagePair.objects.bulk_create(pairs, batch_size=batch_size, ignore_conflicts=True)
+
+    # auto_now fields are overwritten by bulk_create, put the original values back
+    for pair, (ai_message_timestamp, updated_at) in zip(pairs, timestamps):
+        pair.ai_message_timestamp = ai_message_timestamp or pair.ai_message_timestamp
+        pair.updated_at = updated_at or pair.updated_at
+    MessagePair.objects.bulk_update(pairs, ['ai_message_timestamp', 'updated_at'], batch_size=batch_size)
+
+    search_backend = get_search_backend()
+    if search_backend:
+        for pair, row in zip(pairs, rows):
+            search_backend.index_message_pair(
+                message_pair_id=pair.message_pair_id,
+                user_id=conversation.user_id,
+                conversation_id=conversation.conversation_id,
+                user_message=row['user_message'],
+                ai_message=row['ai_message'],
+            )
+    return pairs
+
+
+class ConversationArchive:
+    """
+    Append-only segment files holding compressed conversations.
+
+    Each archived conversation is one frame appended to the active segment; its location
+    (segment name, offset, length) is recorded on the Conversation row. Frames are never
+    rewritten, segments roll over once they exceed `segment_size` bytes.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, archive_dir: Optional[str] = None, segment_size: Optional[int] = None):
+        self.archive_dir = Path(archive_dir or getattr(settings, 'CONVERSATION_ARCHIVE_DIR', settings.BASE_DIR / 'archive'))
+        self.segment_size = segment_size or getattr(settings, 'CONVERSATION_ARCHIVE_SEGMENT_SIZE', 64 * 1024 * 1024)
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+
+    def _active_segment(self) -> str:
+        segments = sorted(self.archive_dir.glob('segment-*.jca'))
+        if segments and segments[-1].stat().st_size < self.segment_size:
+            return segments[-1].name
+        next_number = int(segments[-1].stem.split('-')[1]) + 1 if segments else 1
+        return f"segment-{next_number:06d}.jca"
+
+    @staticmethod
+    def encode_frame(document: Dict) -> bytes:
+        data = json.dumps(document, separators=(',', ':')).encode('utf-8')
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=SHARED_DICTIONARIES[CURRENT_DICTIONARY_VERSION])
+        payload = compressor.compress(data) + compressor.flush()
+        return FRAME_HEADER.pack(FRAME_MAGIC, CURRENT_DICTIONARY_VERSION, len(payload), zlib.crc32(payload)) + payload
+
+    @staticmethod
+    def decode_frame(frame: bytes) -> Dict:
+        magic, version, length, checksum = FRAME_HEADER.unpack_from(frame)
+        payload = frame[FRAME_HEADER.size:FRAME_HEADER.size + length]
+        if magic != FRAME_MAGIC or len(payload) != length or zlib.crc32(payload) != checksum:
+            raise ValueError("Corrupted conversation archive frame")
+        decompressor = zlib.decompressobj(-15, zdict=SHARED_DICTIONARIES[version])
+        return json.loads(decompressor.decompress(payload) + decompressor.flush())
+
+    def append(self, documents: Iterable[Dict]) -> List[Tuple[str, int, int]]:
+        """Append documents as frames and return their (segment, offset, length) locations"""
+        locations = []
+        with self._lock:
+            segment = self._active_segment()
+            with open(self.archive_dir / segment, 'ab') as handle:
+                for document in documents:
+                    frame = self.encode_frame(document)
+                    offset = handle.tell()
+                    handle.write(frame)
+                    locations.append((segment, offset, len(frame)))
+                # Frames must be durable before the rows they replace are deleted
+                handle.flush()
+                os.fsync(handle.fileno())
+        return locations
+
+    def read(self, segment: str, offset: int, length: int) -> Dict:
+        with open(self.archive_dir / segment, 'rb') as handle:
+            handle.seek(offset)
+            return self.decode_frame(handle.read(length))
+
+
+def archive_idle_conversations(idle_days: int, batch_size: int = 100, archive: Optional[ConversationArchive] = None) -> int:
+    """
+    Move the message pairs of conversations idle for more than `idle_days` into the archive.
+
+    Work is done in batches of `batch_size` conversations. Frames are written outside of any
+    transaction; each batch then takes one short write transaction to mark the conversations
+    and delete their rows. Messages saved while a batch is in flight are kept in the table and
+    merged back on rehydration. Archived messages stay in the search index, their hits are
+    flagged as archived and take their snippets from the frame.
+
+    Returns:
+        Number of archived conversations
+    """
+    archive = archive or ConversationArchive()
+    cutoff = timezone.now() - timedelta(days=idle_days)
+    candidates = (
+        Conversation.objects
+        .filter(archived_at__isnull=True, last_message_at__lt=cutoff, message_count__gt=0)
+        .order_by('conversation_id')
+        .values_list('conversation_id', flat=True)
+    )
+
+    archived_total, last_id = 0, 0
+    while True:
+        conversation_ids = list(candidates.filter(conversation_id__gt=last_id)[:batch_size])
+        if not conversation_ids:
+            break
+        last_id = conversation_ids[-1]
+
+        pairs_by_conversation: Dict[int, List[Dict]] = {conversation_id: [] for conversation_id in conversation_ids}
+        max_pair_id = 0
+        for pair in MessagePair.objects.filter(conversation_id__in=conversation_ids).order_by('message_pair_id').iterator(chunk_size=1000):
+            pairs_by_conversation[pair.conversation_id].append(serialize_message_pair(pair))
+            max_pair_id = pair.message_pair_id
+
+        locations = archive.append(
+            {'conversation_id': conversation_id, 'message_pairs': rows}
+            for conversation_id, rows in pairs_by_conversation.items()
+        )
+
+        archived_at = timezone.now()
+        with transaction.atomic():
+            conversations = list(Conversation.objects.filter(conversation_id__in=conversation_ids, archived_at__isnull=True))
+            location_by_id = dict(zip(pairs_by_conversation.keys(), locations))
+            for conversation in conversations:
+                conversation.archived_at = archived_at
+                conversation.archive_segment, conversation.archive_offset, conversation.archive_length = \
+                    location_by_id[conversation.conversation_id]
+            Conversation.objects.bulk_update(
+                conversations, ['archived_at', 'archive_segment', 'archive_offset', 'archive_length']
+            )
+            # Only rows that were written to the archive are removed
+            MessagePair.objects.filter(
+                conversation_id__in=[conversation.conversation_id for conversation in conversations],
+                message_pair_id__lte=max_pair_id,
+            ).delete()
+
+        archived_total += len(conversations)
+        logger.info(f"Archived {len(conversations)} conversations (up to id {last_id})")
+
+    return archived_total
+
+
+def rehydrate_conversation(conversation: Conversation, archive: Optional[ConversationArchive] = None) -> bool:
+    """Restore the message pairs of an archived conversation. Returns False if it was not archived."""
+    if conversation.archived_at is None:
+        return False
+
+    archive = archive or ConversationArchive()
+    document = archive.read(conversation.archive_segment, conversation.archive_offset, conversation.archive_length)
+
+    with transaction.atomic():
+        locked = Conversation.objects.select_for_update().get(conversation_id=conversation.conversation_id)
+        if locked.archived_at is None:
+            # Rehydrated concurrently
+            return False
+        restore_message_pairs(locked, document['message_pairs'])
+        Conversation.objects.filter(conversation_id=locked.conversation_id).update(
+            archived_at=None, archive_segment='', archive_offset=None, archive_length=None
+        )
+
+    conversation.archived_at, conversation.archive_segment = None, ''
+    conversation.archive_offset = conversation.archive_length = None
+    logger.info(f"Rehydrated conversation {conversation.conversation_id} with {len(document['message_pairs'])} messages")
+    return True
+
+
+def compress_existing_messages(batch_size: int = 500) -> int:
+    """
+    Re-encode stored message text with the configured codec, one short transaction per batch.
+
+    Returns:
+        Number of updated message pairs
+    """
+    codec = get_message_codec()
+    updated_total, last_id = 0, 0
+    while True:
+        pairs = list(
+            MessagePair.objects.filter(message_pair_id__gt=last_id)
+            .order_by('message_pair_id')
+            .only('message_pair_id', 'user_message', 'ai_message')[:batch_size]
+        )
+        if not pairs:
+            break
+        last_id = pairs[-1].message_pair_id
+
+        changed = []
+        for pair in pairs:
+            user_message = codec.encode(codec.decode(pair.user_message))
+            ai_message = codec.encode(codec.decode(pair.ai_message))
+            if user_message != pair.user_message or ai_message != pair.ai_message:
+                pair.user_message, pair.ai_message = user_message, ai_message
+                changed.append(pair)
+
+        if changed:
+            with transaction.atomic():
+                MessagePair.objects.bulk_update(changed, ['user_message', 'ai_message'])
+            updated_total += len(changed)
+
+    return updated_total
@@ -0,0 +1,252 @@
+import json
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, IO, Iterable, Iterator, List, Optional
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from core_web.models import Conversation, MessagePair
+from src.storage.chat_search import get_search_backend
+from src.storage.conversation_archive import (
+    DATETIME_FIELDS, MESSAGE_PAIR_FIELDS, ConversationArchive, serialize_message_pair
+)
+from src.storage.message_codec import get_message_codec
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_FIELDS = [
+    'conversation_id', 'title', 'latest_summary', 'message_count', 'last_message_at', 'token_total',
+    'created_at', 'updated_at',
+]
+CONVERSATION_DATETIME_FIELDS = ('last_message_at', 'created_at', 'updated_at')
+
+
+@dataclass
+class TransferStats:
+    """Counters reported by streaming exports and imports"""
+    conversations: int = 0
+    message_pairs: int = 0
+    skipped_conversations: int = 0
+    bytes: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def message_pairs_per_second(self) -> float:
+        return self.message_pairs / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def megabytes_per_second(self) -> float:
+        return self.bytes / (1024 * 1024) / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.conversations} conversations, {self.message_pairs} message pairs, "
+            f"{self.skipped_conversations} skipped, {self.bytes / (1024 * 1024):.1f} MiB in {self.elapsed:.2f}s "
+            f"({self.message_pairs_per_second:.0f} pairs/s, {self.megabytes_per_second:.1f} MiB/s)"
+        )
+
+
+def _serialize_conversation(conversation: Conversation) -> Dict:
+    row = {name: getattr(conversation, name) for name in CONVERSATION_FIELDS}
+    for name in CONVERSATION_DATETIME_FIELDS:
+        row[name] = row[name].isoformat() if row[name] else None
+    row['user_email'] = conversation.user.email
+    return {'type': 'conversation', **row}
+
+
+def iter_export_records(user_ids: Optional[List[int]] = None, chunk_size: int = 500) -> Iterator[Dict]:
+    """
+    Stream conversations followed by their message pairs as plain dicts.
+
+    Conversations are read with a chunked iterator; the message pairs of each chunk are fetched
+    with a single query, so memory stays bounded by `chunk_size` conversations. Archived
+    conversations are read straight from their segment without being rehydrated.
+    """
+    conversations = Conversation.objects.select_related('user').order_by('conversation_id')
+    if user_ids:
+        conversations = conversations.filter(user_id__in=user_ids)
+
+    chunk: List[Conversation] = []
+    for conversation in conversations.iterator(chunk_size=chunk_size):
+        chunk.append(conversation)
+        if len(chunk) >= chunk_size:
+            yield from _export_chunk(chunk)
+            chunk = []
+    if chunk:
+        yield from _export_chunk(chunk)
+
+
+def _export_chunk(conversations: List[Conversation]) -> Iterator[Dict]:
+    archive = ConversationArchive() if any(conversation.archived_at for conversation in conversations) else None
+    pairs = (
+        MessagePair.objects
+        .filter(conversation_id__in=[conversation.conversation_id for conversation in conversations])
+        .order_by('conversation_id', 'message_pair_id')
+        .iterator(chunk_size=1000)
+    )
+    pending_pair = next(pairs, None)
+
+    for conversation in conversations:
+        yield _serialize_conversation(conversation)
+
+        if conversation.archived_at:
+            document = archive.read(conversation.archive_segment, conversation.archive_offset, conversation.archive_length)
+            for row in document['message_pairs']:
+                yield {'type': 'message_pair', 'conversation_id': conversation.conversation_id, **row}
+
+        # Pairs come ordered by conversation, consume those belonging to this one
+        while pending_pair is not None and pending_pair.conversation_id == conversation.conversation_id:
+            yield {'type': 'message_pair', 'conversation_id': conversation.conversation_id,
+                   **serialize_message_pair(pending_pair)}
+            pending_pair = next(pairs, None)
+
+
+def iter_export_lines(user_ids: Optional[List[int]] = None, chunk_size: int = 500) -> Iterator[str]:
+    """Stream the export as NDJSON lines"""
+    for record in iter_export_records(user_ids=user_ids, chunk_size=chunk_size):
+        yield json.dumps(record, separators=(',', ':')) + '\n'
+
+
+def export_conversations(stream: IO[str], user_ids: Optional[List[int]] = None, chunk_size: int = 500) -> TransferStats:
+    """Write the NDJSON export to a text stream (plain or gzip) and return throughput stats"""
+    stats = TransferStats()
+    start_time = time.time()
+    for line in iter_export_lines(user_ids=user_ids, chunk_size=chunk_size):
+        stream.write(line)
+        stats.bytes += len(line)
+        if line.startswith('{"type":"conversation"'):
+            stats.conversations += 1
+        else:
+            stats.message_pairs += 1
+    stats.elapsed = time.time() - start_time
+    return stats
+
+
+class _ConversationImporter:
+    """Buffers NDJSON records and writes them with batched bulk_create calls"""
+
+    def __init__(self, batch_size: int, user=None):
+        self.batch_size = batch_size
+        self.user = user
+        self.codec = get_message_codec()
+        self.search_backend = get_search_backend()
+        self.users_by_email: Dict[str, Optional[int]] = {}
+        # exported conversation id -> (new conversation id, owner id), None when skipped
+        self.conversation_ids: Dict[int, Optional[tuple]] = {}
+        self.pending_conversations: List[tuple] = []
+        self.pending_pairs: List[tuple] = []
+        self.stats = TransferStats()
+
+    def _resolve_user_id(self, email: str) -> Optional[int]:
+        if self.user is not None:
+            return self.user.pk
+        if email not in self.users_by_email:
+            User = get_user_model()
+            self.users_by_email[email] = User.objects.filter(email=email).values_list('pk', flat=True).first()
+        return self.users_by_email[email]
+
+    def add_conversation(self, record: Dict) -> None:
+        user_id = self._resolve_user_id(record.get('user_email'))
+        if user_id is None:
+            logger.warning(f"Skipping conversation {record['conversation_id']}: unknown user {record.get('user_email')}")
+            self.conversation_ids[record['conversation_id']] = None
+            self.stats.skipped_conversations += 1
+            return
+
+        values = {name: record.get(name) for name in CONVERSATION_FIELDS if name != 'conversation_id'}
+        for name in CONVERSATION_DATETIME_FIELDS:
+            values[name] = parse_datetime(values[name]) if values.get(name) else None
+        conversation = Conversation(user_id=user_id, **{k: v for k, v in values.items() if v is not None})
+        self.pending_conversations.append((record['conversation_id'], conversation))
+        if len(self.pending_conversations) >= self.batch_size:
+            self.flush_conversations()
+
+    def add_message_pair(self, record: Dict) -> None:
+        exported_conversation_id = record['conversation_id']
+        if exported_conversation_id not in self.conversation_ids:
+            # The conversation is still buffered
+            self.flush_conversations()
+        if self.conversation_ids.get(exported_conversation_id) is None:
+            return
+        self.pending_pairs.append((exported_conversation_id, record))
+        if len(self.pending_pairs) >= self.batch_size:
+            self.flush_pairs()
+
+    def flush_conversations(self) -> None:
+        if not self.pending_conversations:
+            return
+        with transaction.atomic():
+            created = Conversation.objects.bulk_create([conversation for _, conversation in self.pending_conversations])
+        for (exported_id, _), conversation in zip(self.pending_conversations, created):
+            self.conversation_ids[exported_id] = (conversation.conversation_id, conversation.user_id)
+        self.stats.conversations += len(created)
+        self.pending_conversations = []
+
+    def flush_pairs(self) -> None:
+        if not self.pending_pairs:
+            return
+        pairs, timestamps = [], []
+        for exported_conversation_id, record in self.pending_pairs:
+            values = {name: record.get(name) for name in MESSAGE_PAIR_FIELDS if name != 'message_pair_id'}
+            for name in DATETIME_FIELDS:
+                values[name] = parse_datetime(values[name]) if values.get(name) else None
+            values['user_message'] = self.codec.encode(values['user_message'])
+            values['ai_message'] = self.codec.encode(values['ai_message'])
+            timestamps.append((values['ai_message_timestamp'], values['updated_at']))
+            pairs.append(MessagePair(
+                conversation_id=self.conversation_ids[exported_conversation_id][0],
+                **{name: value for name, value in values.items() if value is not None},
+            ))
+
+        with transaction.atomic():
+            MessagePair.objects.bulk_create(pairs)
+            # auto_now fields are overwritten by bulk_create, put the exported values back
+            for pair, (ai_message_timestamp, updated_at) in zip(pairs, timestamps):
+                pair.ai_message_timestamp = ai_message_timestamp or pair.ai_message_timestamp
+                pair.updated_at = updated_at or pair.updated_at
+            MessagePair.objects.bulk_update(pairs, ['ai_message_timestamp', 'updated_at'])
+
+            if self.search_backend:
+                for pair, (exported_conversation_id, record) in zip(pairs, self.pending_pairs):
+                    conversation_id, user_id = self.conversation_ids[exported_conversation_id]
+                    self.search_backend.index_message_pair(
+                        message_pair_id=pair.message_pair_id,
+                        user_id=user_id,
+                        conversation_id=conversation_id,
+                        user_message=record['user_message'],
+                        ai_message=record['ai_message'],
+                    )
+
+        self.stats.message_pairs += len(pairs)
+        self.pending_pairs = []
+
+    def flush(self) -> None:
+        self.flush_conversations()
+        self.flush_pairs()
+
+
+def import_conversations(lines: Iterable[str], batch_size: int = 1000, user=None) -> TransferStats:
+    """
+    Import an NDJSON export produced by export_conversations.
+
+    Records are streamed and written with batched bulk_create calls, one transaction per batch.
+    New ids are assigned; conversations are matched to users by email unless `user` is given,
+    in which case every conversation is imported for that user.
+    """
+    importer = _ConversationImporter(batch_size=batch_size, user=user)
+    start_time = time.time()
+    for line in lines:
+        if not line.strip():
+            continue
+        importer.stats.bytes += len(line)
+        record = json.loads(line)
+        if record['type'] == 'conversation':
+            importer.add_conversation(record)
+        elif record['type'] == 'message_pair':
+            importer.add_message_pair(record)
+        else:
+            raise ValueError(f"Unknown export record type: {record['type']}")
+    importer.flush()
+    importer.stats.elapsed = time.time() - start_time
+    return importer.stats
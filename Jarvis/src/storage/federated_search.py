@@ -0,0 +1,146 @@
+"""
+Federated retrieval across several namespaces or backends.
+
+One query vector is sent to every source at the same time and the results are merged
+into a single top_k:
+
+    score   weight x similarity, for sources embedded with the same model; L2 distances
+            are turned into 1 / (1 + distance) first so higher is better everywhere
+    rrf     weighted reciprocal rank fusion, for sources whose scores are not comparable
+
+Each source has its own timeout and the request an overall one. A source that is too slow
+or fails is reported in FederatedResult.sources and left out, so the caller still gets the
+matches of the others instead of an error.
+"""
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+from src.storage.hybrid_search import DEFAULT_RRF_K
+from src.storage.vector_store import AsyncVectorDBStrategy, VectorData
+
+
+@dataclass
+class FederatedSource:
+    '''
+    One namespace of one backend taking part in a federated query.
+
+    Args:
+        strategy: backend holding the namespace
+        namespace: namespace to query
+        weight: multiplier of the source's scores (or of its reciprocal ranks for 'rrf')
+        timeout: seconds the source may take, None for the request timeout only
+        top_k: matches fetched from the source, defaults to the request's top_k
+        filter: metadata filter applied to this source only
+        metric: 'cosine', 'dot' or 'l2', tells how to read the source's scores
+        name: label of the source in the result, defaults to the namespace
+    '''
+    strategy: AsyncVectorDBStrategy
+    namespace: str
+    weight: float = 1.0
+    timeout: Optional[float] = None
+    top_k: Optional[int] = None
+    filter: Optional[Dict[str, Any]] = None
+    metric: str = 'cosine'
+    name: Optional[str] = None
+
+    @property
+    def label(self) -> str:
+        return self.name or self.namespace
+
+
+@dataclass
+class FederatedMatch:
+    source: str
+    match: VectorData
+    # Merged score the global ranking is based on
+    score: float
+
+
+@dataclass
+class SourceReport:
+    # 'ok', 'timeout' or 'error'
+    status: str
+    matches: int = 0
+    milliseconds: float = 0.0
+    error: Optional[str] = None
+
+
+@dataclass
+class FederatedResult:
+    matches: List[FederatedMatch]
+    sources: Dict[str, SourceReport] = field(default_factory=dict)
+
+    @property
+    def partial(self) -> bool:
+        '''True when at least one source did not answer'''
+        return any(report.status != 'ok' for report in self.sources.values())
+
+
+def similarity(score: Optional[float], metric: str) -> float:
+    '''Score of a match as a similarity, higher is better'''
+    if score is None:
+        return 0.0
+    return 1.0 / (1.0 + score) if metric == 'l2' else float(score)
+
+
+def merge_matches(sources: Sequence[FederatedSource], results: Dict[str, List[VectorData]], top_k: int,
+                  merge: str = 'score', rrf_k: int = DEFAULT_RRF_K) -> List[FederatedMatch]:
+    '''Global top_k of the per-source results; matches keep the source they came from'''
+    if merge not in ('score', 'rrf'):
+        raise ValueError(f"Unsupported merge: {merge}")
+    merged = []
+    for source in sources:
+        for rank, match in enumerate(results.get(source.label, []), start=1):
+            if merge == 'score':
+                score = source.weight * similarity(match.score, source.metric)
+            else:
+                score = source.weight / (rrf_k + rank)
+            merged.append(FederatedMatch(source.label, match, score))
+    merged.sort(key=lambda item: item.score, reverse=True)
+    return merged[:top_k]
+
+
+async def federated_query(sources: Sequence[FederatedSource], query_vector: List[float], top_k: int = 5,
+                          timeout: Optional[float] = None, merge: str = 'score',
+                          rrf_k: int = DEFAULT_RRF_K) -> FederatedResult:
+    '''
+    Query every source concurrently and merge their matches into one top_k. Sources past
+    their own timeout, or still running at the request `timeout`, are cancelled and
+    reported; the result then holds the matches of the sources that answered.
+    '''
+    labels = [source.label for source in sources]
+    if len(set(labels)) != len(labels):
+        raise ValueError("Federated sources need distinct names")
+    reports: Dict[str, SourceReport] = {}
+    results: Dict[str, List[VectorData]] = {}
+
+    async def run(source: FederatedSource) -> None:
+        start_time = time.perf_counter()
+        try:
+            matches = await asyncio.wait_for(
+                source.strategy.query_vectors(source.namespace, query_vector, source.top_k or top_k,
+                                              filter=source.filter),
+                source.timeout,
+            )
+            results[source.label] = matches
+            reports[source.label] = SourceReport('ok', len(matches), (time.perf_counter() - start_time) * 1000)
+        except asyncio.TimeoutError:
+            reports[source.label] = SourceReport('timeout', milliseconds=(time.perf_counter() - start_time) * 1000)
+        except Exception as e:
+            print(f"Error querying {source.label}: {e}")
+            reports[source.label] = SourceReport('error', milliseconds=(time.perf_counter() - start_time) * 1000,
+                                                 error=str(e))
+
+    start_time = time.perf_counter()
+    tasks = {asyncio.ensure_future(run(source)): source for source in sources}
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            for task in pending:
+                reports[tasks[task].label] = SourceReport('timeout', milliseconds=(time.perf_counter() - start_time) * 1000)
+    return FederatedResult(merge_matches(sources, results, top_k, merge, rrf_k),
+                           {label: reports[label] for label in labels})
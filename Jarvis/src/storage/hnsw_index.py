@@ -0,0 +1,423 @@
+"""
+Hierarchical Navigable Small World graph index for the local vector store.
+
+The index does not own vectors: nodes are the row numbers of a LocalNamespace and distances
+are computed against its matrix, so memory overhead is the adjacency lists only. Rows are
+immutable once indexed (the namespace appends a new row when a vector is overwritten) and
+tombstoned rows stay in the graph as routing nodes until the namespace is compacted. Compaction
+then drops them and renumbers the graph; nodes that lost links are reconnected through the
+removed nodes' neighbours instead of rebuilding the index.
+
+Run the module to benchmark recall@k and latency against brute force:
+    python -m src.storage.hnsw_index --vectors 20000 --dimension 128
+"""
+import itertools
+import math
+import random
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+if TYPE_CHECKING:
+    from src.storage.local_vector_store import LocalNamespace
+
+
+# Candidates expanded together by a layer search
+EXPAND_BATCH = 16
+# Rows of a new graph linked at once by build(), the rest are inserted one by one. Candidates
+# are found by scoring these rows against each other, which grows with the square of their count
+BULK_BUILD_ROWS = 32768
+# Scores held at once while bulk building, 64 MiB of float32
+BUILD_BLOCK_ELEMENTS = 2 ** 24
+
+
+class HNSWIndex:
+    '''
+    HNSW graph over the rows of a LocalNamespace.
+
+    Args:
+        namespace: namespace whose matrix holds the vectors
+        m: links per node on the upper layers, layer 0 keeps 2 * m
+        ef_construction: candidate list size while inserting
+        ef_search: default candidate list size while querying
+    '''
+
+    def __init__(self, namespace: 'LocalNamespace', m: int = 16, ef_construction: int = 200, ef_search: int = 64,
+                 seed: int = 42):
+        self.namespace = namespace
+        self.m = m
+        self.m0 = 2 * m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.level_multiplier = 1 / math.log(max(m, 2))
+        self.random = random.Random(seed)
+        # links[row][level] -> neighbour rows
+        self.links: List[Optional[List[List[int]]]] = []
+        self.entry_point: Optional[int] = None
+        self.max_level = -1
+
+    def __len__(self) -> int:
+        return sum(1 for node in self.links if node is not None)
+
+    def _scores(self, query: np.ndarray, rows: Sequence[int]) -> np.ndarray:
+        '''Similarity of `query` to `rows`, higher is closer'''
+        rows = np.asarray(rows, dtype=np.int64)
+        products = self.namespace.matrix[rows] @ query
+        if self.namespace.metric == 'l2':
+            return 2 * products - self.namespace.norms[rows] - float(query @ query)
+        return products
+
+    def _score_block(self, block: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        '''Similarity of every row of `block` to `rows`, shape (block, rows)'''
+        products = self.namespace.matrix[block] @ self.namespace.matrix[rows].T
+        if self.namespace.metric == 'l2':
+            return 2 * products - self.namespace.norms[rows][None, :] - self.namespace.norms[block][:, None]
+        return products
+
+    def _search_layer(self, query: np.ndarray, entry_scores: np.ndarray, entry_rows: np.ndarray, ef: int, level: int,
+                      alive: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Best-first search of one layer. Returns up to `ef` (scores, rows), unordered.
+        When `alive` is given, dead rows are traversed but never returned.
+
+        Up to EXPAND_BATCH of the closest unexpanded candidates are expanded at a time: their
+        neighbours are gathered, filtered and scored with array operations instead of one by one.
+        '''
+        visited = np.zeros(len(self.links), dtype=bool)
+        visited[entry_rows] = True
+        candidate_scores, candidate_rows = entry_scores, entry_rows
+        if alive is None:
+            result_scores, result_rows = entry_scores, entry_rows
+        else:
+            keep = alive[entry_rows]
+            result_scores, result_rows = entry_scores[keep], entry_rows[keep]
+
+        while len(candidate_rows):
+            # Worst kept result: once ef results are held, farther candidates cannot improve them
+            bound = result_scores.min() if len(result_rows) >= ef else -np.inf
+            useful = candidate_scores >= bound
+            candidate_scores, candidate_rows = candidate_scores[useful], candidate_rows[useful]
+            if len(candidate_rows) > EXPAND_BATCH:
+                best = np.argpartition(-candidate_scores, EXPAND_BATCH - 1)[:EXPAND_BATCH]
+                expand = candidate_rows[best]
+                rest = np.ones(len(candidate_rows), dtype=bool)
+                rest[best] = False
+                candidate_scores, candidate_rows = candidate_scores[rest], candidate_rows[rest]
+            else:
+                expand = candidate_rows
+                candidate_scores, candidate_rows = candidate_scores[:0], candidate_rows[:0]
+
+            links = self.links
+            neighbours = np.fromiter(
+                itertools.chain.from_iterable(links[row][level] for row in expand.tolist() if level < len(links[row])),
+                dtype=np.int64)
+            neighbours = np.unique(neighbours[~visited[neighbours]])
+            if not len(neighbours):
+                continue
+            visited[neighbours] = True
+            scores = self._scores(query, neighbours)
+            if len(result_rows) >= ef:
+                closer = scores > bound
+                scores, neighbours = scores[closer], neighbours[closer]
+            candidate_scores = np.concatenate([candidate_scores, scores])
+            candidate_rows = np.concatenate([candidate_rows, neighbours])
+            if alive is not None:
+                keep = alive[neighbours]
+                scores, neighbours = scores[keep], neighbours[keep]
+            result_scores = np.concatenate([result_scores, scores])
+            result_rows = np.concatenate([result_rows, neighbours])
+            if len(result_rows) > ef:
+                best = np.argpartition(-result_scores, ef - 1)[:ef]
+                result_scores, result_rows = result_scores[best], result_rows[best]
+        return result_scores, result_rows
+
+    def _closest(self, query: np.ndarray, score: float, row: int, level: int) -> Tuple[float, int]:
+        '''Greedy walk of an upper layer from `row` to the node closest to the query'''
+        while True:
+            neighbours = self.links[row][level]
+            if not neighbours:
+                return score, row
+            scores = self._scores(query, neighbours)
+            best = int(np.argmax(scores))
+            if scores[best] <= score:
+                return score, row
+            score, row = float(scores[best]), neighbours[best]
+
+    def _select_neighbours(self, scores: np.ndarray, rows: np.ndarray, count: int) -> List[int]:
+        '''
+        Neighbour selection heuristic: a candidate is kept only if it is closer to the new
+        node than to every neighbour kept so far, which keeps links spread out. Remaining
+        slots are filled with the closest pruned candidates.
+        '''
+        order = np.argsort(-scores, kind='stable')
+        scores, rows = scores[order], np.asarray(rows, dtype=np.int64)[order]
+        if len(rows) <= count:
+            return rows.tolist()
+        vectors = self.namespace.matrix[rows]
+        norms = self.namespace.norms[rows]
+
+        # blocked[i]: candidate i is closer to a kept neighbour than to the new node
+        blocked = np.zeros(len(rows), dtype=bool)
+        selected: List[int] = []
+        position = 0
+        while len(selected) < count:
+            free = np.flatnonzero(~blocked[position:])
+            if not len(free):
+                position = len(rows)
+                break
+            position += int(free[0])
+            selected.append(position)
+            similarities = vectors @ vectors[position]
+            if self.namespace.metric == 'l2':
+                similarities = 2 * similarities - norms - norms[position]
+            blocked |= similarities > scores
+            position += 1
+        pruned = np.ones(position, dtype=bool)
+        pruned[selected] = False
+        return rows[selected + np.flatnonzero(pruned)[:count - len(selected)].tolist()].tolist()
+
+    def _random_level(self) -> int:
+        return int(-math.log(1.0 - self.random.random()) * self.level_multiplier)
+
+    def add(self, rows: Sequence[int]) -> None:
+        '''Insert rows of the namespace matrix into the graph'''
+        for row in rows:
+            self._insert(int(row))
+
+    def build(self, rows: Sequence[int]) -> None:
+        '''
+        Index rows into an empty graph. The first BULK_BUILD_ROWS are linked at once: on every
+        layer the candidates of a node are its exact ef_construction nearest nodes, found with
+        blocked matrix products instead of a graph search, and are selected and linked back
+        like on insert. Remaining rows are inserted one by one.
+        '''
+        rows = np.asarray(rows, dtype=np.int64)
+        if self.entry_point is not None:
+            self.add(rows)
+            return
+        bulk, rest = rows[:BULK_BUILD_ROWS], rows[BULK_BUILD_ROWS:]
+        if len(bulk):
+            levels = np.array([self._random_level() for _ in range(len(bulk))])
+            self.links.extend([None] * (int(bulk.max()) + 1 - len(self.links)))
+            for row, level in zip(bulk.tolist(), levels.tolist()):
+                self.links[row] = [[] for _ in range(level + 1)]
+            for level in range(int(levels.max()), -1, -1):
+                self._link_layer(bulk[levels >= level], level)
+            top = int(np.argmax(levels))
+            self.entry_point, self.max_level = int(bulk[top]), int(levels[top])
+        self.add(rest)
+
+    def _link_layer(self, nodes: np.ndarray, level: int) -> None:
+        '''Link all the nodes of one layer of build() from their exact nearest candidates'''
+        count = min(self.ef_construction, len(nodes) - 1)
+        if count <= 0:
+            return
+        step = max(BUILD_BLOCK_ELEMENTS // len(nodes), 1)
+        for start in range(0, len(nodes), step):
+            block = nodes[start:start + step]
+            scores = self._score_block(block, nodes)
+            # A node is not its own candidate
+            scores[np.arange(len(block)), np.arange(start, start + len(block))] = -np.inf
+            columns = np.argpartition(-scores, count - 1, axis=1)[:, :count]
+            best = np.take_along_axis(scores, columns, axis=1)
+            for row, row_columns, row_scores in zip(block.tolist(), columns, best):
+                self.links[row][level] = self._select_neighbours(row_scores, nodes[row_columns], self.m)
+
+        limit = self.m0 if level == 0 else self.m
+        incoming: Dict[int, List[int]] = {}
+        for row in nodes.tolist():
+            for neighbour in self.links[row][level]:
+                incoming.setdefault(neighbour, []).append(row)
+        for neighbour, rows in incoming.items():
+            links = self.links[neighbour][level]
+            links.extend(row for row in rows if row not in links)
+            if len(links) > limit:
+                # Shrink an overflowing neighbour list to its closest links
+                scores = self._scores(self.namespace.matrix[neighbour], links)
+                self.links[neighbour][level] = [links[i] for i in np.argsort(-scores)[:limit].tolist()]
+
+    def _insert(self, row: int) -> None:
+        if row < len(self.links) and self.links[row] is not None:
+            return
+        while len(self.links) <= row:
+            self.links.append(None)
+        level = self._random_level()
+        self.links[row] = [[] for _ in range(level + 1)]
+        if self.entry_point is None:
+            self.entry_point, self.max_level = row, level
+            return
+
+        query = self.namespace.matrix[row]
+        score, entry = float(self._scores(query, [self.entry_point])[0]), self.entry_point
+        for current in range(self.max_level, level, -1):
+            score, entry = self._closest(query, score, entry, current)
+        entry_scores, entry_rows = np.array([score], dtype=np.float32), np.array([entry], dtype=np.int64)
+
+        for current in range(min(level, self.max_level), -1, -1):
+            entry_scores, entry_rows = self._search_layer(query, entry_scores, entry_rows, self.ef_construction, current)
+            limit = self.m0 if current == 0 else self.m
+            neighbours = self._select_neighbours(entry_scores, entry_rows, self.m)
+            self.links[row][current] = neighbours
+            for neighbour in neighbours:
+                links = self.links[neighbour][current]
+                links.append(row)
+                if len(links) > limit:
+                    # Shrink an overflowing neighbour list to its closest links
+                    scores = self._scores(self.namespace.matrix[neighbour], links)
+                    self.links[neighbour][current] = [links[i] for i in np.argsort(-scores)[:limit].tolist()]
+
+        if level > self.max_level:
+            self.entry_point, self.max_level = row, level
+
+    def compact(self, renumber: np.ndarray) -> None:
+        '''
+        Drop the nodes of removed rows and renumber the rest after the namespace matrix was
+        compacted; `renumber[old row]` is the new row, or -1 for a removed one. A neighbour
+        list that loses links is refilled from the removed neighbours' own links, selected with
+        the same heuristic as on insert.
+        '''
+        renumber = renumber.tolist()
+        old_links = self.links
+        self.links = [None] * (max(renumber) + 1 if renumber else 0)
+        self.entry_point, self.max_level = None, -1
+        for old, node in enumerate(old_links):
+            if node is None or old >= len(renumber) or renumber[old] < 0:
+                continue
+            row = renumber[old]
+            self.links[row] = []
+            for level, neighbours in enumerate(node):
+                kept = [renumber[n] for n in neighbours if renumber[n] >= 0]
+                if len(kept) < len(neighbours):
+                    candidates = set(kept)
+                    for removed in neighbours:
+                        if renumber[removed] >= 0 or old_links[removed] is None or level >= len(old_links[removed]):
+                            continue
+                        candidates.update(renumber[n] for n in old_links[removed][level] if renumber[n] >= 0)
+                    candidates.discard(row)
+                    candidates = np.array(sorted(candidates), dtype=np.int64)
+                    scores = self._scores(self.namespace.matrix[row], candidates)
+                    kept = self._select_neighbours(scores, candidates, self.m0 if level == 0 else self.m)
+                self.links[row].append(kept)
+            if len(node) - 1 > self.max_level:
+                self.entry_point, self.max_level = row, len(node) - 1
+
+    def search(self, query: np.ndarray, top_k: int, ef: Optional[int] = None,
+               alive: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        '''Return (row, score) pairs of the approximate top_k, best first'''
+        if self.entry_point is None or top_k <= 0:
+            return []
+        score, entry = float(self._scores(query, [self.entry_point])[0]), self.entry_point
+        for level in range(self.max_level, 0, -1):
+            score, entry = self._closest(query, score, entry, level)
+        scores, rows = self._search_layer(query, np.array([score], dtype=np.float32), np.array([entry], dtype=np.int64),
+                                          max(ef or self.ef_search, top_k), 0, alive=alive)
+        # Equal scores put the most recent row first
+        best = np.lexsort((-rows, -scores))[:top_k]
+        return [(int(row), float(score)) for row, score in zip(rows[best].tolist(), scores[best].tolist())]
+
+    def save(self, path: Path) -> None:
+        '''Persist the graph as padded adjacency arrays in an .npz file'''
+        levels = np.array([len(node) - 1 if node is not None else -1 for node in self.links], dtype=np.int8)
+        layer0 = np.full((len(self.links), self.m0), -1, dtype=np.int32)
+        upper_nodes, upper_levels, upper_links = [], [], []
+        for row, node in enumerate(self.links):
+            if node is None:
+                continue
+            layer0[row, :len(node[0])] = node[0]
+            for level in range(1, len(node)):
+                padded = np.full(self.m, -1, dtype=np.int32)
+                padded[:len(node[level])] = node[level]
+                upper_nodes.append(row)
+                upper_levels.append(level)
+                upper_links.append(padded)
+
+        with open(path, 'wb') as handle:
+            np.savez(
+                handle,
+                params=np.array([self.m, self.ef_construction, self.ef_search,
+                                 -1 if self.entry_point is None else self.entry_point, self.max_level], dtype=np.int64),
+                levels=levels,
+                layer0=layer0,
+                upper_nodes=np.array(upper_nodes, dtype=np.int32),
+                upper_levels=np.array(upper_levels, dtype=np.int8),
+                upper_links=np.array(upper_links, dtype=np.int32).reshape(-1, self.m),
+            )
+
+    @classmethod
+    def load(cls, namespace: 'LocalNamespace', path: Path) -> 'HNSWIndex':
+        data = np.load(path)
+        m, ef_construction, ef_search, entry_point, max_level = data['params'].tolist()
+        index = cls(namespace, m=m, ef_construction=ef_construction, ef_search=ef_search)
+        index.entry_point = None if entry_point < 0 else entry_point
+        index.max_level = max_level
+
+        index.links = [None if level < 0 else [[] for _ in range(level + 1)] for level in data['levels'].tolist()]
+        for row, links in enumerate(data['layer0'].tolist()):
+            if index.links[row] is not None:
+                index.links[row][0] = [n for n in links if n >= 0]
+        for row, level, links in zip(data['upper_nodes'].tolist(), data['upper_levels'].tolist(),
+                                     data['upper_links'].tolist()):
+            index.links[row][level] = [n for n in links if n >= 0]
+        return index
+
+
+def benchmark(vectors: int = 20000, dimension: int = 128, queries: int = 200, top_k: int = 10,
+              m: int = 16, ef_construction: int = 100, ef_values: Sequence[int] = (16, 32, 64, 128),
+              seed: int = 7) -> Dict[str, List[Dict[str, float]]]:
+    '''Recall@k and latency of HNSW against brute force on clustered random data'''
+    import time
+    from src.storage.local_vector_store import LocalNamespace
+    from src.storage.vector_store import VectorData
+
+    generator = np.random.default_rng(seed)
+    centroids = generator.normal(size=(64, dimension))
+    data = centroids[generator.integers(0, len(centroids), vectors)] + generator.normal(scale=1.0, size=(vectors, dimension))
+    query_data = centroids[generator.integers(0, len(centroids), queries)] + generator.normal(scale=1.0, size=(queries, dimension))
+
+    namespace = LocalNamespace(dimension, 'cosine')
+    namespace.upsert([VectorData(str(i), values, {}) for i, values in enumerate(data.tolist())])
+    start_time = time.perf_counter()
+    namespace.build_index(m=m, ef_construction=ef_construction)
+    build_seconds = time.perf_counter() - start_time
+
+    prepared = namespace.prepare(query_data)
+    exact, exact_latencies = [], []
+    for query in query_data:
+        start_time = time.perf_counter()
+        exact.append({row for row, _ in namespace.search(query, top_k, exact=True)})
+        exact_latencies.append((time.perf_counter() - start_time) * 1000)
+
+    report = {'build_seconds': build_seconds,
+              'brute_force': {'latency_p50_ms': float(np.median(exact_latencies))},
+              'hnsw': []}
+    for ef in ef_values:
+        hits, latencies = 0, []
+        for query, expected in zip(prepared, exact):
+            start_time = time.perf_counter()
+            found = namespace.index.search(query, top_k, ef=ef, alive=namespace.alive)
+            latencies.append((time.perf_counter() - start_time) * 1000)
+            hits += len(expected & {row for row, _ in found})
+        report['hnsw'].append({'ef': ef, 'recall': hits / (len(exact) * top_k),
+                               'latency_p50_ms': float(np.median(latencies)),
+                               'latency_p99_ms': float(np.percentile(latencies, 99))})
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="HNSW recall and latency versus brute force")
+    parser.add_argument('--vectors', type=int, default=20000)
+    parser.add_argument('--dimension', type=int, default=128)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--m', type=int, default=16)
+    parser.add_argument('--ef-construction', type=int, default=100)
+    args = parser.parse_args()
+
+    result = benchmark(args.vectors, args.dimension, args.queries, args.top_k, args.m, args.ef_construction)
+    print(f"built {args.vectors} x {args.dimension} in {result['build_seconds']:.1f}s")
+    print(f"brute force        p50={result['brute_force']['latency_p50_ms']:.3f}ms recall=1.000")
+    for row in result['hnsw']:
+        print(f"hnsw ef={row['ef']:<4}      p50={row['latency_p50_ms']:.3f}ms p99={row['latency_p99_ms']:.3f}ms "
+              f"recall@{args.top_k}={row['recall']:.3f}")
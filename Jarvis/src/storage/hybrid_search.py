@@ -0,0 +1,415 @@
+"""
+Hybrid lexical + vector retrieval.
+
+HybridSearchStrategy wraps a vector strategy and keeps a BM25 index per namespace over
+the chunk text stored in the vector metadata (`hybrid_text_field`, 'text' by default).
+The index follows upserts and deletes made through the strategy: a batch is indexed once
+the wrapped strategy stored it. With `hybrid_index_dir` every write is appended to a log
+next to the saved index of the namespace and replayed on load; the index is saved again,
+and the log emptied, once the log outgrows it and on cleanup(). A hybrid query runs
+the vector search and the BM25 search at the same time, merges both rankings with
+reciprocal rank fusion and optionally re-ranks the fused head:
+
+    lexical   BM25 over identifier-preserving tokens, so 'ERR_CONN_REFUSED' or
+              'v2.3.1' match exactly as pasted
+    vector    query_vectors of the wrapped strategy
+    fusion    sum of weight / (rrf_k + rank) over the rankings a chunk appears in
+    rerank    'overlap' boosts chunks containing every query term, or any callable
+              (query_text, candidates) -> scores
+
+Every stage reports its latency in HybridSearchResult.timings.
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import math
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from src.storage.vector_filter import matches, validate_filter
+from src.storage.vector_store import AsyncVectorDBStrategy, VectorDBConfig, VectorData
+
+
+# Words plus the punctuation that holds identifiers together (paths, versions, error codes)
+_TOKEN_PATTERN = re.compile(r'\w+(?:[.\-:/]\w+)*', re.UNICODE)
+_PART_PATTERN = re.compile(r'[^\W_]+', re.UNICODE)
+DEFAULT_RRF_K = 60
+DEFAULT_CANDIDATES = 50
+# Write log entries kept before the index is saved again, at least as many as indexed chunks
+DEFAULT_LOG_MAX_ENTRIES = 1000
+INDEX_SUFFIX = '.bm25.json'
+LOG_SUFFIX = '.bm25.log'
+
+
+def index_file_name(namespace: str, suffix: str = INDEX_SUFFIX) -> str:
+    '''File name of the BM25 index (or its write log) of a namespace; any character outside [A-Za-z0-9_-] is replaced'''
+    cleaned = re.sub(r'[^0-9A-Za-z_\-]', '_', namespace)
+    if cleaned == namespace and namespace:
+        return f"{namespace}{suffix}"
+    # Keep namespaces that only differ in replaced characters apart
+    return f"{cleaned}-{hashlib.sha1(namespace.encode('utf-8')).hexdigest()[:8]}{suffix}"
+
+
+def tokenize(text: str) -> List[str]:
+    '''Lowercased tokens; compound identifiers also yield their parts ('err_conn' -> err_conn, err, conn)'''
+    tokens = []
+    for token in _TOKEN_PATTERN.findall((text or '').lower()):
+        tokens.append(token)
+        parts = _PART_PATTERN.findall(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class BM25Index:
+    '''In-memory BM25 (Okapi) index keyed by vector id, keeping the metadata of every chunk'''
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        # term -> vector id -> term frequency
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.lengths: Dict[str, int] = {}
+        # vector id -> its distinct terms, to unlink it from the postings
+        self.terms: Dict[str, Tuple[str, ...]] = {}
+        self.metadata: Dict[str, Dict[str, Any]] = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def add(self, vector_id: str, text: str, metadata: Optional[Dict[str, Any]] = None) -> None:
+        self.remove(vector_id)
+        counts = Counter(tokenize(text))
+        for term, frequency in counts.items():
+            self.postings.setdefault(term, {})[vector_id] = frequency
+        length = sum(counts.values())
+        self.lengths[vector_id] = length
+        self.terms[vector_id] = tuple(counts)
+        self.metadata[vector_id] = dict(metadata or {})
+        self.total_length += length
+
+    def remove(self, vector_id: str) -> None:
+        length = self.lengths.pop(vector_id, None)
+        if length is None:
+            return
+        self.total_length -= length
+        self.metadata.pop(vector_id, None)
+        for term in self.terms.pop(vector_id, ()):
+            documents = self.postings.get(term)
+            if documents and documents.pop(vector_id, None) is not None and not documents:
+                del self.postings[term]
+
+    def search(self, query: str, top_k: int, filter: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float]]:
+        '''(vector id, BM25 score) pairs of the best matching chunks, best first'''
+        if not self.lengths or top_k <= 0:
+            return []
+        average_length = self.total_length / len(self.lengths)
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            documents = self.postings.get(term)
+            if not documents:
+                continue
+            idf = math.log(1 + (len(self.lengths) - len(documents) + 0.5) / (len(documents) + 0.5))
+            for vector_id, frequency in documents.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[vector_id] / average_length)
+                scores[vector_id] = scores.get(vector_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        if filter:
+            ranked = [item for item in ranked if matches(self.metadata[item[0]], filter)]
+        return ranked[:top_k]
+
+    def snapshot(self, namespace: str) -> Dict[str, Any]:
+        '''What save() writes; the metadata dicts are replaced on add, never mutated, so a shallow copy is enough'''
+        documents = {vector_id: self.metadata[vector_id] for vector_id in self.lengths}
+        return {'namespace': namespace, 'k1': self.k1, 'b': self.b, 'documents': documents}
+
+    @staticmethod
+    def write(path: Path, snapshot: Dict[str, Any]) -> None:
+        temporary = path.with_name(path.name + '.tmp')
+        temporary.write_text(json.dumps(snapshot))
+        temporary.replace(path)
+
+    def save(self, path: Path, namespace: str) -> None:
+        self.write(path, self.snapshot(namespace))
+
+    @classmethod
+    def load(cls, path: Path, text_field: str) -> Tuple[str, 'BM25Index']:
+        '''The namespace saved in the file and its index'''
+        document = json.loads(path.read_text())
+        index = cls(document['k1'], document['b'])
+        for vector_id, metadata in document['documents'].items():
+            index.add(vector_id, metadata.get(text_field, ''), metadata)
+        # Files written before the namespace was stored are named after it
+        return document.get('namespace', path.name[:-len(INDEX_SUFFIX)]), index
+
+    @staticmethod
+    def append(path: Path, entries: List[Dict[str, Any]]) -> None:
+        '''Append write log entries, one JSON line each'''
+        with open(path, 'a') as handle:
+            handle.write(''.join(json.dumps(entry, separators=(',', ':')) + '\n' for entry in entries))
+
+    def replay(self, path: Path, text_field: str) -> int:
+        '''Apply the write log at `path` on top of the loaded index, returns the number of entries'''
+        if not path.exists():
+            return 0
+        replayed = 0
+        with open(path, 'r') as handle:
+            for line in handle:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn last line of an interrupted append
+                    break
+                if entry['op'] == 'add':
+                    self.add(entry['id'], entry['metadata'].get(text_field, ''), entry['metadata'])
+                else:
+                    for vector_id in entry['ids']:
+                        self.remove(vector_id)
+                replayed += 1
+        return replayed
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], weights: Optional[List[float]] = None,
+                           k: int = DEFAULT_RRF_K) -> List[Tuple[str, float]]:
+    '''Fuse ranked id lists: score(id) = sum of weight / (k + rank), ranks starting at 1'''
+    weights = weights or [1.0] * len(rankings)
+    scores: Dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, vector_id in enumerate(ranking, start=1):
+            scores[vector_id] = scores.get(vector_id, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def overlap_reranker(query: str, candidates: List[VectorData], text_field: str = 'text') -> List[float]:
+    '''
+    Fused score plus the fraction of distinct query terms found in the chunk, so a chunk
+    holding every pasted identifier moves ahead of one that only resembles the query.
+    '''
+    terms = set(tokenize(query))
+    scores = []
+    for candidate in candidates:
+        coverage = len(terms & set(tokenize(candidate.metadata.get(text_field, '')))) / len(terms) if terms else 0.0
+        scores.append((candidate.score or 0.0) * DEFAULT_RRF_K + coverage)
+    return scores
+
+
+@dataclass
+class HybridSearchResult:
+    matches: List[VectorData]
+    # Stage -> milliseconds: lexical, vector, fusion, rerank, total
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+class HybridSearchStrategy(AsyncVectorDBStrategy):
+    '''
+    Wraps a strategy with a BM25 index per namespace and adds hybrid_query().
+
+    Config keys:
+        hybrid_search: enable the wrapper in AsyncVectorDBFactory
+        hybrid_text_field: metadata field holding the chunk text (default 'text')
+        hybrid_index_dir: directory the BM25 indexes and their write logs are kept in
+        hybrid_log_max_entries: write log entries kept before the index is saved again; the
+            index size is used when larger, so saving stays amortized O(1) per write (default 1000)
+        hybrid_candidates: results taken from each retriever before fusion (default 50)
+        hybrid_rrf_k: rank constant of reciprocal rank fusion (default 60)
+        hybrid_weights: [lexical, vector] fusion weights (default [1, 1])
+        hybrid_reranker: None, 'overlap' or a callable (query_text, candidates) -> scores
+    '''
+
+    def __init__(self, strategy: AsyncVectorDBStrategy, config: VectorDBConfig):
+        self.strategy = strategy
+        self.config = config
+        self.text_field = config.config_dict.get('hybrid_text_field', 'text')
+        index_dir = config.config_dict.get('hybrid_index_dir')
+        self.index_dir: Optional[Path] = Path(index_dir) if index_dir else None
+        self.candidates = config.config_dict.get('hybrid_candidates', DEFAULT_CANDIDATES)
+        self.rrf_k = config.config_dict.get('hybrid_rrf_k', DEFAULT_RRF_K)
+        self.weights = config.config_dict.get('hybrid_weights', [1.0, 1.0])
+        reranker = config.config_dict.get('hybrid_reranker')
+        if reranker == 'overlap':
+            reranker = functools.partial(overlap_reranker, text_field=self.text_field)
+        elif reranker is not None and not callable(reranker):
+            raise ValueError(f"Unsupported reranker: {reranker}")
+        self.reranker: Optional[Callable[[str, List[VectorData]], List[float]]] = reranker
+        self.log_max_entries = config.config_dict.get('hybrid_log_max_entries', DEFAULT_LOG_MAX_ENTRIES)
+        self.indexes: Dict[str, BM25Index] = {}
+        self._save_locks: Dict[str, asyncio.Lock] = {}
+        # namespace -> entries in its write log, for the namespaces with a saved index
+        self._log_entries: Dict[str, int] = {}
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.strategy, name)
+
+    def lexical_index(self, namespace: str) -> BM25Index:
+        if namespace not in self.indexes:
+            self.indexes[namespace] = BM25Index()
+        return self.indexes[namespace]
+
+    async def initialize(self) -> None:
+        await self.strategy.initialize()
+        if self.index_dir and self.index_dir.exists():
+            for path in self.index_dir.glob(f'*{INDEX_SUFFIX}'):
+                namespace, index = BM25Index.load(path, self.text_field)
+                self._log_entries[namespace] = index.replay(
+                    self.index_dir / index_file_name(namespace, LOG_SUFFIX), self.text_field)
+                self.indexes[namespace] = index
+
+    async def cleanup(self) -> None:
+        for namespace in list(self.indexes):
+            await self.save_index(namespace)
+        await self.strategy.cleanup()
+
+    def _write_files(self, namespace: str, snapshot: Dict[str, Any]) -> None:
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        BM25Index.write(self.index_dir / index_file_name(namespace), snapshot)
+        # Replaying a log left by a crash here is harmless, its entries are already in the snapshot
+        (self.index_dir / index_file_name(namespace, LOG_SUFFIX)).unlink(missing_ok=True)
+
+    async def _save(self, namespace: str) -> None:
+        '''Write the index of a namespace and empty its write log; the caller holds the save lock'''
+        snapshot = self.indexes[namespace].snapshot(namespace)
+        try:
+            await asyncio.to_thread(self._write_files, namespace, snapshot)
+            self._log_entries[namespace] = 0
+        except OSError as e:
+            print(f"Error saving BM25 index: {e}")
+
+    async def save_index(self, namespace: str) -> None:
+        '''Write the BM25 index of a namespace to hybrid_index_dir and empty its write log, in a worker thread'''
+        if not self.index_dir or namespace not in self.indexes:
+            return
+        async with self._save_locks.setdefault(namespace, asyncio.Lock()):
+            if namespace in self.indexes:
+                await self._save(namespace)
+
+    async def _log_writes(self, namespace: str, entries: List[Dict[str, Any]]) -> None:
+        '''
+        Persist changes of the index of a namespace by appending them to its write log, in a
+        worker thread. The first write of a namespace, and a log grown past log_max_entries and
+        the index size, save the whole index instead, so a write costs O(batch) amortized.
+        '''
+        if not self.index_dir or not entries:
+            return
+        async with self._save_locks.setdefault(namespace, asyncio.Lock()):
+            index = self.indexes.get(namespace)
+            if index is None:
+                # Deleted while waiting for the lock
+                return
+            logged = self._log_entries.get(namespace)
+            if logged is None or logged + len(entries) > max(self.log_max_entries, len(index)):
+                await self._save(namespace)
+                return
+            try:
+                await asyncio.to_thread(BM25Index.append, self.index_dir / index_file_name(namespace, LOG_SUFFIX),
+                                        entries)
+                self._log_entries[namespace] = logged + len(entries)
+            except OSError as e:
+                print(f"Error saving BM25 index: {e}")
+
+    async def create_namespace(self, namespace: str, *args, **kwargs) -> bool:
+        return await self.strategy.create_namespace(namespace, *args, **kwargs)
+
+    async def delete_namespace(self, namespace: str, *args, **kwargs) -> bool:
+        deleted = await self.strategy.delete_namespace(namespace, *args, **kwargs)
+        if deleted:
+            async with self._save_locks.setdefault(namespace, asyncio.Lock()):
+                self.indexes.pop(namespace, None)
+                self._log_entries.pop(namespace, None)
+                if self.index_dir:
+                    for suffix in (INDEX_SUFFIX, LOG_SUFFIX):
+                        (self.index_dir / index_file_name(namespace, suffix)).unlink(missing_ok=True)
+        return deleted
+
+    def _index_vectors(self, namespace: str, vectors: List[VectorData]) -> List[Dict[str, Any]]:
+        '''Apply a stored batch to the index of the namespace and return its write log entries'''
+        index = self.lexical_index(namespace)
+        entries = []
+        for vector in vectors:
+            text = (vector.metadata or {}).get(self.text_field)
+            if text:
+                index.add(vector.id, text, vector.metadata)
+                entries.append({'op': 'add', 'id': vector.id, 'metadata': index.metadata[vector.id]})
+            else:
+                index.remove(vector.id)
+                entries.append({'op': 'remove', 'ids': [vector.id]})
+        return entries
+
+    async def _upsert_batch(self, namespace: str, vectors: List[VectorData]) -> None:
+        '''Store the batch through the wrapped strategy, then index and log it'''
+        # Raises when the batch fails, which leaves the index untouched
+        await self.strategy._upsert_batch(namespace, vectors)
+        await self._log_writes(namespace, self._index_vectors(namespace, vectors))
+
+    async def delete_vectors(self, namespace: str, vector_ids: List[str]) -> bool:
+        deleted = await self.strategy.delete_vectors(namespace, vector_ids)
+        if deleted and namespace in self.indexes:
+            for vector_id in vector_ids:
+                self.indexes[namespace].remove(vector_id)
+            await self._log_writes(namespace, [{'op': 'remove', 'ids': list(vector_ids)}])
+        return deleted
+
+    async def query_vectors(self, namespace: str, query_vector: List[float], top_k: int = 5,
+                            filter: Optional[Dict[str, Any]] = None) -> List[VectorData]:
+        return await self.strategy.query_vectors(namespace, query_vector, top_k, filter=filter)
+
+    async def query_vectors_batch(self, namespace: str, query_vectors: List[List[float]], top_k: int = 5,
+                                  include_values: bool = False, fields: Optional[List[str]] = None,
+                                  filter: Optional[Dict[str, Any]] = None) -> List[List[VectorData]]:
+        return await self.strategy.query_vectors_batch(namespace, query_vectors, top_k, include_values, fields,
+                                                       filter=filter)
+
+    async def hybrid_query(self, namespace: str, query_text: str, query_vector: Optional[List[float]],
+                           top_k: int = 5, filter: Optional[Dict[str, Any]] = None) -> HybridSearchResult:
+        '''
+        Retrieve with BM25 and the vector index at the same time, fuse with RRF and re-rank.
+        Without a query vector only the lexical ranking is used. Match scores are the fused
+        (or re-ranked) scores; values are not returned.
+        '''
+        if filter:
+            validate_filter(filter)
+        timings: Dict[str, float] = {}
+        start_time = time.perf_counter()
+
+        async def vector_stage() -> List[VectorData]:
+            stage_start = time.perf_counter()
+            results = await self.strategy.query_vectors(namespace, query_vector, self.candidates, filter=filter)
+            timings['vector'] = (time.perf_counter() - stage_start) * 1000
+            return results
+
+        vector_task = asyncio.ensure_future(vector_stage()) if query_vector is not None else None
+        # Let the vector query go out before scoring BM25 on the event loop thread
+        await asyncio.sleep(0)
+        stage_start = time.perf_counter()
+        lexical = self.lexical_index(namespace).search(query_text, self.candidates, filter)
+        timings['lexical'] = (time.perf_counter() - stage_start) * 1000
+        vector_results = await vector_task if vector_task is not None else []
+
+        stage_start = time.perf_counter()
+        rankings = [[vector_id for vector_id, _ in lexical], [result.id for result in vector_results]]
+        fused = reciprocal_rank_fusion(rankings, self.weights, self.rrf_k)
+        by_id = {result.id: result for result in vector_results}
+        index = self.lexical_index(namespace)
+        candidates = []
+        for vector_id, score in fused[:self.candidates]:
+            result = by_id.get(vector_id)
+            metadata = result.metadata if result is not None else index.metadata.get(vector_id, {})
+            candidates.append(VectorData(vector_id, [], dict(metadata or {}), score))
+        timings['fusion'] = (time.perf_counter() - stage_start) * 1000
+
+        if self.reranker is not None and candidates:
+            stage_start = time.perf_counter()
+            scores = self.reranker(query_text, candidates)
+            for candidate, score in zip(candidates, scores):
+                candidate.score = float(score)
+            candidates.sort(key=lambda candidate: candidate.score, reverse=True)
+            timings['rerank'] = (time.perf_counter() - stage_start) * 1000
+
+        timings['total'] = (time.perf_counter() - start_time) * 1000
+        return HybridSearchResult(candidates[:top_k], timings)
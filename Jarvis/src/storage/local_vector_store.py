@@ -0,0 +1,755 @@
+import asyncio
+import json
+import os
+import re
+import shutil
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from src.storage.hnsw_index import HNSWIndex
+from src.storage.vector_filter import MetadataIndex, validate_filter
+from src.storage.vector_store import AsyncVectorDBStrategy, VectorDBConfig, VectorData, project_metadata, stack_values
+
+if TYPE_CHECKING:
+    from src.storage.vector_compaction import CompactionBudget
+
+
+METRICS = ('cosine', 'dot', 'l2')
+INITIAL_CAPACITY = 1024
+SNAPSHOT_VERSION = 1
+# Scores computed at once by batched queries (queries x rows), 64 MiB of float32
+SCORE_BLOCK_ELEMENTS = 2 ** 24
+# Filters matching at most this many rows are scanned exactly instead of through an index
+FILTERED_SCAN_ROWS = 20000
+# Upper bound of the HNSW candidate list widened for selective filters
+MAX_FILTERED_EF = 1024
+# Rows scored by one worker thread when a scan is sharded
+SHARD_ROWS = 65536
+DEFAULT_QUERY_THREADS = 8
+# Default HNSW threshold: HNSW_MIN_VECTORS + HNSW_SCAN_ELEMENTS / dimension vectors, see scan()
+HNSW_MIN_VECTORS = 6000
+HNSW_SCAN_ELEMENTS = 640000
+# Namespaces name directories under persist_dir, so they must not hold separators or dots
+NAMESPACE_PATTERN = re.compile(r'[A-Za-z0-9_-]+')
+
+
+def validate_namespace(namespace: str) -> str:
+    '''Reject names that could point outside of persist_dir, like "../.." or "a/b"'''
+    if not isinstance(namespace, str) or not NAMESPACE_PATTERN.fullmatch(namespace):
+        raise ValueError(f"Invalid namespace {namespace!r}: only letters, digits, '_' and '-' are allowed")
+    return namespace
+
+
+def check_dimension(values: np.ndarray, dimension: int) -> None:
+    '''Reject vectors that are not `dimension` wide, which reshaping would silently merge or split'''
+    if values.size and (values.ndim > 2 or values.shape[-1] != dimension):
+        raise ValueError(f"Vector dimension {values.shape[-1]} does not match namespace dimension {dimension}")
+
+
+def prepare_vectors(values: np.ndarray, dimension: int, metric: str) -> np.ndarray:
+    '''Convert raw vectors to the stored representation: float32 rows, normalised for cosine'''
+    values = np.asarray(values, dtype=np.float32)
+    check_dimension(values, dimension)
+    values = values.reshape(-1, dimension)
+    if metric == 'cosine':
+        norms = np.linalg.norm(values, axis=1, keepdims=True)
+        values = values / np.where(norms == 0, 1, norms)
+    return values
+
+
+def score_matrix(queries: np.ndarray, matrix: np.ndarray, norms: np.ndarray, metric: str) -> np.ndarray:
+    '''
+    Score every row of `matrix` against each prepared query, shape (queries, rows).
+    Higher is better for every metric; L2 scores are negated squared distances.
+    '''
+    products = queries @ matrix.T
+    if metric == 'l2':
+        query_norms = np.einsum('ij,ij->i', queries, queries)[:, None]
+        return -(query_norms - 2 * products + norms[None, :])
+    return products
+
+
+def top_k_rows(scores: np.ndarray, top_k: int) -> np.ndarray:
+    '''Rows of the top_k finite scores, best first'''
+    top_k = min(top_k, int(np.isfinite(scores).sum()))
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k < len(scores):
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.flatnonzero(np.isfinite(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def query_blocks(queries: np.ndarray, rows: int) -> Iterator[np.ndarray]:
+    '''Split queries so one block of scores holds at most SCORE_BLOCK_ELEMENTS floats'''
+    step = max(SCORE_BLOCK_ELEMENTS // max(rows, 1), 1)
+    for start in range(0, len(queries), step):
+        yield queries[start:start + step]
+
+
+def block_top_k(scores: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Column positions and scores of the top_k entries of every row of `scores`, best first.
+    Rows with fewer finite scores are padded with -inf.
+    '''
+    top_k = min(top_k, scores.shape[1])
+    if top_k < scores.shape[1]:
+        columns = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    else:
+        columns = np.broadcast_to(np.arange(scores.shape[1]), scores.shape).copy()
+    best = np.take_along_axis(scores, columns, axis=1)
+    order = np.argsort(-best, axis=1, kind='stable')
+    return np.take_along_axis(columns, order, axis=1), np.take_along_axis(best, order, axis=1)
+
+
+def _scan_shard(queries: np.ndarray, matrix: np.ndarray, norms: np.ndarray, metric: str, top_k: int,
+                allowed: Optional[np.ndarray], offset: int) -> Tuple[np.ndarray, np.ndarray]:
+    '''Partial top_k (rows, scores) of one row shard for every query, rows numbered from `offset`'''
+    rows, scores = [], []
+    for block in query_blocks(queries, len(matrix)):
+        block_scores = score_matrix(block, matrix, norms, metric)
+        if allowed is not None:
+            block_scores[:, ~allowed] = -np.inf
+        columns, best = block_top_k(block_scores, top_k)
+        rows.append(columns + offset)
+        scores.append(best)
+    return np.concatenate(rows), np.concatenate(scores)
+
+
+def scan(queries: np.ndarray, matrix: np.ndarray, norms: np.ndarray, metric: str, top_k: int,
+         allowed: Optional[np.ndarray] = None, gather: bool = False, executor: Optional[Executor] = None,
+         shard_rows: int = SHARD_ROWS) -> List[List[Tuple[int, float]]]:
+    '''
+    Brute-force top_k (row, raw score) pairs for each prepared query. Rows where `allowed`
+    is False are skipped; with `gather` the allowed rows are copied out and scored alone
+    when they are at most half of the matrix, which is cheaper for selective filters.
+
+    With an `executor` the rows are split into shards of `shard_rows` that are scored in
+    parallel (NumPy releases the GIL in the matrix products) and the partial top_k of every
+    shard are merged.
+    '''
+    rows = None
+    if gather and allowed is not None and 2 * int(allowed.sum()) <= len(allowed):
+        rows = np.flatnonzero(allowed)
+        matrix, norms, allowed = matrix[rows], norms[rows], None
+    if executor is not None and len(matrix) > shard_rows and top_k > 0:
+        return _sharded_scan(queries, matrix, norms, metric, top_k, allowed, rows, executor, shard_rows)
+    results = []
+    for block in query_blocks(queries, len(matrix)):
+        scores = score_matrix(block, matrix, norms, metric)
+        if allowed is not None:
+            scores[:, ~allowed] = -np.inf
+        for row_scores in scores:
+            best = top_k_rows(row_scores, top_k)
+            results.append([(int(row if rows is None else rows[row]), float(row_scores[row])) for row in best])
+    return results
+
+
+# Below the HNSW threshold namespaces are searched by scan(). Median top-10 latency of one
+# cosine query on one core, clustered data, HNSW with m=16, ef_construction=200, ef_search=64:
+#
+#   vectors x dimension   scan      hnsw      hnsw build
+#   5000 x 64             0.34 ms   0.86 ms    2.5 s
+#   10000 x 64            0.54 ms   0.94 ms    5.6 s
+#   15000 x 64            0.75 ms   0.88 ms    9.6 s
+#   20000 x 64            0.71 ms   0.52 ms   15.0 s
+#   2500 x 768            0.68 ms   1.25 ms    3.3 s
+#   5000 x 768            1.33 ms   1.57 ms    8.0 s
+#   7500 x 768            3.41 ms   1.86 ms   17.1 s
+#   10000 x 768           6.03 ms   1.16 ms   19.2 s
+#
+# The index only pays off past roughly 16000 vectors at dimension 64 and 6500 at 768, which
+# default_index_threshold() follows. Its build also holds the namespace for seconds.
+def default_index_threshold(dimension: int) -> int:
+    '''Vector count from which an HNSW index answers queries faster than scan()'''
+    return HNSW_MIN_VECTORS + HNSW_SCAN_ELEMENTS // dimension
+
+
+def _sharded_scan(queries: np.ndarray, matrix: np.ndarray, norms: np.ndarray, metric: str, top_k: int,
+                  allowed: Optional[np.ndarray], rows: Optional[np.ndarray], executor: Executor,
+                  shard_rows: int) -> List[List[Tuple[int, float]]]:
+    shards = [
+        executor.submit(_scan_shard, queries, matrix[start:start + shard_rows], norms[start:start + shard_rows],
+                        metric, top_k, None if allowed is None else allowed[start:start + shard_rows], start)
+        for start in range(0, len(matrix), shard_rows)
+    ]
+    partial = [shard.result() for shard in shards]
+    # Merge: the best top_k among the shards' partial top_k
+    candidates = np.concatenate([shard_candidates for shard_candidates, _ in partial], axis=1)
+    columns, scores = block_top_k(np.concatenate([shard_scores for _, shard_scores in partial], axis=1), top_k)
+    merged = np.take_along_axis(candidates, columns, axis=1)
+    if rows is not None:
+        merged = rows[merged]
+    return [[(int(row), float(score)) for row, score in zip(query_rows, query_scores) if np.isfinite(score)]
+            for query_rows, query_scores in zip(merged, scores)]
+
+
+def public_score(score: float, metric: str) -> float:
+    '''Score reported to callers: similarity for cosine/dot, euclidean distance for l2'''
+    if metric == 'l2':
+        return float(np.sqrt(max(-score, 0.0)))
+    return float(score)
+
+
+class LocalNamespace:
+    '''
+    Vectors of one namespace kept in a contiguous float32 matrix.
+
+    Rows are appended and the matrix grows by doubling. Deleted rows are tombstoned and
+    skipped at query time; `compact()` drops them and renumbers the remaining rows.
+    For the cosine metric rows are stored L2-normalised so a query is a single matrix product.
+
+    With `index_params` an HNSW index is built once the namespace holds `threshold` vectors and
+    answers queries from then on. Indexed rows are immutable: overwriting an id tombstones its
+    row and appends a new one.
+    '''
+
+    def __init__(self, dimension: int, metric: str = 'cosine', capacity: int = INITIAL_CAPACITY,
+                 index_params: Optional[Dict[str, int]] = None):
+        if metric not in METRICS:
+            raise ValueError(f"Unsupported metric: {metric}")
+        self.dimension = dimension
+        self.metric = metric
+        self.matrix = np.zeros((capacity, dimension), dtype=np.float32)
+        self.alive = np.zeros(capacity, dtype=bool)
+        # Squared norms, used by the L2 metric
+        self.norms = np.zeros(capacity, dtype=np.float32)
+        self.ids: List[Optional[str]] = []
+        self.metadata: List[Optional[Dict[str, Any]]] = []
+        self.id_to_row: Dict[str, int] = {}
+        self.index_params = index_params
+        self.index: Optional[HNSWIndex] = None
+        self.filter_index = MetadataIndex()
+
+    @property
+    def size(self) -> int:
+        '''Number of used rows, tombstones included'''
+        return len(self.ids)
+
+    @property
+    def count(self) -> int:
+        '''Number of live vectors'''
+        return len(self.id_to_row)
+
+    @property
+    def tombstones(self) -> int:
+        return self.size - self.count
+
+    def _reserve(self, rows: int) -> None:
+        capacity = self.matrix.shape[0]
+        if rows <= capacity:
+            return
+        capacity = max(capacity, 1)
+        while capacity < rows:
+            capacity *= 2
+        matrix = np.zeros((capacity, self.dimension), dtype=np.float32)
+        matrix[:self.matrix.shape[0]] = self.matrix
+        self.matrix = matrix
+        self.alive = np.concatenate([self.alive, np.zeros(capacity - len(self.alive), dtype=bool)])
+        self.norms = np.concatenate([self.norms, np.zeros(capacity - len(self.norms), dtype=np.float32)])
+
+    def prepare(self, values: np.ndarray) -> np.ndarray:
+        '''Convert raw vectors to the stored representation'''
+        return prepare_vectors(values, self.dimension, self.metric)
+
+    def upsert(self, vectors: List[VectorData]) -> None:
+        '''Insert new vectors and overwrite existing ids in place'''
+        # An id repeated in the batch is written once, with its last copy. With an index the
+        # second copy would otherwise tombstone the row just assigned to the first one
+        vectors = list({vector.id: vector for vector in vectors}.values())
+        values = self.prepare(stack_values(vectors))
+        rows = []
+        for vector in vectors:
+            row = self.id_to_row.get(vector.id)
+            if row is not None and self.index is not None:
+                self.delete([vector.id])
+                row = None
+            if row is None:
+                row = len(self.ids)
+                self.ids.append(vector.id)
+                self.metadata.append(None)
+                self.id_to_row[vector.id] = row
+            self.filter_index.remove(row, self.metadata[row])
+            self.metadata[row] = dict(vector.metadata or {})
+            self.filter_index.add(row, self.metadata[row])
+            rows.append(row)
+
+        self._reserve(len(self.ids))
+        rows = np.array(rows, dtype=np.int64)
+        self.matrix[rows] = values
+        self.norms[rows] = np.einsum('ij,ij->i', values, values)
+        self.alive[rows] = True
+
+        if self.index is not None:
+            self.index.add(rows)
+        elif self.index_params and self.count >= self.index_threshold:
+            self.build_index(**{k: v for k, v in self.index_params.items() if k != 'threshold'})
+
+    @property
+    def index_threshold(self) -> int:
+        threshold = self.index_params.get('threshold')
+        return default_index_threshold(self.dimension) if threshold is None else threshold
+
+    def build_index(self, m: int = 16, ef_construction: int = 200, ef_search: int = 64) -> HNSWIndex:
+        '''Build an HNSW index over the live rows'''
+        self.index = HNSWIndex(self, m=m, ef_construction=ef_construction, ef_search=ef_search)
+        self.index.build(np.flatnonzero(self.alive[:self.size]))
+        return self.index
+
+    def delete(self, ids: List[str]) -> int:
+        '''Tombstone vectors, returns the number of deleted ids'''
+        deleted = 0
+        for vector_id in ids:
+            row = self.id_to_row.pop(vector_id, None)
+            if row is None:
+                continue
+            self.alive[row] = False
+            self.filter_index.remove(row, self.metadata[row])
+            self.ids[row] = None
+            self.metadata[row] = None
+            deleted += 1
+        return deleted
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        '''Score every row against each prepared query, shape (queries, rows)'''
+        return score_matrix(queries, self.matrix[:self.size], self.norms[:self.size], self.metric)
+
+    def search(self, query_vector: List[float], top_k: int, exact: bool = False,
+               ef: Optional[int] = None, filter: Optional[Dict[str, Any]] = None) -> List[tuple]:
+        '''
+        Return (row, score) pairs of the top_k live rows matching `filter`, best first. Queries
+        go through the HNSW index when there is one, unless `exact` asks for brute force.
+        '''
+        return self.search_batch([query_vector], top_k, exact, ef, filter)[0]
+
+    def search_batch(self, query_vectors: List[List[float]], top_k: int, exact: bool = False,
+                     ef: Optional[int] = None, filter: Optional[Dict[str, Any]] = None,
+                     executor: Optional[Executor] = None, shard_rows: int = SHARD_ROWS) -> List[List[tuple]]:
+        '''
+        search() for several queries; brute force scores them with one matrix product per block,
+        split in row shards scored on `executor` when one is given. A filter is resolved to a row
+        mask through the metadata index first, and selective filters only score the rows they match.
+        '''
+        if self.count == 0 or top_k <= 0:
+            return [[] for _ in query_vectors]
+        allowed, selected = self.alive[:self.size], self.count
+        if filter:
+            validate_filter(filter)
+            allowed = allowed & self.filter_index.mask(filter, self.size)
+            selected = int(allowed.sum())
+            if not selected:
+                return [[] for _ in query_vectors]
+        queries = self.prepare(np.asarray(query_vectors, dtype=np.float32))
+
+        if self.index is not None and not exact and (not filter or selected > FILTERED_SCAN_ROWS):
+            ef = ef or self.index.ef_search
+            if filter:
+                # Fewer matching rows are met along the graph, widen the candidate list to compensate
+                ef = min(int(ef * self.count / selected), MAX_FILTERED_EF)
+            return [[(row, self.public_score(score)) for row, score in self.index.search(query, top_k, ef=ef, alive=allowed)]
+                    for query in queries]
+        results = scan(queries, self.matrix[:self.size], self.norms[:self.size], self.metric, top_k,
+                       allowed, gather=bool(filter), executor=executor, shard_rows=shard_rows)
+        return [[(row, self.public_score(score)) for row, score in best] for best in results]
+
+    def public_score(self, score: float) -> float:
+        return public_score(score, self.metric)
+
+    def memory_usage(self) -> Dict[str, int]:
+        '''Bytes of the vector matrix (allocated capacity) and its per-row arrays'''
+        return {'matrix': self.matrix.nbytes, 'rows': self.norms.nbytes + self.alive.nbytes}
+
+    def vector(self, row: int, include_values: bool = True, fields: Optional[List[str]] = None) -> VectorData:
+        values = self.matrix[row].copy() if include_values else []
+        return VectorData(self.ids[row], values, project_metadata(self.metadata[row], fields))
+
+    def compact(self) -> None:
+        '''Drop tombstoned rows; the HNSW index is renumbered and repaired rather than rebuilt'''
+        if not self.tombstones:
+            return
+        rows = np.flatnonzero(self.alive[:self.size])
+        renumber = np.full(self.size, -1, dtype=np.int64)
+        renumber[rows] = np.arange(len(rows))
+        self.matrix = np.ascontiguousarray(self.matrix[rows])
+        self.norms = self.norms[rows]
+        self.alive = np.ones(len(rows), dtype=bool)
+        self.ids = [self.ids[row] for row in rows]
+        self.metadata = [self.metadata[row] for row in rows]
+        self.id_to_row = {vector_id: row for row, vector_id in enumerate(self.ids)}
+        self.filter_index = MetadataIndex.build(self.metadata)
+        self._reserve(max(len(rows), 1))
+        if self.index is not None:
+            self.index.compact(renumber)
+
+    def save(self, directory: Path) -> None:
+        '''Write the namespace to `directory`, replacing any previous snapshot atomically'''
+        self.compact()
+        directory.mkdir(parents=True, exist_ok=True)
+        temporary = directory / 'vectors.tmp.npy'
+        np.save(temporary, self.matrix[:self.size])
+        os.replace(temporary, directory / 'vectors.npy')
+
+        document = {
+            'version': SNAPSHOT_VERSION,
+            'dimension': self.dimension,
+            'metric': self.metric,
+            'ids': self.ids,
+            'metadata': self.metadata,
+            'index_params': self.index_params,
+            'indexed': self.index is not None,
+        }
+        if self.index is not None:
+            temporary = directory / 'hnsw.tmp.npz'
+            self.index.save(temporary)
+            os.replace(temporary, directory / 'hnsw.npz')
+        temporary = directory / 'manifest.tmp.json'
+        temporary.write_text(json.dumps(document))
+        os.replace(temporary, directory / 'manifest.json')
+
+    @classmethod
+    def load(cls, directory: Path) -> 'LocalNamespace':
+        document = json.loads((directory / 'manifest.json').read_text())
+        if document['version'] != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version: {document['version']}")
+        matrix = np.load(directory / 'vectors.npy')
+        namespace = cls(document['dimension'], document['metric'], capacity=max(len(matrix), INITIAL_CAPACITY),
+                        index_params=document.get('index_params'))
+        rows = len(document['ids'])
+        namespace.matrix[:rows] = matrix
+        namespace.norms[:rows] = np.einsum('ij,ij->i', matrix, matrix)
+        namespace.alive[:rows] = True
+        namespace.ids = document['ids']
+        namespace.metadata = document['metadata']
+        namespace.id_to_row = {vector_id: row for row, vector_id in enumerate(namespace.ids)}
+        namespace.filter_index = MetadataIndex.build(namespace.metadata)
+        if document.get('indexed') and (directory / 'hnsw.npz').exists():
+            namespace.index = HNSWIndex.load(namespace, directory / 'hnsw.npz')
+        return namespace
+
+
+@dataclass
+class PendingQuery:
+    '''Queries of one query_vectors(_batch) call waiting for the namespace dispatcher'''
+    query_vectors: List[List[float]]
+    top_k: int
+    include_values: bool
+    fields: Optional[List[str]]
+    filter: Optional[Dict[str, Any]]
+    future: asyncio.Future
+
+
+@dataclass
+class DispatchStats:
+    # Scans run by the dispatchers and the queries they answered
+    batches: int = 0
+    queries: int = 0
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.queries / self.batches if self.batches else 0.0
+
+
+class AsyncLocalVectorStrategy(AsyncVectorDBStrategy):
+    '''
+    In-process vector store backed by NumPy, for development, CI and small tenants.
+
+    Config keys:
+        metric: default metric of new namespaces, 'cosine' (default), 'dot' or 'l2'
+        persist_dir: directory for snapshots; loaded in initialize(), written in cleanup()
+        index: 'flat' (default) or 'hnsw' for approximate search on large namespaces
+        hnsw_m, hnsw_ef_construction, hnsw_ef_search: HNSW graph parameters
+        hnsw_threshold: vector count at which a namespace builds its HNSW index, defaults to
+            default_index_threshold() of the namespace dimension (about 16000 at 64, 6800 at 768)
+        storage: 'memory' (default) keeps namespaces in RAM and snapshots them; 'segments' keeps
+            them in memory-mapped segment files under persist_dir (see vector_segments)
+        segment_max_vectors: vectors buffered before a new segment is sealed
+        read_only: map existing segments without writing, for additional worker processes
+        quantization: 'int8' or 'pq' to search sealed segments on compressed codes kept in RAM
+            and re-rank the shortlist at full precision (segment storage only)
+        pq_subvectors: sub-vectors per PQ code, defaults to dimension / 4
+        rerank_factor: candidates re-ranked per segment, as a multiple of top_k (default 4)
+        query_threads: threads scoring row shards (or segments) of one scan in parallel; defaults
+            to the CPU count capped at 8, 1 scores on the calling thread only
+        query_shard_rows: rows per shard of a parallel scan (default 65536)
+        query_batch_window: seconds a namespace dispatcher waits to gather more concurrent queries
+            into one scan (default 0: queries arriving while a scan runs join the next one)
+        compaction_interval: seconds between background compaction checks, None (default) disables
+            the background compactor (see vector_compaction)
+        compaction_tombstone_ratio: share of dead rows that makes a segment or namespace worth compacting
+        compaction_min_small_segments: number of small segments that are merged together
+        compaction_io_bytes_per_second: read plus write rate a segment merge stays under
+        compaction_cpu_fraction: share of one core a segment merge may use (default 1)
+
+    Queries run in worker threads, off the event loop. Each namespace has one dispatcher:
+    concurrent queries with the same top_k and filter are scored together as one
+    matrix-matrix product. Writes to a namespace wait for its running scan.
+    '''
+
+    def __init__(self, config: VectorDBConfig):
+        self.config = config
+        # Upserts are in-memory, large batches avoid pipeline overhead
+        self.config.config_dict.setdefault('upsert_batch_size', 10000)
+        self.config.config_dict.setdefault('upsert_max_batch_bytes', 256 * 1024 * 1024)
+        self.metric = config.config_dict.get('metric', 'cosine')
+        persist_dir = config.config_dict.get('persist_dir')
+        self.persist_dir: Optional[Path] = Path(persist_dir) if persist_dir else None
+        self.storage = config.config_dict.get('storage', 'memory')
+        if self.storage == 'segments' and not self.persist_dir:
+            raise ValueError("Segment storage requires persist_dir")
+        self.segment_max_vectors = config.config_dict.get('segment_max_vectors', 100000)
+        self.read_only = config.config_dict.get('read_only', False)
+        self.quantization: Optional[Dict[str, Any]] = None
+        if config.config_dict.get('quantization'):
+            if self.storage != 'segments':
+                raise ValueError("Quantization requires segment storage")
+            self.quantization = {
+                'kind': config.config_dict['quantization'],
+                'subvectors': config.config_dict.get('pq_subvectors'),
+                'rerank': config.config_dict.get('rerank_factor', 4),
+            }
+        self.namespaces: Dict[str, Any] = {}
+        self.index_params: Optional[Dict[str, int]] = None
+        if config.config_dict.get('index', 'flat') == 'hnsw':
+            self.index_params = {
+                'm': config.config_dict.get('hnsw_m', 16),
+                'ef_construction': config.config_dict.get('hnsw_ef_construction', 200),
+                'ef_search': config.config_dict.get('hnsw_ef_search', 64),
+                'threshold': config.config_dict.get('hnsw_threshold'),
+            }
+        self.query_threads = config.config_dict.get('query_threads', min(os.cpu_count() or 1, DEFAULT_QUERY_THREADS))
+        self.shard_rows = config.config_dict.get('query_shard_rows', SHARD_ROWS)
+        self.batch_window = config.config_dict.get('query_batch_window', 0.0)
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.dispatch_stats = DispatchStats()
+        self._pending: Dict[str, List[PendingQuery]] = {}
+        self._dispatchers: Dict[str, asyncio.Task] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.compactor = None
+        if config.config_dict.get('compaction_interval'):
+            from src.storage.vector_compaction import (BackgroundCompactor, DEFAULT_MIN_SMALL_SEGMENTS,
+                                                       DEFAULT_TOMBSTONE_RATIO)
+            self.compactor = BackgroundCompactor(
+                self,
+                interval=config.config_dict['compaction_interval'],
+                tombstone_ratio=config.config_dict.get('compaction_tombstone_ratio', DEFAULT_TOMBSTONE_RATIO),
+                min_small_segments=config.config_dict.get('compaction_min_small_segments', DEFAULT_MIN_SMALL_SEGMENTS),
+                io_bytes_per_second=config.config_dict.get('compaction_io_bytes_per_second'),
+                cpu_fraction=config.config_dict.get('compaction_cpu_fraction', 1.0),
+            )
+
+    async def initialize(self) -> None:
+        '''Load the namespaces snapshotted in persist_dir and start the background compactor'''
+        if self.compactor is not None and not self.read_only:
+            self.compactor.start()
+        if not self.persist_dir or not self.persist_dir.exists():
+            return
+        from src.storage.vector_segments import SegmentedNamespace
+        for directory in sorted(self.persist_dir.iterdir()):
+            if SegmentedNamespace.exists(directory):
+                self.namespaces[directory.name] = SegmentedNamespace.open(
+                    directory, segment_max_vectors=self.segment_max_vectors, read_only=self.read_only,
+                    quantization=self.quantization,
+                )
+            elif (directory / 'manifest.json').exists():
+                self.namespaces[directory.name] = LocalNamespace.load(directory)
+
+    async def cleanup(self) -> None:
+        '''Snapshot every namespace to persist_dir'''
+        if self.compactor is not None:
+            await self.compactor.stop()
+        await asyncio.gather(*self._dispatchers.values(), return_exceptions=True)
+        self.snapshot()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def _executor(self) -> Optional[Executor]:
+        if self.query_threads <= 1:
+            return None
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.query_threads, thread_name_prefix='vector-query')
+        return self.executor
+
+    def _lock(self, namespace: str) -> asyncio.Lock:
+        '''Held by the running scan of a namespace and by writes to it'''
+        return self._locks.setdefault(namespace, asyncio.Lock())
+
+    def snapshot(self) -> None:
+        if not self.persist_dir:
+            return
+        self.persist_dir.mkdir(parents=True, exist_ok=True)
+        for name, namespace in self.namespaces.items():
+            if isinstance(namespace, LocalNamespace):
+                namespace.save(self.persist_dir / name)
+            else:
+                namespace.flush()
+
+    def _new_namespace(self, namespace: str, dimension: int, metric: Optional[str] = None):
+        validate_namespace(namespace)
+        if self.storage == 'segments':
+            from src.storage.vector_segments import SegmentedNamespace
+            return SegmentedNamespace(self.persist_dir / namespace, dimension, metric or self.metric,
+                                      segment_max_vectors=self.segment_max_vectors, quantization=self.quantization)
+        return LocalNamespace(dimension, metric or self.metric, index_params=self.index_params)
+
+    async def create_namespace(self, namespace: str, dimension: Optional[int] = None, metric: Optional[str] = None,
+                               *args, **kwargs) -> bool:
+        '''
+        Create an empty namespace. Without a dimension the namespace is created on the
+        first upsert, like Pinecone does.
+        '''
+        if namespace in self.namespaces or dimension is None:
+            return True
+        try:
+            self.namespaces[namespace] = self._new_namespace(namespace, dimension, metric)
+            return True
+        except ValueError as e:
+            print(f"Error creating namespace: {e}")
+            return False
+
+    async def delete_namespace(self, namespace: str, *args, **kwargs) -> bool:
+        try:
+            validate_namespace(namespace)
+        except ValueError as e:
+            print(f"Error deleting namespace: {e}")
+            return False
+        async with self._lock(namespace):
+            store = self.namespaces.pop(namespace, None)
+            if store is not None and not isinstance(store, LocalNamespace):
+                store.close()
+            if self.persist_dir and (self.persist_dir / namespace).exists():
+                shutil.rmtree(self.persist_dir / namespace)
+        return True
+
+    async def _upsert_batch(self, namespace: str, vectors: List[VectorData]) -> None:
+        '''
+        Apply a batch in a worker thread under the namespace lock: building the HNSW graph
+        once the namespace reaches hnsw_threshold, and adding to it afterwards, would
+        otherwise hold the event loop for seconds.
+        '''
+        async with self._lock(namespace):
+            if namespace not in self.namespaces:
+                self.namespaces[namespace] = self._new_namespace(namespace, len(vectors[0].values))
+            await asyncio.to_thread(self.namespaces[namespace].upsert, vectors)
+
+    async def _submit(self, namespace: str, query_vectors: List[List[float]], top_k: int, include_values: bool,
+                      fields: Optional[List[str]], filter: Optional[Dict[str, Any]]) -> List[List[VectorData]]:
+        '''Queue queries for the dispatcher of the namespace and wait for their results'''
+        dimension = self.namespaces[namespace].dimension
+        for query_vector in query_vectors:
+            # Checked here so one malformed query does not fail the batch it would join
+            if len(query_vector) != dimension:
+                raise ValueError(f"Query dimension {len(query_vector)} does not match namespace dimension {dimension}")
+        loop = asyncio.get_running_loop()
+        request = PendingQuery(list(query_vectors), top_k, include_values, fields, filter, loop.create_future())
+        self._pending.setdefault(namespace, []).append(request)
+        if namespace not in self._dispatchers:
+            self._dispatchers[namespace] = loop.create_task(self._dispatch(namespace))
+        return await request.future
+
+    async def _dispatch(self, namespace: str) -> None:
+        '''Drain the queued queries of a namespace, one scan per top_k and filter'''
+        try:
+            while self._pending.get(namespace):
+                if self.batch_window:
+                    await asyncio.sleep(self.batch_window)
+                groups: Dict[Tuple[int, str], List[PendingQuery]] = {}
+                for request in self._pending.pop(namespace):
+                    if not request.future.done():
+                        key = (request.top_k, json.dumps(request.filter, sort_keys=True, default=str))
+                        groups.setdefault(key, []).append(request)
+                for group in groups.values():
+                    try:
+                        async with self._lock(namespace):
+                            results = await asyncio.to_thread(self._search_group, namespace, group)
+                    except Exception as e:
+                        for request in group:
+                            if not request.future.done():
+                                request.future.set_exception(e)
+                        continue
+                    for request, matches in zip(group, results):
+                        if not request.future.done():
+                            request.future.set_result(matches)
+        finally:
+            del self._dispatchers[namespace]
+
+    def _search_group(self, namespace: str, group: List[PendingQuery]) -> List[List[List[VectorData]]]:
+        '''Worker thread: score the queries of a group in one scan and build each caller's results'''
+        store = self.namespaces.get(namespace)
+        if store is None:
+            return [[[] for _ in request.query_vectors] for request in group]
+        if self.read_only and not isinstance(store, LocalNamespace):
+            # Pick up segments sealed by the writer process
+            store.refresh()
+        query_vectors = [query_vector for request in group for query_vector in request.query_vectors]
+        matches = store.search_batch(query_vectors, group[0].top_k, filter=group[0].filter,
+                                     executor=self._executor(), shard_rows=self.shard_rows)
+        self.dispatch_stats.batches += 1
+        self.dispatch_stats.queries += len(query_vectors)
+        results, offset = [], 0
+        for request in group:
+            request_results = []
+            for query_matches in matches[offset:offset + len(request.query_vectors)]:
+                vectors = []
+                for row, score in query_matches:
+                    vector = store.vector(row, request.include_values, request.fields)
+                    vector.score = score
+                    vectors.append(vector)
+                request_results.append(vectors)
+            results.append(request_results)
+            offset += len(request.query_vectors)
+        return results
+
+    async def query_vectors(self, namespace: str, query_vector: List[float], top_k: int = 5,
+                            filter: Optional[Dict[str, Any]] = None) -> List[VectorData]:
+        if namespace not in self.namespaces:
+            return []
+        try:
+            return (await self._submit(namespace, [query_vector], top_k, True, None, filter))[0]
+        except Exception as e:
+            print(f"Error querying vectors: {e}")
+            return []
+
+    async def query_vectors_batch(self, namespace: str, query_vectors: List[List[float]], top_k: int = 5,
+                                  include_values: bool = False, fields: Optional[List[str]] = None,
+                                  filter: Optional[Dict[str, Any]] = None) -> List[List[VectorData]]:
+        '''Score all the queries with one matrix product per block instead of one per query'''
+        if namespace not in self.namespaces or not query_vectors:
+            return [[] for _ in query_vectors]
+        try:
+            return await self._submit(namespace, query_vectors, top_k, include_values, fields, filter)
+        except Exception as e:
+            print(f"Error querying vectors: {e}")
+            return [[] for _ in query_vectors]
+
+    async def delete_vectors(self, namespace: str, ids: List[str]) -> bool:
+        try:
+            async with self._lock(namespace):
+                store = self.namespaces.get(namespace)
+                if store is not None:
+                    store.delete(ids)
+            return True
+        except Exception as e:
+            print(f"Error deleting vectors: {e}")
+            return False
+
+    async def compact_namespace(self, namespace: str, segments: Optional[List[str]] = None,
+                                budget: Optional['CompactionBudget'] = None) -> None:
+        '''
+        Drop tombstones in a worker thread. Segment namespaces merge `segments` (default all) while
+        queries continue, throttled by a vector_compaction.CompactionBudget when one is given;
+        in-memory namespaces hold their queries while rows are renumbered.
+        '''
+        store = self.namespaces.get(namespace)
+        if store is None:
+            return
+        if isinstance(store, LocalNamespace):
+            async with self._lock(namespace):
+                if budget is not None:
+                    budget.phase('compact', store.size)
+                await asyncio.to_thread(store.compact)
+        else:
+            await asyncio.to_thread(store.compact, segments, budget)
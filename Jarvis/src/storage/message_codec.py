@@ -0,0 +1,116 @@
+import base64
+import zlib
+from typing import Optional
+from django.conf import settings
+
+
+# Marker that prefixes every compressed payload stored in a TextField. It starts with a
+# control character so it never collides with real chat text; raw text that happens to
+# start with it anyway is always stored compressed, keeping decoding unambiguous.
+COMPRESSED_PREFIX = '\x02c:'
+
+# Shared dictionary primed with phrasing that is common in LLM answers. Short and medium
+# payloads compress much better when the compressor can reference it.
+# NEVER edit this in place: stored payloads reference it by version. Add a new version instead.
+SHARED_DICTIONARIES = {
+    1: (
+        b"I apologize, but I couldn't generate a response. "
+        b"Here is a summary of the conversation so far: "
+        b"Certainly! Here's an example: Sure! Let me explain. In summary, "
+        b"```python\nimport \ndef __init__(self, return None\n```\n"
+        b"```bash\npip install \n```\n"
+        b"For example, you can use the following code: "
+        b"This means that the function returns a list of strings. "
+        b"### Explanation\n### Example\n### Summary\n**Note:** "
+        b"1. **First**, 2. **Second**, 3. **Third**, - "
+        b"I hope this helps! Let me know if you have any other questions. "
+        b"The user asked about the following topic and the assistant explained "
+        b"the difference between the two approaches, including advantages and disadvantages. "
+    ),
+}
+CURRENT_DICTIONARY_VERSION = 1
+
+
+class MessageCodec:
+    """
+    Transparent compression of large message payloads stored in text columns.
+
+    Payloads shorter than the threshold are stored as-is. Larger ones are compressed
+    with zlib (or zstd when configured and the `zstandard` package is installed) using
+    a shared dictionary, base64 encoded and prefixed with COMPRESSED_PREFIX, followed by
+    a codec tag and the dictionary version, e.g. "\\x02c:z1:<base64>".
+    """
+
+    def __init__(self, threshold: Optional[int] = None, codec: Optional[str] = None, level: int = 6):
+        self.threshold = threshold if threshold is not None else getattr(settings, 'MESSAGE_COMPRESSION_THRESHOLD', 1024)
+        self.codec = codec or getattr(settings, 'MESSAGE_COMPRESSION_CODEC', 'zlib')
+        self.level = level
+        if self.codec not in ('zlib', 'zstd'):
+            raise ValueError(f"Unsupported message compression codec: {self.codec}")
+        self._zstd_compressor = None
+
+    @staticmethod
+    def _zstd():
+        import zstandard
+        return zstandard
+
+    def _zstd_dictionary(self, version: int):
+        zstandard = self._zstd()
+        return zstandard.ZstdCompressionDict(SHARED_DICTIONARIES[version], dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+
+    def compress(self, data: bytes) -> str:
+        """Compress bytes and return the prefixed, text-safe representation"""
+        version = CURRENT_DICTIONARY_VERSION
+        if self.codec == 'zstd':
+            if self._zstd_compressor is None:
+                self._zstd_compressor = self._zstd().ZstdCompressor(level=self.level, dict_data=self._zstd_dictionary(version))
+            tag, payload = 's', self._zstd_compressor.compress(data)
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, zdict=SHARED_DICTIONARIES[version])
+            tag, payload = 'z', compressor.compress(data) + compressor.flush()
+        return f"{COMPRESSED_PREFIX}{tag}{version}:{base64.b64encode(payload).decode('ascii')}"
+
+    def decompress(self, value: str) -> bytes:
+        """Inverse of compress()"""
+        header, _, encoded = value[len(COMPRESSED_PREFIX):].partition(':')
+        tag, version = header[0], int(header[1:])
+        payload = base64.b64decode(encoded)
+        if tag == 's':
+            return self._zstd().ZstdDecompressor(dict_data=self._zstd_dictionary(version)).decompress(payload)
+        if tag == 'z':
+            decompressor = zlib.decompressobj(-15, zdict=SHARED_DICTIONARIES[version])
+            return decompressor.decompress(payload) + decompressor.flush()
+        raise ValueError(f"Unknown compressed payload tag: {tag}")
+
+    def encode(self, text: Optional[str]) -> Optional[str]:
+        """Return the value to store for a message text"""
+        if not text:
+            return text
+        if len(text) < self.threshold and not text.startswith(COMPRESSED_PREFIX):
+            return text
+        compressed = self.compress(text.encode('utf-8'))
+        # Incompressible payloads (base64 adds a third) are kept raw unless they must be escaped
+        if len(compressed) >= len(text) and not text.startswith(COMPRESSED_PREFIX):
+            return text
+        return compressed
+
+    def decode(self, value: Optional[str]) -> Optional[str]:
+        """Return the message text for a stored value, compressed or not"""
+        if not value or not value.startswith(COMPRESSED_PREFIX):
+            return value
+        return self.decompress(value).decode('utf-8')
+
+    @staticmethod
+    def is_compressed(value: Optional[str]) -> bool:
+        return bool(value) and value.startswith(COMPRESSED_PREFIX)
+
+
+_default_codec: Optional[MessageCodec] = None
+
+
+def get_message_codec() -> MessageCodec:
+    """Return the process-wide codec configured from settings"""
+    global _default_codec
+    if _default_codec is None:
+        _default_codec = MessageCodec()
+    return _default_codec
@@ -0,0 +1,294 @@
+"""
+Milvus strategy for AsyncVectorDBFactory ('milvus').
+
+All namespaces live in one collection. The primary key combines namespace and id so ids
+are scoped per namespace as in Pinecone; next to it the schema holds the id, the
+namespace, a float vector field and a JSON metadata field. On a Milvus server each
+namespace is also a partition of the collection, so a query only scans its own partition.
+Milvus Lite has no partition support, so there (`namespace_mode` 'field') namespaces are
+kept apart by filtering on the namespace field instead.
+
+With a file path as `uri` (for example 'jarvis.db') pymilvus runs Milvus Lite
+in-process, which is what the tests use; an http(s) uri connects to a Milvus server or
+Zilliz Cloud.
+
+pymilvus is imported lazily and its client is synchronous, so every call runs in a
+worker thread to keep the event loop free.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import re
+from typing import Any, Dict, List, Optional
+from src.storage.vector_filter import RANGE_OPERATORS, validate_filter
+from src.storage.vector_store import AsyncVectorDBStrategy, VectorDBConfig, VectorData, project_metadata, values_list
+
+
+METRIC_TYPES = {'cosine': 'COSINE', 'dot': 'IP', 'l2': 'L2'}
+DEFAULT_COLLECTION = 'jarvis_vectors'
+MAX_ID_LENGTH = 512
+_RANGE_SYMBOLS = {'$gt': '>', '$gte': '>=', '$lt': '<', '$lte': '<='}
+
+
+def partition_name(namespace: str) -> str:
+    '''Milvus partition names only allow letters, digits and underscores'''
+    cleaned = re.sub(r'[^0-9A-Za-z_]', '_', namespace)
+    if cleaned == namespace:
+        return f"ns_{namespace}"
+    # Keep namespaces that only differ in replaced characters apart
+    return f"ns_{cleaned}_{hashlib.sha1(namespace.encode('utf-8')).hexdigest()[:8]}"
+
+
+def primary_key(namespace: str, vector_id: str) -> str:
+    '''Collection-wide key of a vector; the length prefix keeps ('a:b', 'c') apart from ('a', 'b:c')'''
+    return f"{len(namespace)}:{namespace}:{vector_id}"
+
+
+def _literal(value: Any) -> str:
+    return json.dumps(value)
+
+
+def _field(name: str) -> str:
+    return f"metadata[{json.dumps(name)}]"
+
+
+def to_milvus_expression(filter: Dict[str, Any]) -> str:
+    '''
+    Translate a Pinecone-style filter into a Milvus boolean expression over the JSON
+    metadata field. A list-valued field matches $eq and $in when any item does.
+    '''
+    clauses = []
+    for field, condition in filter.items():
+        if field in ('$and', '$or'):
+            joiner = ' and ' if field == '$and' else ' or '
+            clauses.append('(' + joiner.join(to_milvus_expression(item) for item in condition) + ')')
+            continue
+        operators = condition if isinstance(condition, dict) else {'$eq': condition}
+        for operator, operand in operators.items():
+            if operator == '$eq':
+                clauses.append(f"({_field(field)} == {_literal(operand)} or json_contains({_field(field)}, {_literal(operand)}))")
+            elif operator == '$in':
+                # One json_contains per item: json_contains_any does not match in Milvus Lite
+                contains = ''.join(f" or json_contains({_field(field)}, {_literal(item)})" for item in operand)
+                clauses.append(f"({_field(field)} in {_literal(operand)}{contains})")
+            elif operator in RANGE_OPERATORS:
+                clauses.append(f"{_field(field)} {_RANGE_SYMBOLS[operator]} {_literal(operand)}")
+    return ' and '.join(clauses) if clauses else ''
+
+
+class AsyncMilvusStrategy(AsyncVectorDBStrategy):
+    '''
+    Milvus Strategy Implementation
+
+    Config keys:
+        uri: Milvus Lite database file, or the http(s) address of a Milvus server
+        token: credentials for a server ('user:password' or an API key)
+        collection: collection holding every namespace (default 'jarvis_vectors')
+        dimension: vector dimension; without it the collection is created on the first upsert
+        metric: 'cosine' (default), 'dot' or 'l2'
+        index_type: 'AUTOINDEX' (default), 'FLAT', 'IVF_FLAT', 'HNSW'... (Milvus Lite supports FLAT and IVF_FLAT)
+        index_params: build parameters, e.g. {'nlist': 1024} or {'M': 16, 'efConstruction': 200}
+        search_params: query parameters, e.g. {'nprobe': 16} or {'ef': 64}
+        consistency_level: 'Strong' (default), 'Bounded', 'Session' or 'Eventually'
+        namespace_mode: 'partition' (one partition per namespace) or 'field' (namespace filter only);
+            defaults to 'field' for Milvus Lite and 'partition' for a server
+    '''
+
+    def __init__(self, config: VectorDBConfig):
+        self.config = config
+        # Milvus accepts up to 64MB per insert request
+        self.config.config_dict.setdefault('upsert_batch_size', 1000)
+        self.config.config_dict.setdefault('upsert_max_batch_bytes', 16 * 1024 * 1024)
+        self.collection = config.config_dict.get('collection', DEFAULT_COLLECTION)
+        self.dimension: Optional[int] = config.config_dict.get('dimension')
+        metric = config.config_dict.get('metric', 'cosine')
+        if metric not in METRIC_TYPES:
+            raise ValueError(f"Unsupported metric: {metric}")
+        self.metric = metric
+        uri = config.config_dict.get('uri', 'jarvis_milvus.db')
+        self.namespace_mode = config.config_dict.get(
+            'namespace_mode', 'partition' if re.match(r'^(https?|tcp)://', uri) else 'field')
+        if self.namespace_mode not in ('partition', 'field'):
+            raise ValueError(f"Unsupported namespace_mode: {self.namespace_mode}")
+        self.client = None
+        self.partitions: set = set()
+        self._collection_lock = asyncio.Lock()
+
+    async def _call(self, method: str, *args, **kwargs) -> Any:
+        '''Run a blocking MilvusClient method in a worker thread'''
+        return await asyncio.to_thread(getattr(self.client, method), *args, **kwargs)
+
+    async def initialize(self) -> None:
+        '''Connect and create the collection when its dimension is known'''
+        if self.client is not None:
+            return
+        from pymilvus import MilvusClient
+        connection = {'uri': self.config.config_dict.get('uri', 'jarvis_milvus.db')}
+        if self.config.config_dict.get('token'):
+            connection['token'] = self.config.config_dict['token']
+        self.client = await asyncio.to_thread(MilvusClient, **connection)
+        if await self._call('has_collection', self.collection):
+            description = await self._call('describe_collection', self.collection)
+            for field in description.get('fields', []):
+                if field.get('name') == 'vector':
+                    self.dimension = field.get('params', {}).get('dim', self.dimension)
+            if self.namespace_mode == 'partition':
+                self.partitions = set(await self._call('list_partitions', self.collection))
+        elif self.dimension:
+            await self._ensure_collection(self.dimension)
+
+    async def cleanup(self) -> None:
+        if self.client is not None:
+            await self._call('close')
+            self.client = None
+            self.partitions = set()
+
+    async def _ensure_collection(self, dimension: int) -> None:
+        async with self._collection_lock:
+            if await self._call('has_collection', self.collection):
+                return
+            from pymilvus import DataType, MilvusClient
+            schema = MilvusClient.create_schema(auto_id=False, enable_dynamic_field=False)
+            schema.add_field('pk', DataType.VARCHAR, is_primary=True, max_length=2 * MAX_ID_LENGTH + 8)
+            schema.add_field('id', DataType.VARCHAR, max_length=MAX_ID_LENGTH)
+            schema.add_field('namespace', DataType.VARCHAR, max_length=MAX_ID_LENGTH)
+            schema.add_field('vector', DataType.FLOAT_VECTOR, dim=dimension)
+            schema.add_field('metadata', DataType.JSON)
+            index_params = MilvusClient.prepare_index_params()
+            index_params.add_index(
+                field_name='vector',
+                index_type=self.config.config_dict.get('index_type', 'AUTOINDEX'),
+                metric_type=METRIC_TYPES[self.metric],
+                params=self.config.config_dict.get('index_params', {}),
+            )
+            await self._call('create_collection', self.collection, schema=schema, index_params=index_params,
+                             consistency_level=self.config.config_dict.get('consistency_level', 'Strong'))
+            self.dimension = dimension
+            if self.namespace_mode == 'partition':
+                self.partitions = set(await self._call('list_partitions', self.collection))
+
+    async def create_namespace(self, namespace: str, dimension: Optional[int] = None, *args, **kwargs) -> bool:
+        '''Create the partition of a namespace, and the collection first if needed'''
+        try:
+            if not self.dimension:
+                if dimension is None:
+                    # Created with the first upsert, like Pinecone does
+                    return True
+                await self._ensure_collection(dimension)
+            if self.namespace_mode == 'field':
+                return True
+            partition = partition_name(namespace)
+            if partition not in self.partitions:
+                if not await self._call('has_partition', self.collection, partition):
+                    await self._call('create_partition', self.collection, partition)
+                self.partitions.add(partition)
+            return True
+        except Exception as e:
+            print(f"Error creating namespace: {e}")
+            return False
+
+    async def delete_namespace(self, namespace: str, *args, **kwargs) -> bool:
+        partition = partition_name(namespace)
+        try:
+            if not self.dimension:
+                return True
+            if self.namespace_mode == 'field':
+                await self._call('delete', self.collection, filter=self._namespace_expression(namespace))
+            elif await self._call('has_partition', self.collection, partition):
+                # A loaded partition cannot be dropped
+                await self._call('release_partitions', self.collection, [partition])
+                await self._call('drop_partition', self.collection, partition)
+            self.partitions.discard(partition)
+            return True
+        except Exception as e:
+            print(f"Error deleting namespace: {e}")
+            return False
+
+    def _namespace_expression(self, namespace: str) -> str:
+        return f"namespace == {_literal(namespace)}"
+
+    def _partition_scope(self, namespace: str) -> Optional[Dict[str, Any]]:
+        '''Partition arguments of a request on the namespace, None when the namespace has no data'''
+        if not self.dimension:
+            return None
+        if self.namespace_mode == 'field':
+            return {}
+        partition = partition_name(namespace)
+        return {'partition_name': partition} if partition in self.partitions else None
+
+    async def _upsert_batch(self, namespace: str, vectors: List[VectorData]) -> None:
+        if not self.dimension:
+            await self._ensure_collection(len(vectors[0].values))
+        if self._partition_scope(namespace) is None:
+            if not await self.create_namespace(namespace):
+                raise RuntimeError(f"Could not create partition for namespace {namespace}")
+        records = [{'pk': primary_key(namespace, v.id), 'id': v.id, 'namespace': namespace, 'vector': values_list(v.values),
+                    'metadata': v.metadata or {}} for v in vectors]
+        await self._call('upsert', self.collection, records, **self._partition_scope(namespace))
+
+    def _search_params(self) -> Dict[str, Any]:
+        return {'metric_type': METRIC_TYPES[self.metric], 'params': self.config.config_dict.get('search_params', {})}
+
+    def _score(self, distance: float) -> float:
+        # Milvus reports squared distances for L2; callers get the euclidean distance like the local backend
+        return math.sqrt(max(distance, 0.0)) if self.metric == 'l2' else float(distance)
+
+    async def _search(self, namespace: str, query_vectors: List[List[float]], top_k: int, include_values: bool,
+                      fields: Optional[List[str]], filter: Optional[Dict[str, Any]]) -> List[List[VectorData]]:
+        scope = self._partition_scope(namespace)
+        if scope is None:
+            return [[] for _ in query_vectors]
+        if filter:
+            validate_filter(filter)
+        clauses = [self._namespace_expression(namespace)] if self.namespace_mode == 'field' else []
+        if filter and to_milvus_expression(filter):
+            clauses.append(f"({to_milvus_expression(filter)})")
+        output_fields = ['id', 'metadata'] + (['vector'] if include_values else [])
+        partitions = {'partition_names': [scope['partition_name']]} if scope else {}
+        hits = await self._call(
+            'search', self.collection, data=[[float(x) for x in vector] for vector in query_vectors],
+            filter=' and '.join(clauses), limit=top_k, output_fields=output_fields,
+            search_params=self._search_params(), anns_field='vector', **partitions,
+        )
+        results = []
+        for query_hits in hits:
+            matches = []
+            for hit in query_hits:
+                entity = hit.get('entity', {})
+                values = [float(x) for x in entity.get('vector', [])] if include_values else []
+                matches.append(VectorData(str(entity['id']), values, project_metadata(entity.get('metadata'), fields),
+                                          self._score(hit['distance'])))
+            results.append(matches)
+        return results
+
+    async def query_vectors(self, namespace: str, query_vector: List[float], top_k: int = 5,
+                            filter: Optional[Dict[str, Any]] = None) -> List[VectorData]:
+        try:
+            return (await self._search(namespace, [query_vector], top_k, True, None, filter))[0]
+        except Exception as e:
+            print(f"Error querying vectors: {e}")
+            return []
+
+    async def query_vectors_batch(self, namespace: str, query_vectors: List[List[float]], top_k: int = 5,
+                                  include_values: bool = False, fields: Optional[List[str]] = None,
+                                  filter: Optional[Dict[str, Any]] = None) -> List[List[VectorData]]:
+        '''Milvus searches several vectors in one request'''
+        if not query_vectors:
+            return []
+        try:
+            return await self._search(namespace, query_vectors, top_k, include_values, fields, filter)
+        except Exception as e:
+            print(f"Error querying vectors: {e}")
+            return [[] for _ in query_vectors]
+
+    async def delete_vectors(self, namespace: str, ids: List[str]) -> bool:
+        scope = self._partition_scope(namespace)
+        if scope is None or not ids:
+            return True
+        try:
+            await self._call('delete', self.collection, ids=[primary_key(namespace, i) for i in ids], **scope)
+            return True
+        except Exception as e:
+            print(f"Error deleting vectors: {e}")
+            return False
@@ -0,0 +1,236 @@
+"""
+Compressed vector codes for candidate search in segment namespaces.
+
+Quantizers are trained per segment when it is sealed. Their codes stay in RAM while the
+full-precision vectors stay in the memory-mapped segment: a query scores every row on the
+codes, keeps `rerank` x top_k candidates and re-ranks only those rows at full precision.
+
+    int8  scalar quantization, one byte per dimension (4x smaller than float32)
+    pq    product quantization, one byte per sub-vector (dimension / subvectors bytes,
+          16x smaller with the default 4-dimensional sub-vectors)
+
+Run the module to measure memory and recall against exact search:
+    python -m src.storage.quantization --vectors 50000 --dimension 768
+"""
+from pathlib import Path
+from typing import Dict, Optional
+import numpy as np
+
+
+# Rows decoded at once when scoring codes, bounds the float32 scratch memory
+SCORE_BLOCK_ROWS = 16384
+PQ_CENTROIDS = 256
+PQ_TRAINING_ROWS = 5000
+PQ_ITERATIONS = 10
+
+
+def _approximate_to_scores(products: np.ndarray, queries: np.ndarray, norms: np.ndarray, metric: str) -> np.ndarray:
+    '''Turn approximate dot products into scores, using exact squared norms for L2'''
+    if metric == 'l2':
+        query_norms = np.einsum('ij,ij->i', queries, queries)[:, None]
+        return -(query_norms - 2 * products + norms[None, :])
+    return products
+
+
+class ScalarQuantizer:
+    '''Per-dimension affine int8 quantization: value ~= low + scale * code'''
+    kind = 'int8'
+
+    def __init__(self, low: Optional[np.ndarray] = None, scale: Optional[np.ndarray] = None):
+        self.low = low
+        self.scale = scale
+
+    def fit(self, vectors: np.ndarray) -> 'ScalarQuantizer':
+        low, high = vectors.min(axis=0), vectors.max(axis=0)
+        self.low = low.astype(np.float32)
+        self.scale = np.where(high > low, (high - low) / 255, 1).astype(np.float32)
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.empty(vectors.shape, dtype=np.uint8)
+        for start in range(0, len(vectors), SCORE_BLOCK_ROWS):
+            block = (np.asarray(vectors[start:start + SCORE_BLOCK_ROWS]) - self.low) / self.scale
+            codes[start:start + SCORE_BLOCK_ROWS] = np.clip(np.rint(block), 0, 255)
+        return codes
+
+    def products(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        '''Approximate dot products of queries with the encoded rows, shape (queries, rows)'''
+        scaled = (queries * self.scale).T
+        products = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+            block = codes[start:start + SCORE_BLOCK_ROWS].astype(np.float32)
+            products[:, start:start + SCORE_BLOCK_ROWS] = (block @ scaled).T
+        return products + (queries @ self.low)[:, None]
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {'low': self.low, 'scale': self.scale}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray]) -> 'ScalarQuantizer':
+        return cls(state['low'], state['scale'])
+
+
+def _kmeans(data: np.ndarray, clusters: int, iterations: int, generator: np.random.Generator) -> np.ndarray:
+    centroids = data[generator.choice(len(data), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        # The squared norm of the row does not change its nearest centroid
+        distances = (centroids ** 2).sum(axis=1)[None, :] - 2 * data @ centroids.T
+        assignment = distances.argmin(axis=1)
+        counts = np.bincount(assignment, minlength=clusters)
+        sums = np.stack([np.bincount(assignment, weights=data[:, k], minlength=clusters)
+                         for k in range(data.shape[1])], axis=1)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+class ProductQuantizer:
+    '''
+    Product quantization: the vector is split into `subvectors` chunks, each replaced by the
+    index of its nearest of 256 k-means centroids. Queries are scored with per-chunk lookup tables.
+    '''
+    kind = 'pq'
+
+    def __init__(self, subvectors: int, centroids: Optional[np.ndarray] = None, seed: int = 11):
+        self.subvectors = subvectors
+        # shape (subvectors, clusters, chunk dimension)
+        self.centroids = centroids
+        self.seed = seed
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        rows, dimension = vectors.shape
+        if dimension % self.subvectors:
+            raise ValueError(f"Dimension {dimension} is not divisible into {self.subvectors} sub-vectors")
+        return np.asarray(vectors, dtype=np.float32).reshape(rows, self.subvectors, dimension // self.subvectors)
+
+    def fit(self, vectors: np.ndarray) -> 'ProductQuantizer':
+        generator = np.random.default_rng(self.seed)
+        sample = vectors
+        if len(vectors) > PQ_TRAINING_ROWS:
+            sample = vectors[np.sort(generator.choice(len(vectors), PQ_TRAINING_ROWS, replace=False))]
+        # One contiguous (rows, chunk dimension) block per sub-vector
+        chunks = np.ascontiguousarray(self._split(np.asarray(sample)).transpose(1, 0, 2))
+        clusters = min(PQ_CENTROIDS, len(sample))
+        self.centroids = np.stack([
+            _kmeans(chunks[j], clusters, PQ_ITERATIONS, generator) for j in range(self.subvectors)
+        ]).astype(np.float32)
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.empty((len(vectors), self.subvectors), dtype=np.uint8)
+        centroid_norms = (self.centroids ** 2).sum(axis=2)
+        for start in range(0, len(vectors), SCORE_BLOCK_ROWS):
+            chunks = np.ascontiguousarray(self._split(np.asarray(vectors[start:start + SCORE_BLOCK_ROWS])).transpose(1, 0, 2))
+            for j in range(self.subvectors):
+                distances = centroid_norms[j][None, :] - 2 * chunks[j] @ self.centroids[j].T
+                codes[start:start + SCORE_BLOCK_ROWS, j] = distances.argmin(axis=1)
+        return codes
+
+    def products(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        '''Approximate dot products through per-query lookup tables, shape (queries, rows)'''
+        # tables[q, j, c] = <query q chunk j, centroid c of chunk j>
+        tables = np.einsum('qjd,jcd->qjc', self._split(queries), self.centroids)
+        chunk_index = np.arange(self.subvectors)
+        products = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+            block = codes[start:start + SCORE_BLOCK_ROWS]
+            for q, table in enumerate(tables):
+                products[q, start:start + SCORE_BLOCK_ROWS] = table[chunk_index, block].sum(axis=1)
+        return products
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {'centroids': self.centroids}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray]) -> 'ProductQuantizer':
+        return cls(state['centroids'].shape[0], state['centroids'])
+
+
+class QuantizedCodes:
+    '''A trained quantizer together with the codes of one segment'''
+
+    def __init__(self, quantizer, codes: np.ndarray):
+        self.quantizer = quantizer
+        self.codes = codes
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + sum(array.nbytes for array in self.quantizer.state().values())
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, kind: str, subvectors: Optional[int] = None) -> 'QuantizedCodes':
+        if kind == 'int8':
+            quantizer = ScalarQuantizer()
+        elif kind == 'pq':
+            quantizer = ProductQuantizer(subvectors or max(vectors.shape[1] // 4, 1))
+        else:
+            raise ValueError(f"Unsupported quantization: {kind}")
+        quantizer.fit(vectors)
+        return cls(quantizer, quantizer.encode(vectors))
+
+    def scores(self, queries: np.ndarray, norms: np.ndarray, metric: str) -> np.ndarray:
+        return _approximate_to_scores(self.quantizer.products(queries, self.codes), queries, norms, metric)
+
+    def save(self, path: Path) -> None:
+        with open(path, 'wb') as handle:
+            np.savez(handle, kind=np.array(self.quantizer.kind), codes=self.codes, **self.quantizer.state())
+
+    @classmethod
+    def load(cls, path: Path) -> 'QuantizedCodes':
+        with np.load(path) as data:
+            state = {name: data[name] for name in data.files}
+        kind = str(state.pop('kind'))
+        codes = state.pop('codes')
+        quantizer = ScalarQuantizer.from_state(state) if kind == 'int8' else ProductQuantizer.from_state(state)
+        return cls(quantizer, codes)
+
+
+def benchmark(vectors: int = 50000, dimension: int = 768, queries: int = 100, top_k: int = 10,
+              rerank_factors=(1, 4, 10), seed: int = 5) -> Dict:
+    '''Memory and recall@k of int8 and PQ candidate search, with and without re-ranking'''
+    from src.storage.local_vector_store import prepare_vectors, score_matrix, top_k_rows
+
+    generator = np.random.default_rng(seed)
+    centroids = generator.normal(size=(100, dimension))
+    data = prepare_vectors(
+        centroids[generator.integers(0, len(centroids), vectors)] + generator.normal(size=(vectors, dimension)),
+        dimension, 'cosine')
+    query_data = prepare_vectors(
+        centroids[generator.integers(0, len(centroids), queries)] + generator.normal(size=(queries, dimension)),
+        dimension, 'cosine')
+    norms = np.ones(vectors, dtype=np.float32)
+    exact = [set(top_k_rows(scores, top_k).tolist()) for scores in score_matrix(query_data, data, norms, 'cosine')]
+
+    report = {'float32_bytes': data.nbytes, 'quantizers': []}
+    for kind in ('int8', 'pq'):
+        codes = QuantizedCodes.build(data, kind)
+        approximate = codes.scores(query_data, norms, 'cosine')
+        for factor in rerank_factors:
+            hits = 0
+            for query, scores, expected in zip(query_data, approximate, exact):
+                candidates = top_k_rows(scores, top_k * factor)
+                exact_scores = data[candidates] @ query
+                found = candidates[top_k_rows(exact_scores, top_k)]
+                hits += len(expected & set(found.tolist()))
+            report['quantizers'].append({
+                'kind': kind, 'rerank': factor, 'bytes': codes.nbytes,
+                'compression': data.nbytes / codes.nbytes, 'recall': hits / (queries * top_k),
+            })
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Quantized candidate search memory and recall")
+    parser.add_argument('--vectors', type=int, default=50000)
+    parser.add_argument('--dimension', type=int, default=768)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--top-k', type=int, default=10)
+    args = parser.parse_args()
+
+    result = benchmark(args.vectors, args.dimension, args.queries, args.top_k)
+    print(f"float32: {result['float32_bytes'] / 2 ** 20:.1f} MiB")
+    for row in result['quantizers']:
+        print(f"{row['kind']:5} rerank x{row['rerank']:<3} {row['bytes'] / 2 ** 20:7.1f} MiB "
+              f"({row['compression']:4.1f}x smaller) recall@{args.top_k}={row['recall']:.3f}")
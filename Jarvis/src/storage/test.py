@@ -1,10 +1,16 @@
 
+import asyncio
 import unittest
+import importlib.util
 import os
+import random
+import tempfile
 import warnings
-import constants
 from dotenv import load_dotenv
-from vector_store import VectorDBConfig, AsyncVectorDBFactory, VectorData
+from src.storage import constants
+from src.storage.vector_store import VectorDBConfig, AsyncVectorDBFactory, VectorData, vectors_from_array, values_list
+from src.storage.local_vector_store import default_index_threshold
+from src.storage.vector_upsert import VectorUpsertPipeline, record_size, split_batches
 
 
 load_dotenv()
@@ -66,6 +72,733 @@ class AsyncTestCase(unittest.IsolatedAsyncioTestCase):
         result = await self.strategy.delete_namespace("test_namespace")
         self.assertTrue(result)
 
+
+class LocalVectorStoreTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.persist_dir = tempfile.TemporaryDirectory()
+        self.config = VectorDBConfig(config_dict={'db_type': 'local', 'persist_dir': self.persist_dir.name})
+        self.strategy = AsyncVectorDBFactory.create_strategy(self.config)
+        await self.strategy.initialize()
+        vectors = [
+            VectorData(id="1", values=constants.vector_1, metadata={"field": "value"}),
+            VectorData(id="2", values=constants.vector_2, metadata={"field": "value2"}),
+            VectorData(id="3", values=[-x for x in constants.vector_1], metadata={"field": "value3"}),
+        ]
+        self.assertTrue(await self.strategy.upsert_vectors("test_namespace", vectors))
+
+    async def asyncTearDown(self):
+        await self.strategy.cleanup()
+        self.persist_dir.cleanup()
+
+    async def test_query_vectors(self):
+        results = await self.strategy.query_vectors("test_namespace", constants.vector_1, top_k=2)
+        self.assertEqual([result.id for result in results], ["1", "2"])
+        self.assertAlmostEqual(results[0].score, 1.0, places=4)
+        self.assertEqual(results[0].metadata, {"field": "value"})
+
+    async def test_query_vectors_batch(self):
+        batch = await self.strategy.query_vectors_batch(
+            "test_namespace", [constants.vector_1, constants.vector_2], top_k=2, fields=["field"])
+        for query, matches in zip([constants.vector_1, constants.vector_2], batch):
+            single = await self.strategy.query_vectors("test_namespace", query, top_k=2)
+            self.assertEqual([m.id for m in matches], [m.id for m in single])
+            self.assertEqual([m.metadata for m in matches], [m.metadata for m in single])
+            self.assertTrue(all(m.values == [] for m in matches))
+        batch = await self.strategy.query_vectors_batch("test_namespace", [constants.vector_1], top_k=1,
+                                                        include_values=True, fields=[])
+        self.assertEqual((len(batch[0][0].values), batch[0][0].metadata), (len(constants.vector_1), {}))
+
+    async def test_filters(self):
+        await self.strategy.upsert_vectors("filtered", [
+            VectorData(id=str(i), values=constants.vector_1 if i % 2 else constants.vector_2,
+                       metadata={"document": f"doc{i % 3}", "created_at": i, "tags": ["a", "b"] if i < 5 else ["c"]})
+            for i in range(10)
+        ])
+
+        async def ids(filter):
+            results = await self.strategy.query_vectors("filtered", constants.vector_1, top_k=10, filter=filter)
+            return sorted(int(result.id) for result in results)
+
+        self.assertEqual(await ids({"document": "doc1"}), [1, 4, 7])
+        self.assertEqual(await ids({"document": {"$in": ["doc0", "doc2"]}, "created_at": {"$gte": 5}}), [5, 6, 8, 9])
+        self.assertEqual(await ids({"tags": "c", "created_at": {"$lt": 7}}), [5, 6])
+        self.assertEqual(await ids({"$or": [{"created_at": {"$lte": 1}}, {"created_at": {"$gt": 8}}]}), [0, 1, 9])
+        self.assertEqual(await ids({"document": "missing"}), [])
+
+        await self.strategy.upsert_vectors("filtered", [VectorData(id="1", values=constants.vector_1, metadata={"document": "doc2"})])
+        await self.strategy.delete_vectors("filtered", ["4"])
+        self.assertEqual(await ids({"document": "doc1"}), [7])
+        self.assertEqual(await ids({"document": {"$regex": "doc"}}), [])
+
+    async def test_metrics(self):
+        for metric, expected in (("dot", ["1", "2", "3"]), ("l2", ["1", "2", "3"])):
+            await self.strategy.create_namespace(metric, dimension=len(constants.vector_1), metric=metric)
+            await self.strategy.upsert_vectors(metric, [
+                VectorData(id="3", values=[-x for x in constants.vector_1], metadata={}),
+                VectorData(id="2", values=constants.vector_2, metadata={}),
+                VectorData(id="1", values=constants.vector_1, metadata={}),
+            ])
+            results = await self.strategy.query_vectors(metric, constants.vector_1, top_k=3)
+            self.assertEqual([result.id for result in results], expected)
+        self.assertAlmostEqual(results[0].score, 0.0, delta=1e-2)
+
+    async def test_delete_and_overwrite(self):
+        self.assertTrue(await self.strategy.delete_vectors(namespace="test_namespace", ids=["1"]))
+        await self.strategy.upsert_vectors("test_namespace", [VectorData(id="2", values=constants.vector_1, metadata={})])
+        results = await self.strategy.query_vectors("test_namespace", constants.vector_1, top_k=5)
+        self.assertEqual([result.id for result in results], ["2", "3"])
+
+    async def test_snapshot_round_trip(self):
+        await self.strategy.delete_vectors(namespace="test_namespace", ids=["2"])
+        await self.strategy.cleanup()
+
+        restored = AsyncVectorDBFactory.create_strategy(self.config)
+        await restored.initialize()
+        results = await restored.query_vectors("test_namespace", constants.vector_1, top_k=5)
+        self.assertEqual([(result.id, result.metadata) for result in results],
+                         [("1", {"field": "value"}), ("3", {"field": "value3"})])
+
+        self.assertTrue(await restored.delete_namespace("test_namespace"))
+        self.assertEqual(await restored.query_vectors("test_namespace", constants.vector_1), [])
+
+    async def test_namespace_names_cannot_escape_persist_dir(self):
+        victim = os.path.join(self.persist_dir.name, "victim")
+        os.makedirs(os.path.join(victim, "data"))
+        store = os.path.join(self.persist_dir.name, "store")
+        for storage in ("memory", "segments"):
+            strategy = AsyncVectorDBFactory.create_strategy(VectorDBConfig(config_dict={
+                'db_type': 'local', 'persist_dir': store, 'storage': storage, 'upsert_max_retries': 0}))
+            await strategy.initialize()
+            for namespace in ("../victim", "..", "a/b", "", "ns.1"):
+                self.assertFalse(await strategy.create_namespace(namespace, dimension=4))
+                self.assertFalse(await strategy.delete_namespace(namespace))
+            self.assertFalse(await strategy.upsert_vectors("../victim", [VectorData(id="1", values=[1.0] * 4, metadata={})]))
+            self.assertTrue(await strategy.create_namespace("docs_v2-en", dimension=4))
+            await strategy.cleanup()
+        self.assertTrue(os.path.isdir(os.path.join(victim, "data")))
+
+    async def test_vectors_of_another_dimension_are_rejected(self):
+        for storage in ("memory", "segments"):
+            strategy = AsyncVectorDBFactory.create_strategy(VectorDBConfig(config_dict={
+                'db_type': 'local', 'persist_dir': os.path.join(self.persist_dir.name, storage), 'storage': storage,
+                'upsert_max_retries': 0}))
+            await strategy.initialize()
+            self.assertTrue(await strategy.create_namespace("docs", dimension=4))
+            # Two 2-d vectors hold as many floats as one 4-d vector
+            self.assertFalse(await strategy.upsert_vectors("docs", [
+                VectorData(id="a", values=[1.0, 0.0], metadata={}), VectorData(id="b", values=[0.0, 1.0], metadata={})]))
+            self.assertFalse(await strategy.upsert_vectors("docs", [VectorData(id="c", values=[1.0] * 5, metadata={})]))
+            self.assertEqual(strategy.namespaces["docs"].count, 0)
+            await strategy.cleanup()
+
+
+class HNSWIndexTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_hnsw_matches_brute_force_and_persists(self):
+        import numpy as np
+        generator = np.random.default_rng(3)
+        data = generator.normal(size=(600, 16)).tolist()
+        with tempfile.TemporaryDirectory() as persist_dir:
+            config = VectorDBConfig(config_dict={'db_type': 'local', 'persist_dir': persist_dir, 'index': 'hnsw',
+                                                 'hnsw_threshold': 100, 'hnsw_ef_search': 100,
+                                                 'hnsw_ef_construction': 64})
+            strategy = AsyncVectorDBFactory.create_strategy(config)
+            await strategy.initialize()
+            await strategy.upsert_vectors("hnsw", [VectorData(str(i), v, {}) for i, v in enumerate(data)])
+            await strategy.delete_vectors("hnsw", ["0", "1"])
+            await strategy.upsert_vectors("hnsw", [VectorData("2", data[5], {})])
+
+            store = strategy.namespaces["hnsw"]
+            self.assertIsNotNone(store.index)
+            for query in data[:20]:
+                exact = [row for row, _ in store.search(query, 5, exact=True)]
+                self.assertEqual([row for row, _ in store.search(query, 5)], exact)
+            results = await strategy.query_vectors("hnsw", data[0], top_k=3)
+            self.assertNotIn("0", [result.id for result in results])
+            await strategy.cleanup()
+
+            restored = AsyncVectorDBFactory.create_strategy(config)
+            await restored.initialize()
+            self.assertIsNotNone(restored.namespaces["hnsw"].index)
+            results = await restored.query_vectors("hnsw", data[5], top_k=2)
+            self.assertEqual(sorted(result.id for result in results), ["2", "5"])
+
+    async def test_repeated_id_in_a_batch(self):
+        import numpy as np
+        data = np.random.default_rng(5).normal(size=(60, 8)).astype(np.float32)
+        strategy = AsyncVectorDBFactory.create_strategy(VectorDBConfig(config_dict={
+            'db_type': 'local', 'index': 'hnsw', 'hnsw_threshold': 50}))
+        await strategy.initialize()
+        await strategy.upsert_vectors("hnsw", [VectorData(str(i), data[i], {}) for i in range(50)])
+        self.assertIsNotNone(strategy.namespaces["hnsw"].index)
+
+        # The last copy wins, the first one must not come back as a row without an id
+        self.assertTrue(await strategy.upsert_vectors("hnsw", [
+            VectorData("dup", data[50], {"copy": 1}), VectorData("dup", data[51], {"copy": 2})]))
+        store = strategy.namespaces["hnsw"]
+        self.assertEqual((store.count, store.tombstones), (51, 0))
+        for query in (data[50], data[51]):
+            results = await strategy.query_vectors("hnsw", query, top_k=3)
+            self.assertNotIn(None, [result.id for result in results])
+        results = await strategy.query_vectors("hnsw", data[51], top_k=1)
+        self.assertEqual((results[0].id, results[0].metadata), ("dup", {"copy": 2}))
+        await strategy.cleanup()
+
+    async def test_default_threshold_depends_on_the_dimension(self):
+        import numpy as np
+        strategy = AsyncVectorDBFactory.create_strategy(VectorDBConfig(config_dict={'db_type': 'local', 'index': 'hnsw'}))
+        await strategy.initialize()
+        await strategy.upsert_vectors("small", [VectorData(str(i), v, {}) for i, v in enumerate(np.eye(64))])
+        store = strategy.namespaces["small"]
+        self.assertIsNone(store.index)
+        self.assertEqual(store.index_threshold, default_index_threshold(64))
+        self.assertGreater(default_index_threshold(64), default_index_threshold(768))
+        await strategy.cleanup()
+
+    async def test_index_build_does_not_block_the_loop(self):
+        import time
+        import numpy as np
+        data = np.random.default_rng(4).normal(size=(2400, 32)).astype(np.float32)
+        strategy = AsyncVectorDBFactory.create_strategy(VectorDBConfig(config_dict={
+            'db_type': 'local', 'index': 'hnsw', 'hnsw_threshold': 1200, 'hnsw_ef_construction': 64}))
+        await strategy.initialize()
+        await strategy.upsert_vectors("hnsw", [VectorData(str(i), data[i], {}) for i in range(1199)])
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(time.perf_counter())
+                await asyncio.sleep(0.005)
+
+        task = asyncio.ensure_future(ticker())
+        await asyncio.sleep(0)
+        start_time = time.perf_counter()
+        # Crosses the threshold: builds the graph, then adds the rest to it
+        await strategy.upsert_vectors("hnsw", [VectorData(str(i), data[i], {}) for i in range(1199, 2400)])
+        elapsed = time.perf_counter() - start_time
+        task.cancel()
+        self.assertIsNotNone(strategy.namespaces["hnsw"].index)
+        self.assertGreater(elapsed, 0.2)
+        # The loop kept running other coroutines during the build
+        self.assertGreater(len(ticks), 10)
+        self.assertLess(max(np.diff(ticks)), elapsed / 4)
+        await strategy.cleanup()
+
+
+class ShardedQueryTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.persist_dir = tempfile.TemporaryDirectory()
+        rng = random.Random(3)
+        self.vectors = [VectorData(id=str(i), values=[rng.uniform(-1, 1) for _ in range(16)], metadata={"group": i % 3})
+                        for i in range(500)]
+        self.queries = [[rng.uniform(-1, 1) for _ in range(16)] for _ in range(12)]
+
+    async def asyncTearDown(self):
+        self.persist_dir.cleanup()
+
+    async def results(self, config_dict, filter=None):
+        strategy = AsyncVectorDBFactory.create_strategy(VectorDBConfig(config_dict=config_dict))
+        await strategy.initialize()
+        await strategy.upsert_vectors("sharded", self.vectors)
+        # Concurrent queries are answered by a shared scan
+        results = await asyncio.gather(*(strategy.query_vectors("sharded", query, top_k=7, filter=filter)
+                                         for query in self.queries))
+        self.assertLess(strategy.dispatch_stats.batches, len(self.queries))
+        await strategy.cleanup()
+        return [[(result.id, round(result.score, 5)) for result in matches] for matches in results]
+
+    async def test_shards_match_single_thread_scan(self):
+        for filter in (None, {"group": 1}):
+            expected = await self.results({'db_type': 'local', 'query_threads': 1}, filter)
+            sharded = await self.results({'db_type': 'local', 'query_threads': 4, 'query_shard_rows': 64}, filter)
+            self.assertEqual(sharded, expected)
+            segments = await self.results({'db_type': 'local', 'query_threads': 4, 'query_shard_rows': 64,
+                                           'storage': 'segments', 'segment_max_vectors': 150,
+                                           'persist_dir': os.path.join(self.persist_dir.name, str(bool(filter)))}, filter)
+            self.assertEqual(segments, expected)
+
+
+class SegmentStorageTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.persist_dir = tempfile.TemporaryDirectory()
+        self.config = VectorDBConfig(config_dict={'db_type': 'local', 'persist_dir': self.persist_dir.name,
+                                                  'storage': 'segments', 'segment_max_vectors': 2})
+        self.strategy = AsyncVectorDBFactory.create_strategy(self.config)
+        await self.strategy.initialize()
+        await self.strategy.upsert_vectors("segments", [
+            VectorData(id="1", values=constants.vector_1, metadata={"field": "value"}),
+            VectorData(id="2", values=constants.vector_2, metadata={"field": "value2"}),
+            VectorData(id="3", values=[-x for x in constants.vector_1], metadata={"field": "value3"}),
+        ])
+
+    async def asyncTearDown(self):
+        self.persist_dir.cleanup()
+
+    async def query_ids(self, strategy, vector):
+        return [result.id for result in await strategy.query_vectors("segments", vector, top_k=5)]
+
+    async def test_segments_write_log_and_readers(self):
+        store = self.strategy.namespaces["segments"]
+        # The first batch filled the write buffer and was sealed into a segment
+        self.assertEqual(len(store.segments), 1)
+        await self.strategy.delete_vectors("segments", ["1"])
+        await self.strategy.upsert_vectors("segments", [VectorData(id="2", values=constants.vector_1, metadata={})])
+        self.assertEqual(await self.query_ids(self.strategy, constants.vector_1), ["2", "3"])
+
+        # A fresh writer replays the write log
+        writer = AsyncVectorDBFactory.create_strategy(self.config)
+        await writer.initialize()
+        self.assertEqual(await self.query_ids(writer, constants.vector_1), ["2", "3"])
+
+        # A read-only worker sees sealed segments only, and picks up new ones
+        reader = AsyncVectorDBFactory.create_strategy(VectorDBConfig(config_dict={**self.config.config_dict, 'read_only': True}))
+        await reader.initialize()
+        self.assertEqual(await self.query_ids(reader, constants.vector_2), ["2", "1", "3"])
+        await writer.cleanup()
+        os.utime(writer.namespaces["segments"].manifest_path, (1e9 + 1, 1e9 + 1))
+        self.assertEqual(await self.query_ids(reader, constants.vector_1), ["2", "3"])
+
+    async def test_compaction(self):
+        await self.strategy.upsert_vectors("segments", [
+            VectorData(id="4", values=constants.vector_2, metadata={}),
+            VectorData(id="5", values=[-x for x in constants.vector_2], metadata={}),
+        ])
+        await self.strategy.delete_vectors("segments", ["2"])
+        store = self.strategy.namespaces["segments"]
+        self.assertEqual((len(store.segments), store.tombstones), (2, 1))
+
+        await self.strategy.compact_namespace("segments")
+        self.assertEqual((len(store.segments), store.tombstones), (1, 0))
+        results = await self.strategy.query_vectors("segments", constants.vector_1, top_k=5, filter={"field": {"$in": ["value", "value3"]}})
+        self.assertEqual([result.id for result in results], ["1", "3"])
+        self.assertEqual(await self.query_ids(self.strategy, constants.vector_1), ["1", "4", "5", "3"])
+        batch = await self.strategy.query_vectors_batch("segments", [constants.vector_1, constants.vector_2], top_k=5)
+        self.assertEqual([[m.id for m in matches] for matches in batch],
+                         [["1", "4", "5", "3"], await self.query_ids(self.strategy, constants.vector_2)])
+        results = await self.strategy.query_vectors("segments", constants.vector_1, top_k=1)
+        self.assertEqual(results[0].metadata, {"field": "value"})
+        self.assertTrue(await self.strategy.delete_namespace("segments"))
+        self.assertFalse(os.path.exists(os.path.join(self.persist_dir.name, "segments")))
+
+
+class BackgroundCompactionTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.persist_dir = tempfile.TemporaryDirectory()
+        rng = random.Random(5)
+        self.vectors = [VectorData(id=str(i), values=[rng.uniform(-1, 1) for _ in range(8)], metadata={"i": i})
+                        for i in range(40)]
+
+    async def asyncTearDown(self):
+        self.persist_dir.cleanup()
+
+    async def ids(self, strategy, namespace):
+        return [[result.id for result in await strategy.query_vectors(namespace, vector.values, top_k=5)]
+                for vector in self.vectors[::7]]
+
+    async def test_background_merge_with_progress(self):
+        strategy = AsyncVectorDBFactory.create_strategy(VectorDBConfig(config_dict={
+            'db_type': 'local', 'persist_dir': self.persist_dir.name, 'storage': 'segments', 'segment_max_vectors': 10,
+            'quantization': 'int8', 'compaction_interval': 0.01, 'compaction_io_bytes_per_second': 10 ** 7}))
+        await strategy.initialize()
+        for start in range(0, 40, 5):
+            await strategy.upsert_vectors("merged", self.vectors[start:start + 5])
+        await strategy.delete_vectors("merged", [str(i) for i in range(0, 40, 3)])
+        store = strategy.namespaces["merged"]
+        self.assertEqual(len(store.segments), 4)
+        expected = await self.ids(strategy, "merged")
+
+        for _ in range(200):
+            progress = strategy.compactor.progress.get("merged")
+            if progress is not None and progress.finished_at is not None:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual((progress.phase, progress.fraction, progress.error), ("done", 1.0, None))
+        self.assertGreater(progress.bytes_done, 0)
+        self.assertEqual((len(store.segments), store.tombstones, store.count), (1, 0, 26))
+        self.assertEqual(await self.ids(strategy, "merged"), expected)
+        await strategy.cleanup()
+
+    async def test_cleanup_waits_for_a_running_merge(self):
+        strategy = AsyncVectorDBFactory.create_strategy(VectorDBConfig(config_dict={
+            'db_type': 'local', 'persist_dir': self.persist_dir.name, 'storage': 'segments', 'segment_max_vectors': 10,
+            'compaction_interval': 0.01, 'compaction_io_bytes_per_second': 5000}))
+        await strategy.initialize()
+        for start in range(0, 40, 5):
+            await strategy.upsert_vectors("merged", self.vectors[start:start + 5])
+        await strategy.delete_vectors("merged", [str(i) for i in range(0, 40, 3)])
+
+        for _ in range(200):
+            progress = strategy.compactor.progress.get("merged")
+            if progress is not None and progress.bytes_done:
+                break
+            await asyncio.sleep(0.01)
+        self.assertIsNone(progress.finished_at)
+        # The throttled merge is still running in its thread, stopping must wait for it
+        await strategy.cleanup()
+        self.assertEqual(progress.phase, "done")
+        self.assertEqual(len(strategy.namespaces["merged"].segments), 1)
+
+    async def test_memory_namespace_keeps_its_graph(self):
+        strategy = AsyncVectorDBFactory.create_strategy(VectorDBConfig(config_dict={
+            'db_type': 'local', 'index': 'hnsw', 'hnsw_threshold': 0}))
+        await strategy.upsert_vectors("graph", self.vectors)
+        await strategy.delete_vectors("graph", [str(i) for i in range(0, 40, 2)])
+        expected = await self.ids(strategy, "graph")
+        from src.storage.vector_compaction import BackgroundCompactor
+        compacted = await BackgroundCompactor(strategy).run_once()
+        store = strategy.namespaces["graph"]
+        self.assertEqual((compacted["graph"].phase, store.size, len(store.index)), ("done", 20, 20))
+        self.assertEqual(await self.ids(strategy, "graph"), expected)
+
+    def test_budget_throttles(self):
+        from src.storage.vector_compaction import CompactionBudget
+        budget = CompactionBudget(io_bytes_per_second=10 ** 6)
+        budget.phase('write', 2)
+        budget.consume(1, 10 ** 5)
+        budget.consume(1, 10 ** 5)
+        self.assertGreaterEqual(budget.progress.throttled_seconds, 0.15)
+        self.assertEqual((budget.progress.rows_done, budget.progress.fraction), (2, 1.0))
+
+
+class QuantizedSegmentTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.persist_dir = tempfile.TemporaryDirectory()
+        generator = random.Random(3)
+        self.vectors = [VectorData(id=str(i), values=[generator.gauss(0, 1) for _ in range(32)], metadata={})
+                        for i in range(600)]
+
+    async def asyncTearDown(self):
+        self.persist_dir.cleanup()
+
+    async def check_quantization(self, kind):
+        config = VectorDBConfig(config_dict={'db_type': 'local', 'persist_dir': self.persist_dir.name,
+                                             'storage': 'segments', 'segment_max_vectors': 250,
+                                             'quantization': kind, 'pq_subvectors': 8})
+        strategy = AsyncVectorDBFactory.create_strategy(config)
+        await strategy.initialize()
+        for start in range(0, len(self.vectors), 250):
+            await strategy.upsert_vectors(kind, self.vectors[start:start + 250])
+        store = strategy.namespaces[kind]
+        self.assertEqual(len(store.codes), 2)
+        # One byte per dimension for int8, one per sub-vector for PQ
+        self.assertEqual({codes.codes.shape[1] for codes in store.codes.values()}, {32 if kind == 'int8' else 8})
+
+        hits = 0
+        for vector in self.vectors[:40]:
+            expected = [row for row, _ in store.search(vector.values, 10, exact=True)]
+            found = [row for row, _ in store.search(vector.values, 10)]
+            self.assertEqual(found[0], expected[0])
+            hits += len(set(expected) & set(found))
+        self.assertGreaterEqual(hits / 400, 0.9)
+
+        # Codes are persisted next to the segments and reused by a reopened namespace
+        reopened = AsyncVectorDBFactory.create_strategy(VectorDBConfig(config_dict={**config.config_dict, 'read_only': True}))
+        await reopened.initialize()
+        self.assertEqual(reopened.namespaces[kind].quantization['kind'], kind)
+        results = await reopened.query_vectors(kind, self.vectors[0].values, top_k=1)
+        self.assertEqual(results[0].id, "0")
+
+    async def test_int8(self):
+        await self.check_quantization('int8')
+
+    async def test_product_quantization(self):
+        await self.check_quantization('pq')
+
+    def test_quantization_requires_segments(self):
+        with self.assertRaises(ValueError):
+            AsyncVectorDBFactory.create_strategy(VectorDBConfig(config_dict={'db_type': 'local', 'quantization': 'int8'}))
+
+
+class QueryCacheTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.strategy = AsyncVectorDBFactory.create_strategy(VectorDBConfig(config_dict={
+            'db_type': 'local', 'query_cache': True, 'query_cache_max_entries': 2,
+        }))
+        await self.strategy.initialize()
+        await self.strategy.upsert_vectors("cache", [
+            VectorData(id="1", values=constants.vector_1, metadata={"field": "value"}),
+            VectorData(id="2", values=constants.vector_2, metadata={"field": "value2"}),
+        ])
+
+    async def test_hits_and_invalidation(self):
+        first = await self.strategy.query_vectors("cache", constants.vector_1, top_k=1)
+        second = await self.strategy.query_vectors("cache", list(constants.vector_1), top_k=1)
+        self.assertEqual([r.id for r in first], [r.id for r in second])
+        self.assertEqual((self.strategy.stats.hits, self.strategy.stats.misses), (1, 1))
+
+        await self.strategy.delete_vectors("cache", ["1"])
+        results = await self.strategy.query_vectors("cache", constants.vector_1, top_k=1)
+        self.assertEqual([r.id for r in results], ["2"])
+        self.assertEqual(self.strategy.stats.misses, 2)
+
+    async def test_bounded(self):
+        for top_k in (1, 2, 3):
+            await self.strategy.query_vectors("cache", constants.vector_2, top_k=top_k)
+        self.assertEqual(len(self.strategy.entries), 2)
+        self.assertEqual(self.strategy.stats.evictions, 1)
+
+
+class HybridSearchTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.index_dir = tempfile.TemporaryDirectory()
+        self.config = VectorDBConfig(config_dict={'db_type': 'local', 'hybrid_search': True,
+                                                  'hybrid_index_dir': self.index_dir.name, 'hybrid_reranker': 'overlap'})
+        self.strategy = AsyncVectorDBFactory.create_strategy(self.config)
+        await self.strategy.initialize()
+        await self.strategy.upsert_vectors("hybrid", [
+            VectorData(id="a", values=constants.vector_2, metadata={"text": "Connection failed with ERR_CONN_REFUSED on port 443"}),
+            VectorData(id="b", values=constants.vector_1, metadata={"text": "General network troubleshooting"}),
+            VectorData(id="c", values=[-x for x in constants.vector_1], metadata={"text": "Unrelated notes about cooking"}),
+        ])
+
+    async def asyncTearDown(self):
+        self.index_dir.cleanup()
+
+    async def test_identifier_beats_embedding(self):
+        result = await self.strategy.hybrid_query("hybrid", "err_conn_refused", constants.vector_1, top_k=2)
+        self.assertEqual([match.id for match in result.matches], ["a", "b"])
+        self.assertEqual(set(result.timings), {"lexical", "vector", "fusion", "rerank", "total"})
+
+        lexical_only = await self.strategy.hybrid_query("hybrid", "port 443", None, top_k=3)
+        self.assertEqual([match.id for match in lexical_only.matches], ["a"])
+        self.assertEqual(lexical_only.matches[0].metadata["text"], "Connection failed with ERR_CONN_REFUSED on port 443")
+
+    async def test_index_follows_deletes_and_persists(self):
+        await self.strategy.delete_vectors("hybrid", ["a"])
+        result = await self.strategy.hybrid_query("hybrid", "ERR_CONN_REFUSED", None)
+        self.assertEqual(result.matches, [])
+
+        await self.strategy.cleanup()
+        reopened = AsyncVectorDBFactory.create_strategy(self.config)
+        await reopened.initialize()
+        result = await reopened.hybrid_query("hybrid", "cooking", None)
+        self.assertEqual([match.id for match in result.matches], ["c"])
+
+    async def test_writes_are_logged_and_replayed(self):
+        index_path = os.path.join(self.index_dir.name, "hybrid.bm25.json")
+        log_path = os.path.join(self.index_dir.name, "hybrid.bm25.log")
+        with open(index_path) as handle:
+            saved = handle.read()
+        await self.strategy.delete_vectors("hybrid", ["c"])
+        await self.strategy.upsert_vectors("hybrid", [
+            VectorData(id="d", values=constants.vector_2, metadata={"text": "Cooking with ERR_CONN_REFUSED"})])
+        # Writes are appended to the log, the saved index is not rewritten
+        with open(index_path) as handle:
+            self.assertEqual(handle.read(), saved)
+        with open(log_path) as handle:
+            self.assertEqual(len(handle.readlines()), 2)
+
+        # No cleanup(): a crash after the writes keeps the lexical index
+        reopened = AsyncVectorDBFactory.create_strategy(self.config)
+        await reopened.initialize()
+        result = await reopened.hybrid_query("hybrid", "err_conn_refused cooking", None)
+        self.assertEqual([match.id for match in result.matches], ["d", "a"])
+
+        await reopened.cleanup()
+        self.assertFalse(os.path.exists(log_path))
+
+    async def test_log_is_folded_into_the_index_once_it_outgrows_it(self):
+        config = VectorDBConfig(config_dict={**self.config.config_dict, 'hybrid_log_max_entries': 2})
+        strategy = AsyncVectorDBFactory.create_strategy(config)
+        await strategy.initialize()
+        for i in range(6):
+            await strategy.upsert_vectors("hybrid", [
+                VectorData(id="note", values=constants.vector_1, metadata={"text": f"note revision{i}"})])
+        # The log never holds more entries than the index has chunks, older ones were saved into it
+        with open(os.path.join(self.index_dir.name, "hybrid.bm25.log")) as handle:
+            logged = len(handle.readlines())
+        self.assertEqual(logged, strategy._log_entries["hybrid"])
+        self.assertLessEqual(logged, len(strategy.indexes["hybrid"]))
+        self.assertLess(logged, 6)
+
+        reopened = AsyncVectorDBFactory.create_strategy(config)
+        await reopened.initialize()
+        self.assertEqual(len(reopened.indexes["hybrid"]), 4)
+        for query, expected in (("revision5", ["note"]), ("revision4", [])):
+            result = await reopened.hybrid_query("hybrid", query, None)
+            self.assertEqual([match.id for match in result.matches], expected)
+
+    async def test_failed_batches_are_not_indexed(self):
+        config = VectorDBConfig(config_dict={**self.config.config_dict, 'upsert_batch_size': 1, 'upsert_max_retries': 0})
+        strategy = AsyncVectorDBFactory.create_strategy(config)
+        await strategy.initialize()
+        send_batch = strategy.strategy._upsert_batch
+
+        async def flaky(namespace, vectors):
+            if any(vector.id == "bad" for vector in vectors):
+                raise RuntimeError("unavailable")
+            await send_batch(namespace, vectors)
+
+        strategy.strategy._upsert_batch = flaky
+        self.assertFalse(await strategy.upsert_vectors("flaky", [
+            VectorData(id="good", values=constants.vector_1, metadata={"text": "kubernetes ingress timeout"}),
+            VectorData(id="bad", values=constants.vector_2, metadata={"text": "kubernetes pod eviction"}),
+        ]))
+        self.assertEqual(len(strategy.last_upsert_report.failed_batches), 1)
+        result = await strategy.hybrid_query("flaky", "kubernetes", None)
+        self.assertEqual([match.id for match in result.matches], ["good"])
+
+    async def test_namespace_file_names_are_sanitized(self):
+        from src.storage.hybrid_search import index_file_name
+        self.assertEqual(index_file_name("docs_v2-en"), "docs_v2-en.bm25.json")
+        self.assertNotEqual(index_file_name("a/b"), index_file_name("a_b"))
+        for namespace in ("../../escape", "a/b", ""):
+            self.assertNotIn("/", index_file_name(namespace))
+            self.strategy.lexical_index(namespace).add("1", "escaped namespace", {"text": "escaped namespace"})
+            await self.strategy.save_index(namespace)
+        self.assertEqual(len(os.listdir(self.index_dir.name)), 4)
+
+        reopened = AsyncVectorDBFactory.create_strategy(self.config)
+        await reopened.initialize()
+        self.assertEqual(set(reopened.indexes), {"hybrid", "../../escape", "a/b", ""})
+
+
+class FederatedSearchTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.strategy = AsyncVectorDBFactory.create_strategy(VectorDBConfig(config_dict={'db_type': 'local'}))
+        await self.strategy.upsert_vectors("documents", [
+            VectorData(id="d1", values=constants.vector_1, metadata={"kind": "document"}),
+            VectorData(id="d2", values=[-x for x in constants.vector_1], metadata={"kind": "document"}),
+        ])
+        await self.strategy.upsert_vectors("knowledge", [
+            VectorData(id="k1", values=constants.vector_2, metadata={"kind": "knowledge"}),
+        ])
+
+    async def test_weighted_merge(self):
+        result = await self.strategy.query_namespaces(["documents", "knowledge"], constants.vector_2, top_k=2)
+        self.assertFalse(result.partial)
+        self.assertEqual([(match.source, match.match.id) for match in result.matches],
+                         [("knowledge", "k1"), ("documents", "d1")])
+        # A low weight pushes a source behind the others
+        result = await self.strategy.query_namespaces(["documents", "knowledge"], constants.vector_2, top_k=3,
+                                                      weights={"knowledge": 0.01})
+        self.assertEqual([match.match.id for match in result.matches][:1], ["d1"])
+        self.assertEqual(result.sources["documents"].matches, 2)
+
+    async def test_slow_source_degrades_to_partial_results(self):
+        from src.storage.federated_search import FederatedSource, federated_query
+
+        class SlowStrategy:
+            async def query_vectors(self, namespace, query_vector, top_k=5, filter=None):
+                await asyncio.sleep(5)
+                return []
+
+        sources = [FederatedSource(self.strategy, "documents"), FederatedSource(SlowStrategy(), "remote", timeout=0.05),
+                   FederatedSource(SlowStrategy(), "archive")]
+        result = await federated_query(sources, constants.vector_1, top_k=1, timeout=0.2)
+        self.assertTrue(result.partial)
+        self.assertEqual([match.match.id for match in result.matches], ["d1"])
+        self.assertEqual({name: report.status for name, report in result.sources.items()},
+                         {"documents": "ok", "remote": "timeout", "archive": "timeout"})
+
+
+class BenchmarkHarnessTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_local_benchmark_report(self):
+        from src.rag.storage.benchmark import run_benchmark
+        report = await run_benchmark({'db_type': 'local'}, vectors=500, dimension=16, queries=20, top_k=5,
+                                     concurrency_levels=(1, 4), insert_batch=200)
+        self.assertEqual(report['insert']['vectors'], 500)
+        self.assertEqual([stats['concurrency'] for stats in report['query']], [1, 4])
+        # Brute force search must agree with the NumPy ground truth
+        self.assertTrue(all(stats['recall_at_k'] == 1.0 for stats in report['query']))
+        self.assertIn('namespace', report['memory'])
+
+
+@unittest.skipUnless(importlib.util.find_spec("pymilvus"), "pymilvus is not installed")
+class MilvusVectorStoreTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.data_dir = tempfile.TemporaryDirectory()
+        # A file uri runs Milvus Lite in-process
+        self.config = VectorDBConfig(config_dict={'db_type': 'milvus', 'uri': os.path.join(self.data_dir.name, 'test.db')})
+        self.strategy = AsyncVectorDBFactory.create_strategy(self.config)
+        await self.strategy.initialize()
+        await self.strategy.upsert_vectors("milvus", [
+            VectorData(id="a", values=constants.vector_1, metadata={"tags": ["x", "y"], "year": 2021}),
+            VectorData(id="b", values=constants.vector_2, metadata={"tags": "y", "year": 2024}),
+        ])
+        # Same id in another namespace
+        await self.strategy.upsert_vectors("other", [VectorData(id="a", values=constants.vector_2, metadata={})])
+
+    async def asyncTearDown(self):
+        await self.strategy.cleanup()
+        self.data_dir.cleanup()
+
+    async def test_query_filter_and_batch(self):
+        results = await self.strategy.query_vectors("milvus", constants.vector_1, top_k=2)
+        self.assertEqual([result.id for result in results], ["a", "b"])
+        self.assertAlmostEqual(results[0].score, 1.0, places=4)
+        self.assertEqual(len(results[0].values), len(constants.vector_1))
+
+        filtered = await self.strategy.query_vectors("milvus", constants.vector_1, top_k=2, filter={"tags": "x"})
+        self.assertEqual([result.id for result in filtered], ["a"])
+        filtered = await self.strategy.query_vectors("milvus", constants.vector_1, top_k=2,
+                                                     filter={"tags": {"$in": ["y"]}, "year": {"$gte": 2022}})
+        self.assertEqual([result.id for result in filtered], ["b"])
+
+        batch = await self.strategy.query_vectors_batch("milvus", [constants.vector_1, constants.vector_2], top_k=1,
+                                                        fields=["year"])
+        self.assertEqual([[(result.id, result.metadata) for result in matches] for matches in batch],
+                         [[("a", {"year": 2021})], [("b", {"year": 2024})]])
+
+    async def test_deletes_stay_in_namespace(self):
+        self.assertTrue(await self.strategy.delete_vectors("milvus", ["a"]))
+        results = await self.strategy.query_vectors("milvus", constants.vector_1, top_k=2)
+        self.assertEqual([result.id for result in results], ["b"])
+        self.assertEqual([result.id for result in await self.strategy.query_vectors("other", constants.vector_1)], ["a"])
+
+        self.assertTrue(await self.strategy.delete_namespace("milvus"))
+        self.assertEqual(await self.strategy.query_vectors("milvus", constants.vector_1), [])
+        self.assertEqual(len(await self.strategy.query_vectors("other", constants.vector_1)), 1)
+
+
+class UpsertPipelineTestCase(unittest.IsolatedAsyncioTestCase):
+    def vectors(self, count):
+        return [VectorData(id=str(i), values=[0.5] * 8, metadata={"field": "value"}) for i in range(count)]
+
+    def test_split_by_count_and_bytes(self):
+        self.assertEqual([len(batch) for batch in split_batches(self.vectors(25), 10, 10 ** 6)], [10, 10, 5])
+        # ~100 bytes per record
+        self.assertEqual([len(batch) for batch in split_batches(self.vectors(6), 10, 250)], [2, 2, 2])
+
+    async def test_only_failed_batches_are_retried(self):
+        sent, failures = [], {"1": 2}
+
+        async def send_batch(namespace, batch):
+            first_id = batch[0].id
+            if failures.get(first_id):
+                failures[first_id] -= 1
+                raise ConnectionError("temporarily unavailable")
+            sent.append(first_id)
+
+        pipeline = VectorUpsertPipeline(max_batch_vectors=1, concurrency=2, max_retries=2, retry_backoff=0)
+        report = await pipeline.run("test_namespace", self.vectors(3), send_batch)
+        self.assertTrue(report.succeeded)
+        self.assertEqual(sorted(sent), ["0", "1", "2"])
+        self.assertEqual([batch.attempts for batch in report.batches], [1, 3, 1])
+
+        failures["0"] = 5
+        report = await pipeline.run("test_namespace", self.vectors(1), send_batch)
+        self.assertFalse(report.succeeded)
+        self.assertEqual(report.failed_batches[0].attempts, 3)
+
+    async def test_array_values(self):
+        import json
+        import numpy as np
+        matrix = np.random.default_rng(0).normal(size=(20, 8)).astype(np.float32)
+        vectors = vectors_from_array([str(i) for i in range(20)], matrix, [{"row": i} for i in range(20)])
+        # Row views of the matrix, converted to floats only for the payload
+        self.assertTrue(all(np.shares_memory(vector.values, matrix) for vector in vectors))
+        record = {"id": "0", "values": values_list(vectors[0].values), "metadata": {"row": 0}}
+        self.assertGreaterEqual(record_size(vectors[0]), len(json.dumps(record)))
+
+        strategy = AsyncVectorDBFactory.create_strategy(VectorDBConfig(config_dict={'db_type': 'local', 'metric': 'l2'}))
+        await strategy.initialize()
+        self.assertTrue(await strategy.upsert_vectors("arrays", vectors))
+        results = await strategy.query_vectors("arrays", matrix[3], top_k=1)
+        self.assertEqual(results[0].id, "3")
+        np.testing.assert_allclose(results[0].values, matrix[3])
+        await strategy.cleanup()
+
+
 if __name__ == '__main__':
     warnings.filterwarnings(action="ignore", message="Enable", category=ResourceWarning)
 
@@ -0,0 +1,220 @@
+"""
+Query result cache in front of a vector DB strategy.
+
+Entries are keyed on the namespace, a hash of the query vector rounded to
+`query_cache_precision` decimals, top_k and the remaining query arguments (filters).
+Every namespace carries a version counter that is part of the key and is bumped by
+upserts, deletes and namespace deletion, so a write invalidates exactly the results of
+its namespace; superseded entries are never read again and age out of the LRU.
+
+Versions are local to the process. When other processes write to the same backend,
+set `query_cache_ttl` to bound how stale a cached result can be.
+"""
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from src.storage.vector_store import AsyncVectorDBStrategy, VectorDBConfig, VectorData
+
+
+DEFAULT_MAX_ENTRIES = 4096
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_PRECISION = 4
+# Rough per-result overhead of the VectorData object and its dicts
+RESULT_OVERHEAD_BYTES = 200
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    # Misses that waited for an identical query already in flight
+    coalesced: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+def _results_size(results: List[VectorData]) -> int:
+    '''Approximate memory held by cached results'''
+    return sum(
+        RESULT_OVERHEAD_BYTES + 8 * len(result.values if result.values is not None else [])
+        + len(json.dumps(result.metadata or {}, default=str))
+        for result in results
+    )
+
+
+def _copy_results(results: List[VectorData]) -> List[VectorData]:
+    '''Callers get their own objects, so mutating a result never alters the cache'''
+    return [replace(result, values=result.values.copy() if isinstance(result.values, np.ndarray) else list(result.values or []),
+                    metadata=dict(result.metadata or {}))
+            for result in results]
+
+
+class CachedVectorDBStrategy(AsyncVectorDBStrategy):
+    '''
+    Wraps a strategy and caches its query_vectors results in a bounded LRU.
+
+    Config keys:
+        query_cache: enable the cache in AsyncVectorDBFactory
+        query_cache_max_entries: maximum number of cached queries
+        query_cache_max_bytes: approximate memory bound of the cached results
+        query_cache_precision: decimals the query vector is rounded to before hashing
+        query_cache_ttl: seconds an entry stays valid, None (default) relies on versions only
+    '''
+
+    def __init__(self, strategy: AsyncVectorDBStrategy, config: VectorDBConfig):
+        self.strategy = strategy
+        self.config = config
+        self.max_entries = config.config_dict.get('query_cache_max_entries', DEFAULT_MAX_ENTRIES)
+        self.max_bytes = config.config_dict.get('query_cache_max_bytes', DEFAULT_MAX_BYTES)
+        self.precision = config.config_dict.get('query_cache_precision', DEFAULT_PRECISION)
+        self.ttl: Optional[float] = config.config_dict.get('query_cache_ttl')
+        self.stats = CacheStats()
+        self.versions: Dict[str, int] = {}
+        # key -> (results, size in bytes, time stored)
+        self.entries: 'OrderedDict[Tuple, Tuple[List[VectorData], int, float]]' = OrderedDict()
+        self.bytes = 0
+        self._in_flight: Dict[Tuple, asyncio.Future] = {}
+
+    def __getattr__(self, name: str) -> Any:
+        # Backend specific methods and attributes (compact_namespace, namespaces...) go to the wrapped strategy
+        return getattr(self.strategy, name)
+
+    def vector_hash(self, query_vector: List[float]) -> str:
+        rounded = np.round(np.asarray(query_vector, dtype=np.float64), self.precision)
+        # -0.0 and 0.0 must hash the same
+        rounded += 0.0
+        return hashlib.blake2b(rounded.tobytes(), digest_size=16).hexdigest()
+
+    def cache_key(self, namespace: str, query_vector: List[float], top_k: int, options: Dict[str, Any]) -> Tuple:
+        return (namespace, self.versions.get(namespace, 0), self.vector_hash(query_vector), top_k,
+                json.dumps(options, sort_keys=True, default=str))
+
+    def invalidate(self, namespace: str) -> None:
+        '''Bump the namespace version; its cached results are no longer reachable'''
+        self.versions[namespace] = self.versions.get(namespace, 0) + 1
+        self.stats.invalidations += 1
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.bytes = 0
+
+    def _lookup(self, key: Tuple) -> Optional[List[VectorData]]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        results, size, stored_at = entry
+        if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+            del self.entries[key]
+            self.bytes -= size
+            return None
+        self.entries.move_to_end(key)
+        return results
+
+    def _store(self, key: Tuple, results: List[VectorData]) -> None:
+        size = _results_size(results)
+        if size > self.max_bytes:
+            return
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.bytes -= previous[1]
+        self.entries[key] = (_copy_results(results), size, time.monotonic())
+        self.bytes += size
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self.entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.stats.evictions += 1
+
+    async def query_vectors(self, namespace: str, query_vector: List[float], top_k: int = 5,
+                            **kwargs) -> List[VectorData]:
+        key = self.cache_key(namespace, query_vector, top_k, kwargs)
+        results = self._lookup(key)
+        if results is not None:
+            self.stats.hits += 1
+            return _copy_results(results)
+        self.stats.misses += 1
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.stats.coalesced += 1
+            return _copy_results(await asyncio.shield(in_flight))
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            results = await self.strategy.query_vectors(namespace, query_vector, top_k, **kwargs)
+            # The strategies report errors as an empty result, which is not cached
+            if results:
+                self._store(key, results)
+            future.set_result(results)
+            return results
+        except BaseException as e:
+            future.set_exception(e)
+            # Retrieve the exception so an unawaited future does not log it
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+    async def query_vectors_batch(self, namespace: str, query_vectors: List[List[float]], top_k: int = 5,
+                                  include_values: bool = False, fields: Optional[List[str]] = None,
+                                  filter: Optional[Dict[str, Any]] = None) -> List[List[VectorData]]:
+        '''Answer cached queries from the cache and send the misses to the backend as one batch'''
+        options = {'include_values': include_values, 'fields': fields, 'filter': filter}
+        keys = [self.cache_key(namespace, vector, top_k, options) for vector in query_vectors]
+        results = [self._lookup(key) for key in keys]
+        missing = [i for i, cached in enumerate(results) if cached is None]
+        self.stats.hits += len(results) - len(missing)
+        self.stats.misses += len(missing)
+        if missing:
+            fetched = await self.strategy.query_vectors_batch(
+                namespace, [query_vectors[i] for i in missing], top_k, include_values, fields, filter=filter)
+            for i, matches in zip(missing, fetched):
+                if matches:
+                    self._store(keys[i], matches)
+                results[i] = matches
+        return [_copy_results(matches) for matches in results]
+
+    async def initialize(self) -> None:
+        await self.strategy.initialize()
+
+    async def cleanup(self) -> None:
+        await self.strategy.cleanup()
+        self.clear()
+
+    async def create_namespace(self, namespace: str, *args, **kwargs) -> bool:
+        return await self.strategy.create_namespace(namespace, *args, **kwargs)
+
+    async def delete_namespace(self, namespace: str, *args, **kwargs) -> bool:
+        try:
+            return await self.strategy.delete_namespace(namespace, *args, **kwargs)
+        finally:
+            self.invalidate(namespace)
+
+    async def upsert_vectors(self, namespace: str, vectors: List[VectorData]) -> bool:
+        try:
+            return await self.strategy.upsert_vectors(namespace, vectors)
+        finally:
+            self.last_upsert_report = getattr(self.strategy, 'last_upsert_report', None)
+            self.invalidate(namespace)
+
+    async def _upsert_batch(self, namespace: str, vectors: List[VectorData]) -> None:
+        try:
+            await self.strategy._upsert_batch(namespace, vectors)
+        finally:
+            self.invalidate(namespace)
+
+    async def delete_vectors(self, namespace: str, vector_ids: List[str]) -> bool:
+        try:
+            return await self.strategy.delete_vectors(namespace, vector_ids)
+        finally:
+            self.invalidate(namespace)
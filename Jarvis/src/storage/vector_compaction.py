@@ -0,0 +1,215 @@
+"""
+Background compaction of local vector namespaces.
+
+Deletes and overwrites leave tombstoned rows behind, and steady upserts seal many small
+segments; both slow scans down and waste memory. BackgroundCompactor periodically picks
+the namespaces worth compacting and compacts them in a worker thread:
+
+    segment namespaces    segments with many tombstones, or enough small segments, are
+                          merged into one; queries keep using the old segments until the
+                          merged one is swapped in under the namespace lock
+    in-memory namespaces  tombstoned rows are dropped and the HNSW graph is repaired in
+                          place instead of being rebuilt
+
+Segment merges read and write in chunks through a CompactionBudget, which sleeps between
+chunks to stay within an I/O rate and a share of one CPU, and records the progress of the
+current run.
+"""
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+from src.storage.local_vector_store import LocalNamespace
+
+
+# Rows read or written between two budget checks
+COMPACTION_CHUNK_ROWS = 8192
+DEFAULT_TOMBSTONE_RATIO = 0.2
+DEFAULT_MIN_SMALL_SEGMENTS = 4
+
+
+@dataclass
+class CompactionProgress:
+    namespace: str
+    phase: str = 'pending'
+    rows_done: int = 0
+    rows_total: int = 0
+    bytes_done: int = 0
+    # Seconds spent sleeping to respect the budget
+    throttled_seconds: float = 0.0
+    started_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+
+    @property
+    def fraction(self) -> float:
+        if self.finished_at is not None:
+            return 1.0
+        return min(self.rows_done / self.rows_total, 1.0) if self.rows_total else 0.0
+
+
+class CompactionBudget:
+    '''
+    Throttle and progress record of one compaction.
+
+    Args:
+        io_bytes_per_second: read plus write rate the compaction stays under, None for no limit
+        cpu_fraction: share of one core the compaction may use; after a chunk that took t
+            seconds of work it sleeps t * (1 - cpu_fraction) / cpu_fraction
+        progress: record updated as chunks complete
+        on_progress: called with the record after every chunk
+    '''
+
+    def __init__(self, io_bytes_per_second: Optional[float] = None, cpu_fraction: float = 1.0,
+                 progress: Optional[CompactionProgress] = None,
+                 on_progress: Optional[Callable[[CompactionProgress], None]] = None):
+        if not 0 < cpu_fraction <= 1:
+            raise ValueError("cpu_fraction must be in (0, 1]")
+        self.io_bytes_per_second = io_bytes_per_second
+        self.cpu_fraction = cpu_fraction
+        self.progress = progress or CompactionProgress(namespace='')
+        self.on_progress = on_progress
+        self._started = time.monotonic()
+        self._last = self._started
+
+    def phase(self, name: str, rows_total: int) -> None:
+        '''Start a phase over `rows_total` rows'''
+        self.progress.phase = name
+        self.progress.rows_done = 0
+        self.progress.rows_total = rows_total
+        self._report()
+
+    def consume(self, rows: int, nbytes: int) -> None:
+        '''Account a processed chunk and sleep as long as the budget requires'''
+        now = time.monotonic()
+        self.progress.rows_done += rows
+        self.progress.bytes_done += nbytes
+        delay = 0.0
+        if self.cpu_fraction < 1:
+            delay = (now - self._last) * (1 - self.cpu_fraction) / self.cpu_fraction
+        if self.io_bytes_per_second:
+            # Time the bytes so far should have taken, minus the time already spent
+            delay = max(delay, self.progress.bytes_done / self.io_bytes_per_second - (now - self._started))
+        if delay > 0:
+            time.sleep(delay)
+            self.progress.throttled_seconds += delay
+        self._last = time.monotonic()
+        self._report()
+
+    def finish(self, error: Optional[str] = None) -> None:
+        self.progress.phase = 'failed' if error else 'done'
+        self.progress.error = error
+        self.progress.finished_at = time.time()
+        self._report()
+
+    def _report(self) -> None:
+        if self.on_progress is not None:
+            self.on_progress(self.progress)
+
+
+def plan_compaction(store: Any, tombstone_ratio: float = DEFAULT_TOMBSTONE_RATIO,
+                    min_small_segments: int = DEFAULT_MIN_SMALL_SEGMENTS) -> Optional[List[str]]:
+    '''
+    Segments of a namespace worth merging, None when it does not need compaction. An
+    in-memory namespace is compacted as a whole and gets an empty list.
+
+    A segment qualifies when at least `tombstone_ratio` of its rows are dead; segments
+    under half of `segment_max_vectors` qualify once there are `min_small_segments` of them.
+    '''
+    if isinstance(store, LocalNamespace):
+        return [] if store.size and store.tombstones / store.size >= tombstone_ratio else None
+    if store.read_only:
+        return None
+    selected = []
+    small = []
+    for segment in store.segments:
+        mask = store.masks.get(segment.name)
+        dead = int((~mask).sum()) if mask is not None else 0
+        if segment.count and dead / segment.count >= tombstone_ratio:
+            selected.append(segment.name)
+        elif segment.count < store.segment_max_vectors // 2:
+            small.append(segment.name)
+    if len(small) >= min_small_segments:
+        selected.extend(small)
+    # Rewriting one segment only pays off when it drops rows
+    if not selected or (len(selected) == 1 and selected[0] not in store.masks):
+        return None
+    return [segment.name for segment in store.segments if segment.name in selected]
+
+
+class BackgroundCompactor:
+    '''
+    Periodically compacts the namespaces of an AsyncLocalVectorStrategy.
+
+    Args:
+        strategy: local strategy whose namespaces are compacted
+        interval: seconds between two checks of every namespace
+        tombstone_ratio, min_small_segments: thresholds of plan_compaction()
+        io_bytes_per_second, cpu_fraction: CompactionBudget of every run
+    '''
+
+    def __init__(self, strategy, interval: float = 60.0, tombstone_ratio: float = DEFAULT_TOMBSTONE_RATIO,
+                 min_small_segments: int = DEFAULT_MIN_SMALL_SEGMENTS, io_bytes_per_second: Optional[float] = None,
+                 cpu_fraction: float = 1.0):
+        self.strategy = strategy
+        self.interval = interval
+        self.tombstone_ratio = tombstone_ratio
+        self.min_small_segments = min_small_segments
+        self.io_bytes_per_second = io_bytes_per_second
+        self.cpu_fraction = cpu_fraction
+        # namespace -> progress of its running or last compaction
+        self.progress: Dict[str, CompactionProgress] = {}
+        self._task: Optional[asyncio.Task] = None
+        # Compaction being run, it outlives a cancelled check since its thread cannot be interrupted
+        self._running: Optional[asyncio.Future] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        '''Stop checking and wait for a compaction in progress to finish and be swapped in'''
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._running is not None:
+            await self._running
+            self._running = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.run_once()
+
+    def budget(self, namespace: str) -> CompactionBudget:
+        progress = CompactionProgress(namespace=namespace)
+        self.progress[namespace] = progress
+        return CompactionBudget(self.io_bytes_per_second, self.cpu_fraction, progress)
+
+    async def run_once(self) -> Dict[str, CompactionProgress]:
+        '''Compact every namespace that needs it, one at a time; returns their progress'''
+        compacted = {}
+        for namespace in list(self.strategy.namespaces):
+            store = self.strategy.namespaces.get(namespace)
+            plan = plan_compaction(store, self.tombstone_ratio, self.min_small_segments) if store is not None else None
+            if plan is None:
+                continue
+            self._running = asyncio.ensure_future(self._compact(namespace, plan))
+            # Shielded: cancelling the check must not leave the merge running unawaited in its thread
+            compacted[namespace] = await asyncio.shield(self._running)
+            self._running = None
+        return compacted
+
+    async def _compact(self, namespace: str, plan: List[str]) -> CompactionProgress:
+        budget = self.budget(namespace)
+        try:
+            await self.strategy.compact_namespace(namespace, segments=plan or None, budget=budget)
+            budget.finish()
+        except Exception as e:
+            print(f"Error compacting namespace {namespace}: {e}")
+            budget.finish(str(e))
+        return budget.progress
@@ -0,0 +1,218 @@
+"""
+Metadata filter expressions for vector queries.
+
+Filters use the Pinecone syntax so they can be pushed down to Pinecone unchanged:
+
+    {"document_id": "a1"}                                 equality (same as {"$eq": "a1"})
+    {"user": {"$in": ["u1", "u2"]}}                       membership
+    {"created_at": {"$gte": 1700000000, "$lt": 1710000000}}   range
+    {"$and": [...]}, {"$or": [...]}                       combinations
+
+Several fields in one dict must all match. A metadata value that is a list matches
+$eq and $in when any of its items does.
+
+The local backend evaluates filters through MetadataIndex: per-field posting lists for
+equality and sorted numeric columns for ranges, turned into a boolean row mask before
+any vector is scored.
+"""
+import bisect
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+
+RANGE_OPERATORS = ('$gt', '$gte', '$lt', '$lte')
+LOGICAL_OPERATORS = ('$and', '$or')
+
+
+def _key(value: Any) -> Tuple[str, Any]:
+    '''Posting list key; keeps True apart from 1'''
+    return ('bool' if isinstance(value, bool) else 'value', value)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate_filter(filter: Dict[str, Any]) -> None:
+    '''Raise ValueError for expressions outside the supported syntax'''
+    if not isinstance(filter, dict):
+        raise ValueError(f"Filter must be a dict, got {type(filter).__name__}")
+    for field, condition in filter.items():
+        if field in LOGICAL_OPERATORS:
+            if not isinstance(condition, list) or not condition:
+                raise ValueError(f"{field} expects a non-empty list of filters")
+            for item in condition:
+                validate_filter(item)
+        elif field.startswith('$'):
+            raise ValueError(f"Unsupported filter operator: {field}")
+        elif isinstance(condition, dict):
+            for operator, operand in condition.items():
+                if operator == '$eq':
+                    continue
+                if operator == '$in':
+                    if not isinstance(operand, list):
+                        raise ValueError(f"$in on {field} expects a list")
+                elif operator in RANGE_OPERATORS:
+                    if not _is_number(operand):
+                        raise ValueError(f"{operator} on {field} expects a number")
+                else:
+                    raise ValueError(f"Unsupported filter operator: {operator}")
+
+
+def matches(metadata: Optional[Dict[str, Any]], filter: Optional[Dict[str, Any]]) -> bool:
+    '''Evaluate a filter against one metadata dict'''
+    if not filter:
+        return True
+    metadata = metadata or {}
+    for field, condition in filter.items():
+        if field == '$and':
+            if not all(matches(metadata, item) for item in condition):
+                return False
+            continue
+        if field == '$or':
+            if not any(matches(metadata, item) for item in condition):
+                return False
+            continue
+        if field not in metadata:
+            return False
+        value = metadata[field]
+        items = value if isinstance(value, list) else [value]
+        keys = {_key(item) for item in items}
+        operators = condition if isinstance(condition, dict) else {'$eq': condition}
+        for operator, operand in operators.items():
+            if operator == '$eq' and _key(operand) not in keys:
+                return False
+            if operator == '$in' and not keys & {_key(item) for item in operand}:
+                return False
+            if operator in RANGE_OPERATORS:
+                if not _is_number(value):
+                    return False
+                if ((operator == '$gt' and not value > operand) or (operator == '$gte' and not value >= operand)
+                        or (operator == '$lt' and not value < operand) or (operator == '$lte' and not value <= operand)):
+                    return False
+    return True
+
+
+class MetadataIndex:
+    '''
+    Inverted index over the metadata of numbered rows.
+
+    Equality postings map (field, value) to the set of rows holding it; numeric fields
+    also keep a column sorted on demand for range lookups. `mask()` turns a filter into
+    a boolean array over the rows.
+    '''
+
+    def __init__(self):
+        # field -> value key -> rows
+        self.postings: Dict[str, Dict[Tuple[str, Any], set]] = {}
+        # field -> row -> number
+        self.numbers: Dict[str, Dict[int, float]] = {}
+        # field -> (sorted numbers, their rows), dropped when the field changes
+        self._sorted: Dict[str, Tuple[List[float], np.ndarray]] = {}
+        # (field, value key) -> posting list as an array, dropped when the posting changes
+        self._arrays: Dict[Tuple[str, Tuple[str, Any]], np.ndarray] = {}
+
+    def add(self, row: int, metadata: Optional[Dict[str, Any]]) -> None:
+        for field, value in (metadata or {}).items():
+            items = value if isinstance(value, list) else [value]
+            postings = self.postings.setdefault(field, {})
+            for item in items:
+                try:
+                    postings.setdefault(_key(item), set()).add(row)
+                    self._arrays.pop((field, _key(item)), None)
+                except TypeError:
+                    # Unhashable values (nested dicts) cannot be filtered on
+                    continue
+            if _is_number(value):
+                self.numbers.setdefault(field, {})[row] = value
+                self._sorted.pop(field, None)
+
+    def remove(self, row: int, metadata: Optional[Dict[str, Any]]) -> None:
+        for field, value in (metadata or {}).items():
+            items = value if isinstance(value, list) else [value]
+            postings = self.postings.get(field, {})
+            for item in items:
+                try:
+                    rows = postings.get(_key(item))
+                except TypeError:
+                    continue
+                if rows is not None:
+                    rows.discard(row)
+                    self._arrays.pop((field, _key(item)), None)
+                    if not rows:
+                        del postings[_key(item)]
+            if _is_number(value) and self.numbers.get(field, {}).pop(row, None) is not None:
+                self._sorted.pop(field, None)
+
+    @classmethod
+    def build(cls, metadata: Iterable[Optional[Dict[str, Any]]]) -> 'MetadataIndex':
+        index = cls()
+        for row, item in enumerate(metadata):
+            if item:
+                index.add(row, item)
+        return index
+
+    def _sorted_column(self, field: str) -> Tuple[List[float], np.ndarray]:
+        column = self._sorted.get(field)
+        if column is None:
+            numbers = self.numbers.get(field, {})
+            order = sorted(numbers.items(), key=lambda item: item[1])
+            column = ([value for _, value in order], np.array([row for row, _ in order], dtype=np.int64))
+            self._sorted[field] = column
+        return column
+
+    def _posting(self, field: str, value: Any) -> np.ndarray:
+        key = (field, _key(value))
+        rows = self._arrays.get(key)
+        if rows is None:
+            posting = self.postings.get(field, {}).get(key[1])
+            if posting is None:
+                return np.empty(0, dtype=np.int64)
+            rows = np.fromiter(posting, dtype=np.int64, count=len(posting))
+            self._arrays[key] = rows
+        return rows
+
+    def _rows_mask(self, rows: np.ndarray, size: int) -> np.ndarray:
+        mask = np.zeros(size, dtype=bool)
+        mask[rows[rows < size]] = True
+        return mask
+
+    def _range_mask(self, field: str, operators: Dict[str, Any], size: int) -> np.ndarray:
+        values, rows = self._sorted_column(field)
+        start, end = 0, len(values)
+        for operator, operand in operators.items():
+            if operator == '$gt':
+                start = max(start, bisect.bisect_right(values, operand))
+            elif operator == '$gte':
+                start = max(start, bisect.bisect_left(values, operand))
+            elif operator == '$lt':
+                end = min(end, bisect.bisect_left(values, operand))
+            elif operator == '$lte':
+                end = min(end, bisect.bisect_right(values, operand))
+        return self._rows_mask(rows[start:end], size) if start < end else np.zeros(size, dtype=bool)
+
+    def mask(self, filter: Dict[str, Any], size: int) -> np.ndarray:
+        '''Boolean array over `size` rows, True where the metadata matches the filter'''
+        mask = np.ones(size, dtype=bool)
+        for field, condition in filter.items():
+            if field == '$and':
+                for item in condition:
+                    mask &= self.mask(item, size)
+                continue
+            if field == '$or':
+                alternatives = np.zeros(size, dtype=bool)
+                for item in condition:
+                    alternatives |= self.mask(item, size)
+                mask &= alternatives
+                continue
+
+            operators = condition if isinstance(condition, dict) else {'$eq': condition}
+            if '$eq' in operators:
+                mask &= self._rows_mask(self._posting(field, operators['$eq']), size)
+            if '$in' in operators:
+                rows = [self._posting(field, item) for item in operators['$in']]
+                mask &= self._rows_mask(np.concatenate(rows) if rows else np.empty(0, dtype=np.int64), size)
+            ranges = {operator: operand for operator, operand in operators.items() if operator in RANGE_OPERATORS}
+            if ranges:
+                mask &= self._range_mask(field, ranges, size)
+        return mask
@@ -0,0 +1,618 @@
+"""
+Memory-mapped on-disk segments for local vector namespaces.
+
+A namespace directory holds immutable segment files, a manifest and an append-only write log:
+
+    segments.json            manifest: dimension, metric, live segments, tombstoned rows
+    segment-000001.jvs       immutable segment, memory-mapped read-only
+    segment-000001.codes.npz quantized codes of the segment, when the namespace is quantized
+    write.log                JSON lines of upserts and deletes not sealed into a segment yet
+
+Segment layout (little endian, blocks aligned to 64 bytes):
+
+    header      magic 'JVS1', version, metric, dimension, count and the block offsets
+    vectors     count x dimension float32, prepared for the metric (normalised for cosine)
+    norms       count float32 squared norms
+    ids         count + 1 uint64 offsets into a UTF-8 id blob
+    metadata    count + 1 uint64 offsets into a blob of per-row JSON documents
+
+Opening a namespace reads the manifest and maps the segment files, so startup does not
+depend on the number of vectors and every worker process shares the page cache copy.
+A quantized namespace keeps compact codes of every sealed segment in RAM, scores them
+first and reads only the shortlisted rows from the memory map to re-rank them exactly.
+"""
+import json
+import os
+import struct
+import threading
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from src.storage.local_vector_store import (FILTERED_SCAN_ROWS, LocalNamespace, METRICS, SHARD_ROWS, check_dimension,
+                                            public_score, query_blocks, scan, score_matrix, top_k_rows)
+from src.storage.vector_filter import MetadataIndex, validate_filter
+from src.storage.quantization import QuantizedCodes
+from src.storage.vector_compaction import COMPACTION_CHUNK_ROWS, CompactionBudget
+from src.storage.vector_store import VectorData, project_metadata, stack_values
+
+
+SEGMENT_MAGIC = b'JVS1'
+SEGMENT_VERSION = 1
+SEGMENT_HEADER = struct.Struct('<4sHHIQQQQQQQ')
+BLOCK_ALIGNMENT = 64
+MANIFEST_NAME = 'segments.json'
+WRITE_LOG_NAME = 'write.log'
+DEFAULT_SEGMENT_MAX_VECTORS = 100000
+DEFAULT_RERANK_FACTOR = 4
+
+
+def _align(offset: int) -> int:
+    return (offset + BLOCK_ALIGNMENT - 1) // BLOCK_ALIGNMENT * BLOCK_ALIGNMENT
+
+
+def _offsets_and_blob(items: List[bytes]) -> Tuple[np.ndarray, bytes]:
+    offsets = np.zeros(len(items) + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([len(item) for item in items], dtype=np.uint64)
+    return offsets, b''.join(items)
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    temporary = path.with_name(path.name + '.tmp')
+    with open(temporary, 'wb') as handle:
+        handle.write(data)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(temporary, path)
+
+
+class VectorSegment:
+    '''Read-only view of a segment file; vectors are a zero-copy view of the memory map'''
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.name = path.name
+        self.raw = np.memmap(path, dtype=np.uint8, mode='r')
+        (magic, version, metric, self.dimension, self.count, vectors_offset, norms_offset, id_offsets_offset,
+         id_blob_offset, metadata_offsets_offset, metadata_blob_offset) = SEGMENT_HEADER.unpack_from(self.raw)
+        if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+            raise ValueError(f"Not a vector segment: {path}")
+        self.metric = METRICS[metric]
+
+        self.vectors = self.raw[vectors_offset:vectors_offset + self.count * self.dimension * 4] \
+            .view(np.float32).reshape(self.count, self.dimension)
+        self.norms = self.raw[norms_offset:norms_offset + self.count * 4].view(np.float32)
+        self.id_offsets = self.raw[id_offsets_offset:id_offsets_offset + (self.count + 1) * 8].view(np.uint64)
+        self.id_blob_offset = id_blob_offset
+        self.metadata_offsets = self.raw[metadata_offsets_offset:metadata_offsets_offset + (self.count + 1) * 8] \
+            .view(np.uint64)
+        self.metadata_blob_offset = metadata_blob_offset
+
+    @staticmethod
+    def write(path: Path, metric: str, vectors: np.ndarray, ids: List[str], metadata: List[Dict[str, Any]],
+              budget: Optional[CompactionBudget] = None) -> 'VectorSegment':
+        '''
+        Write a segment atomically and open it. `vectors` must already be prepared for the metric.
+        Vectors are written in chunks; with a `budget` every chunk is accounted and throttled.
+        '''
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        count, dimension = vectors.shape
+        norms = np.einsum('ij,ij->i', vectors, vectors).astype(np.float32)
+        id_offsets, id_blob = _offsets_and_blob([vector_id.encode('utf-8') for vector_id in ids])
+        metadata_offsets, metadata_blob = _offsets_and_blob(
+            [json.dumps(item or {}, separators=(',', ':')).encode('utf-8') for item in metadata]
+        )
+
+        sizes = [vectors.nbytes, norms.nbytes, id_offsets.nbytes, len(id_blob), metadata_offsets.nbytes,
+                 len(metadata_blob)]
+        offsets, position = [], _align(SEGMENT_HEADER.size)
+        for size in sizes:
+            offsets.append(position)
+            position = _align(position + size)
+        header = SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, METRICS.index(metric), dimension, count, *offsets)
+
+        if budget is not None:
+            budget.phase('write', count)
+        temporary = path.with_name(path.name + '.tmp')
+        with open(temporary, 'wb') as handle:
+            handle.write(header)
+            handle.seek(offsets[0])
+            for start in range(0, count, COMPACTION_CHUNK_ROWS):
+                chunk = vectors[start:start + COMPACTION_CHUNK_ROWS]
+                handle.write(chunk.tobytes())
+                if budget is not None:
+                    budget.consume(len(chunk), chunk.nbytes)
+            for offset, block in zip(offsets[1:], [norms.tobytes(), id_offsets.tobytes(), id_blob,
+                                                   metadata_offsets.tobytes(), metadata_blob]):
+                handle.seek(offset)
+                handle.write(block)
+            handle.truncate(position)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temporary, path)
+        return VectorSegment(path)
+
+    def id(self, row: int) -> str:
+        start, end = int(self.id_offsets[row]), int(self.id_offsets[row + 1])
+        return bytes(self.raw[self.id_blob_offset + start:self.id_blob_offset + end]).decode('utf-8')
+
+    def ids(self) -> List[str]:
+        offsets = self.id_offsets.tolist()
+        blob = bytes(self.raw[self.id_blob_offset:self.id_blob_offset + offsets[-1]])
+        return [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(self.count)]
+
+    def metadata(self, row: int) -> Dict[str, Any]:
+        start, end = int(self.metadata_offsets[row]), int(self.metadata_offsets[row + 1])
+        return json.loads(bytes(self.raw[self.metadata_blob_offset + start:self.metadata_blob_offset + end]))
+
+    def close(self) -> None:
+        mmap = getattr(self.raw, '_mmap', None)
+        self.raw = self.vectors = self.norms = self.id_offsets = self.metadata_offsets = None
+        if mmap is not None:
+            try:
+                mmap.close()
+            except BufferError:
+                # Views handed out to callers are still alive; the map is released with them
+                pass
+
+
+class SegmentedNamespace:
+    '''
+    Local vector namespace stored as memory-mapped immutable segments plus a write buffer.
+
+    Upserts and deletes are appended to the write log and applied to an in-memory
+    LocalNamespace; once it holds `segment_max_vectors` vectors (or on flush) it is sealed
+    into a new segment. Overwritten and deleted rows of sealed segments are tombstoned in
+    the manifest until `compact()` merges the segments. Opened with `read_only`, a worker
+    only maps the segments and picks up new ones with `refresh()`.
+
+    `quantization` ({'kind': 'int8' | 'pq', 'subvectors': int, 'rerank': int}) trains a
+    quantizer for every sealed segment; searches shortlist `rerank` x top_k rows per
+    segment on the codes and re-rank them against the full-precision vectors.
+    '''
+
+    def __init__(self, directory: Path, dimension: int, metric: str = 'cosine',
+                 segment_max_vectors: int = DEFAULT_SEGMENT_MAX_VECTORS, read_only: bool = False,
+                 quantization: Optional[Dict[str, Any]] = None):
+        if metric not in METRICS:
+            raise ValueError(f"Unsupported metric: {metric}")
+        if quantization and quantization.get('kind') not in ('int8', 'pq'):
+            raise ValueError(f"Unsupported quantization: {quantization.get('kind')}")
+        self.directory = Path(directory)
+        self.dimension = dimension
+        self.metric = metric
+        self.segment_max_vectors = segment_max_vectors
+        self.read_only = read_only
+        self.quantization = dict(quantization) if quantization else None
+        self.segments: List[VectorSegment] = []
+        # segment name -> quantized codes, only for quantized namespaces
+        self.codes: Dict[str, Optional[QuantizedCodes]] = {}
+        # segment name -> metadata index, built by the first filtered query
+        self.filter_indexes: Dict[str, MetadataIndex] = {}
+        # segment name -> boolean mask of live rows, only for segments with tombstones
+        self.masks: Dict[str, np.ndarray] = {}
+        self.buffer = LocalNamespace(dimension, metric)
+        self._id_locations: Optional[Dict[str, Tuple[str, int]]] = None
+        self._manifest_mtime = 0.0
+        self._segment_number = 0
+        self._lock = threading.RLock()
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.directory / MANIFEST_NAME
+
+    @property
+    def write_log_path(self) -> Path:
+        return self.directory / WRITE_LOG_NAME
+
+    @property
+    def count(self) -> int:
+        tombstones = sum(int((~mask).sum()) for mask in self.masks.values())
+        return sum(segment.count for segment in self.segments) - tombstones + self.buffer.count
+
+    @property
+    def tombstones(self) -> int:
+        return sum(int((~mask).sum()) for mask in self.masks.values()) + self.buffer.tombstones
+
+    @staticmethod
+    def exists(directory: Path) -> bool:
+        return (Path(directory) / MANIFEST_NAME).exists()
+
+    @classmethod
+    def open(cls, directory: Path, segment_max_vectors: int = DEFAULT_SEGMENT_MAX_VECTORS,
+             read_only: bool = False, quantization: Optional[Dict[str, Any]] = None) -> 'SegmentedNamespace':
+        '''Open an existing namespace; `quantization` defaults to the one recorded in the manifest'''
+        manifest = json.loads((Path(directory) / MANIFEST_NAME).read_text())
+        namespace = cls(directory, manifest['dimension'], manifest['metric'], segment_max_vectors, read_only,
+                        quantization if quantization is not None else manifest.get('quantization'))
+        namespace._load_manifest(manifest)
+        if not read_only:
+            namespace._replay_write_log()
+        return namespace
+
+    def _load_manifest(self, manifest: Dict) -> None:
+        opened = {segment.name: segment for segment in self.segments}
+        segments = [opened.get(name) or VectorSegment(self.directory / name) for name in manifest['segments']]
+        masks = {}
+        for name, rows in manifest.get('tombstones', {}).items():
+            segment = next(segment for segment in segments if segment.name == name)
+            mask = np.ones(segment.count, dtype=bool)
+            mask[np.asarray(rows, dtype=np.int64)] = False
+            masks[name] = mask
+        self.segments, self.masks = segments, masks
+        self.filter_indexes = {segment.name: self.filter_indexes[segment.name]
+                               for segment in segments if segment.name in self.filter_indexes}
+        self.codes = {segment.name: self.codes.get(segment.name) or self._segment_codes(segment)
+                      for segment in segments} if self.quantization else {}
+        self._segment_number = max([self._segment_number] + [int(name.split('-')[1].split('.')[0]) for name in manifest['segments']])
+        self._id_locations = None
+        self._manifest_mtime = self.manifest_path.stat().st_mtime
+
+    def _write_manifest(self) -> None:
+        manifest = {
+            'version': SEGMENT_VERSION,
+            'dimension': self.dimension,
+            'metric': self.metric,
+            'segments': [segment.name for segment in self.segments],
+            'tombstones': {name: np.flatnonzero(~mask).tolist() for name, mask in self.masks.items()},
+            'quantization': self.quantization,
+        }
+        self.directory.mkdir(parents=True, exist_ok=True)
+        _write_atomic(self.manifest_path, json.dumps(manifest).encode('utf-8'))
+        self._manifest_mtime = self.manifest_path.stat().st_mtime
+
+    def refresh(self) -> bool:
+        '''Reload the manifest if another process changed it. Returns True when reloaded.'''
+        if not self.manifest_path.exists() or self.manifest_path.stat().st_mtime == self._manifest_mtime:
+            return False
+        with self._lock:
+            self._load_manifest(json.loads(self.manifest_path.read_text()))
+        return True
+
+    def _replay_write_log(self) -> None:
+        if not self.write_log_path.exists():
+            return
+        with open(self.write_log_path, 'r') as handle:
+            for line in handle:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn last line of an interrupted append
+                    break
+                if entry['op'] == 'upsert':
+                    self._apply_upsert([VectorData(entry['id'], entry['values'], entry['metadata'])])
+                else:
+                    self._apply_delete(entry['ids'])
+
+    def _append_log(self, entries: List[Dict]) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.write_log_path, 'a') as handle:
+            handle.write(''.join(json.dumps(entry, separators=(',', ':')) + '\n' for entry in entries))
+            handle.flush()
+            os.fsync(handle.fileno())
+
+    def id_locations(self) -> Dict[str, Tuple[str, int]]:
+        '''id -> (segment name, row) of the live rows of sealed segments, built on first use'''
+        if self._id_locations is None:
+            locations = {}
+            for segment in self.segments:
+                mask = self.masks.get(segment.name)
+                for row, vector_id in enumerate(segment.ids()):
+                    if mask is None or mask[row]:
+                        locations[vector_id] = (segment.name, row)
+            self._id_locations = locations
+        return self._id_locations
+
+    def _tombstone(self, vector_id: str) -> bool:
+        location = self.id_locations().pop(vector_id, None)
+        if location is None:
+            return False
+        name, row = location
+        if name not in self.masks:
+            segment = next(segment for segment in self.segments if segment.name == name)
+            self.masks[name] = np.ones(segment.count, dtype=bool)
+        self.masks[name][row] = False
+        return True
+
+    def _apply_upsert(self, vectors: List[VectorData]) -> None:
+        for vector in vectors:
+            self._tombstone(vector.id)
+        self.buffer.upsert(vectors)
+
+    def _apply_delete(self, ids: List[str]) -> int:
+        deleted = self.buffer.delete(ids)
+        return deleted + sum(self._tombstone(vector_id) for vector_id in ids)
+
+    def upsert(self, vectors: List[VectorData]) -> None:
+        if self.read_only:
+            raise PermissionError("Namespace is opened read-only")
+        values = stack_values(vectors)
+        # Checked before the batch reaches the write log, it would fail again on every replay
+        check_dimension(values, self.dimension)
+        with self._lock:
+            self._append_log([
+                {'op': 'upsert', 'id': vector.id, 'values': row.tolist(), 'metadata': vector.metadata or {}}
+                for vector, row in zip(vectors, values)
+            ])
+            self._apply_upsert(vectors)
+            if self.buffer.count >= self.segment_max_vectors:
+                self.seal()
+
+    def delete(self, ids: List[str]) -> int:
+        if self.read_only:
+            raise PermissionError("Namespace is opened read-only")
+        with self._lock:
+            self._append_log([{'op': 'delete', 'ids': list(ids)}])
+            return self._apply_delete(ids)
+
+    @staticmethod
+    def _codes_path(segment: VectorSegment) -> Path:
+        return segment.path.with_suffix('.codes.npz')
+
+    def _segment_codes(self, segment: VectorSegment) -> Optional[QuantizedCodes]:
+        '''Load the quantized codes of a segment, training and saving them when missing'''
+        if not segment.count:
+            return None
+        path = self._codes_path(segment)
+        if path.exists():
+            codes = QuantizedCodes.load(path)
+            if codes.quantizer.kind == self.quantization['kind'] and len(codes.codes) == segment.count:
+                return codes
+        codes = QuantizedCodes.build(segment.vectors, self.quantization['kind'], self.quantization.get('subvectors'))
+        self._save_codes(segment, codes)
+        return codes
+
+    def _save_codes(self, segment: VectorSegment, codes: QuantizedCodes) -> None:
+        if not self.read_only:
+            path = self._codes_path(segment)
+            temporary = path.with_name(path.name + '.tmp')
+            codes.save(temporary)
+            os.replace(temporary, path)
+
+    def _merged_codes(self, sources: List[VectorSegment], source_rows: List[np.ndarray],
+                      merged: VectorSegment) -> Optional[QuantizedCodes]:
+        '''
+        Codes of a merged segment without retraining: when one source holds at least half of
+        the merged rows, its quantizer is kept, its codes are reused and only the rows of the
+        other sources are encoded. Otherwise the quantizer is trained again.
+        '''
+        if not merged.count:
+            return None
+        trained = [(len(rows), segment) for segment, rows in zip(sources, source_rows)
+                   if self.codes.get(segment.name) is not None]
+        if not trained or 2 * max(trained, key=lambda item: item[0])[0] < merged.count:
+            return self._segment_codes(merged)
+        base = max(trained, key=lambda item: item[0])[1]
+        quantizer = self.codes[base.name].quantizer
+        parts = []
+        for segment, rows in zip(sources, source_rows):
+            if segment is base:
+                parts.append(self.codes[base.name].codes[rows])
+            elif len(rows):
+                parts.append(quantizer.encode(np.asarray(segment.vectors[rows])))
+        codes = QuantizedCodes(quantizer, np.concatenate(parts))
+        self._save_codes(merged, codes)
+        return codes
+
+    def memory_usage(self) -> Dict[str, int]:
+        '''Bytes of sealed vectors on disk, of quantized codes and of the write buffer in RAM'''
+        return {
+            'segment_vectors': sum(segment.vectors.nbytes for segment in self.segments),
+            'codes': sum(codes.nbytes for codes in self.codes.values() if codes is not None),
+            'buffer': self.buffer.matrix.nbytes,
+        }
+
+    def _next_segment_name(self) -> str:
+        with self._lock:
+            self._segment_number += 1
+            return f"segment-{self._segment_number:06d}.jvs"
+
+    def seal(self) -> Optional[VectorSegment]:
+        '''Write the buffered vectors as a new segment and truncate the write log'''
+        with self._lock:
+            self.buffer.compact()
+            segment = None
+            if self.buffer.count:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                segment = VectorSegment.write(
+                    self.directory / self._next_segment_name(), self.metric,
+                    self.buffer.matrix[:self.buffer.size], self.buffer.ids, self.buffer.metadata,
+                )
+                if self.quantization:
+                    self.codes[segment.name] = self._segment_codes(segment)
+                self.segments = self.segments + [segment]
+                if self._id_locations is not None:
+                    self._id_locations.update({vector_id: (segment.name, row) for row, vector_id in enumerate(self.buffer.ids)})
+            self._write_manifest()
+            open(self.write_log_path, 'w').close()
+            self.buffer = LocalNamespace(self.dimension, self.metric)
+            return segment
+
+    def flush(self) -> None:
+        if not self.read_only:
+            self.seal()
+
+    def compact(self, segments: Optional[List[str]] = None,
+                budget: Optional[CompactionBudget] = None) -> Optional[VectorSegment]:
+        '''
+        Merge sealed segments into one, dropping tombstoned rows: all of them, or the ones named
+        in `segments`. The merged segment is written without holding the lock; queries keep
+        using the old segments until the swap. A `budget` throttles the reads and writes and
+        records the progress.
+        '''
+        with self._lock:
+            sources = [segment for segment in self.segments if segments is None or segment.name in segments]
+            masks = {name: mask.copy() for name, mask in self.masks.items()
+                     if name in {segment.name for segment in sources}}
+        if len(sources) < 2 and not masks:
+            return None
+
+        vectors, ids, metadata, source_rows = [], [], [], []
+        if budget is not None:
+            budget.phase('merge', sum(segment.count for segment in sources))
+        for segment in sources:
+            rows = np.flatnonzero(masks[segment.name]) if segment.name in masks else np.arange(segment.count)
+            source_rows.append(rows)
+            for start in range(0, len(rows), COMPACTION_CHUNK_ROWS):
+                chunk = rows[start:start + COMPACTION_CHUNK_ROWS]
+                vectors.append(np.asarray(segment.vectors[chunk]))
+                ids.extend(segment.id(row) for row in chunk.tolist())
+                metadata.extend(segment.metadata(row) for row in chunk.tolist())
+                if budget is not None:
+                    budget.consume(len(chunk), vectors[-1].nbytes)
+            if budget is not None and segment.count > len(rows):
+                # Dropped rows count as processed
+                budget.consume(segment.count - len(rows), 0)
+        matrix = np.concatenate(vectors) if vectors else np.zeros((0, self.dimension), dtype=np.float32)
+        merged = VectorSegment.write(self.directory / self._next_segment_name(), self.metric, matrix, ids, metadata,
+                                     budget)
+        if budget is not None:
+            budget.phase('index', merged.count)
+        merged_codes = self._merged_codes(sources, source_rows, merged) if self.quantization else None
+        if budget is not None:
+            budget.consume(merged.count, 0)
+
+        with self._lock:
+            # Rows deleted while merging are tombstoned again in the merged segment
+            deleted_since = set()
+            for segment in sources:
+                before, after = masks.get(segment.name), self.masks.get(segment.name)
+                if after is not None:
+                    newly_deleted = ~after if before is None else before & ~after
+                    deleted_since.update(segment.id(row) for row in np.flatnonzero(newly_deleted).tolist())
+            source_names = {segment.name for segment in sources}
+            self.segments = [merged] + [segment for segment in self.segments if segment.name not in source_names]
+            self.masks = {name: mask for name, mask in self.masks.items() if name not in source_names}
+            if merged_codes is not None:
+                self.codes = {name: codes for name, codes in self.codes.items() if name not in source_names}
+                self.codes[merged.name] = merged_codes
+            self.filter_indexes = {name: index for name, index in self.filter_indexes.items() if name not in source_names}
+            if deleted_since:
+                mask = np.ones(merged.count, dtype=bool)
+                mask[[row for row, vector_id in enumerate(ids) if vector_id in deleted_since]] = False
+                self.masks[merged.name] = mask
+            self._id_locations = None
+            self._write_manifest()
+
+        # In-flight queries may still hold the old maps; unlinking keeps them readable until released
+        for segment in sources:
+            segment.path.unlink(missing_ok=True)
+            self._codes_path(segment).unlink(missing_ok=True)
+        return merged
+
+    def search(self, query_vector: List[float], top_k: int, exact: bool = False,
+               ef: Optional[int] = None, filter: Optional[Dict[str, Any]] = None) -> List[tuple]:
+        '''
+        Return ((segment, row), score) pairs of the top_k live rows matching `filter`, best first;
+        segment is None for the write buffer. `exact` skips the quantized codes and scans the full vectors.
+        '''
+        return self.search_batch([query_vector], top_k, exact, ef, filter)[0]
+
+    def search_batch(self, query_vectors: List[List[float]], top_k: int, exact: bool = False,
+                     ef: Optional[int] = None, filter: Optional[Dict[str, Any]] = None,
+                     executor: Optional[Executor] = None, shard_rows: int = SHARD_ROWS) -> List[List[tuple]]:
+        '''
+        search() for several queries; each segment is scored for all of them with one matrix
+        product per block. With a filter, segments whose matching rows are few only score those.
+        With an `executor` the segments (and the write buffer) are scored in parallel.
+        '''
+        if top_k <= 0:
+            return [[] for _ in query_vectors]
+        if filter:
+            validate_filter(filter)
+        queries = self.buffer.prepare(np.asarray(query_vectors, dtype=np.float32))
+        segments, masks, codes = self.segments, self.masks, self.codes
+
+        def search_segment(segment: VectorSegment, row_executor: Optional[Executor] = None) -> List[list]:
+            candidates: List[list] = [[] for _ in range(len(queries))]
+            allowed = masks.get(segment.name)
+            if filter:
+                matching = self.filter_index(segment).mask(filter, segment.count)
+                allowed = matching if allowed is None else allowed & matching
+                if not allowed.any():
+                    return candidates
+            segment_codes = None if exact else codes.get(segment.name)
+            if segment_codes is None or (filter and allowed.sum() <= FILTERED_SCAN_ROWS):
+                for query_candidates, best in zip(candidates, scan(queries, segment.vectors, segment.norms, self.metric,
+                                                                   top_k, allowed, gather=bool(filter),
+                                                                   executor=row_executor, shard_rows=shard_rows)):
+                    query_candidates.extend(((segment, row), score) for row, score in best)
+                return candidates
+            offset = 0
+            for block in query_blocks(queries, segment.count):
+                scores = segment_codes.scores(block, segment.norms, self.metric)
+                if allowed is not None:
+                    scores[:, ~allowed] = -np.inf
+                for query, row_scores in zip(block, scores):
+                    candidates[offset].extend(((segment, row), score)
+                                              for row, score in self._rerank(segment, query, row_scores, top_k))
+                    offset += 1
+            return candidates
+
+        def search_buffer() -> List[list]:
+            return [[((None, row), score) for row, score in best]
+                    for best in self._buffer_search(queries, top_k, filter, executor, shard_rows)]
+
+        # Segments are the shards; a single one is split by rows inside scan() instead.
+        # Tasks running on the executor must not wait for further tasks on it
+        searched = [segment for segment in segments if segment.count]
+        if executor is not None and len(searched) > 1:
+            parts = [executor.submit(search_segment, segment) for segment in searched]
+            parts = [part.result() for part in parts]
+        else:
+            parts = [search_segment(segment, executor) for segment in searched]
+        parts.append(search_buffer())
+        results = []
+        for query_parts in zip(*parts):
+            query_candidates = [candidate for part in query_parts for candidate in part]
+            query_candidates.sort(key=lambda candidate: candidate[1], reverse=True)
+            results.append([(handle, self.public_score(score)) for handle, score in query_candidates[:top_k]])
+        return results
+
+    def _rerank(self, segment: VectorSegment, query: np.ndarray, approximate: np.ndarray,
+                top_k: int) -> List[Tuple[int, float]]:
+        '''Shortlist rows on their quantized scores and re-score them at full precision'''
+        shortlist = np.sort(top_k_rows(approximate, top_k * self.quantization.get('rerank', DEFAULT_RERANK_FACTOR)))
+        scores = score_matrix(query[None, :], segment.vectors[shortlist], segment.norms[shortlist], self.metric)[0]
+        return [(int(shortlist[i]), float(scores[i])) for i in top_k_rows(scores, top_k)]
+
+    def _buffer_search(self, queries: np.ndarray, top_k: int, filter: Optional[Dict[str, Any]] = None,
+                       executor: Optional[Executor] = None,
+                       shard_rows: int = SHARD_ROWS) -> List[List[Tuple[int, float]]]:
+        '''Raw (row, score) pairs of the write buffer for each query'''
+        if not self.buffer.count:
+            return [[] for _ in range(len(queries))]
+        buffer = self.buffer
+        allowed = buffer.alive[:buffer.size]
+        if filter:
+            allowed = allowed & buffer.filter_index.mask(filter, buffer.size)
+        return scan(queries, buffer.matrix[:buffer.size], buffer.norms[:buffer.size], self.metric, top_k,
+                    allowed, gather=bool(filter), executor=executor, shard_rows=shard_rows)
+
+    def filter_index(self, segment: VectorSegment) -> MetadataIndex:
+        '''Metadata index of a sealed segment, built from its metadata blob on first use'''
+        index = self.filter_indexes.get(segment.name)
+        if index is None:
+            index = MetadataIndex.build(segment.metadata(row) for row in range(segment.count))
+            self.filter_indexes[segment.name] = index
+        return index
+
+    def public_score(self, score: float) -> float:
+        return public_score(score, self.metric)
+
+    def vector(self, handle: Tuple[Optional[VectorSegment], int], include_values: bool = True,
+               fields: Optional[List[str]] = None) -> VectorData:
+        segment, row = handle
+        if segment is None:
+            return self.buffer.vector(row, include_values, fields)
+        values = np.array(segment.vectors[row], dtype=np.float32) if include_values else []
+        return VectorData(segment.id(row), values, project_metadata(segment.metadata(row), fields))
+
+    def close(self) -> None:
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
+        self.codes = {}
+        self.filter_indexes = {}
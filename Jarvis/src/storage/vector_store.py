@@ -2,10 +2,14 @@ import asyncio
 import os
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import List, Optional, Any, Dict
+from typing import TYPE_CHECKING, List, Optional, Any, Dict, Sequence, Union
 from contextlib import asynccontextmanager
-from pinecone import Pinecone
+import numpy as np
 from dotenv import load_dotenv
+from src.storage.vector_upsert import UpsertReport, VectorUpsertPipeline
+
+if TYPE_CHECKING:
+    from src.storage.federated_search import FederatedResult
 
 load_dotenv()
 
@@ -17,9 +21,45 @@ class VectorDBConfig:
 @dataclass
 class VectorData:
     id: str
-    values: List[float]
+    # A list of floats or a float32 array, typically a row view of an embedding matrix
+    values: Union[List[float], np.ndarray]
     metadata: Dict[str, Any]
+    # Similarity (or distance) reported by queries
+    score: Optional[float] = None
+
+
+def vectors_from_array(ids: Sequence[str], matrix: np.ndarray,
+                       metadata: Optional[Sequence[Dict[str, Any]]] = None) -> List[VectorData]:
+    '''
+    VectorData for every row of an embedding matrix. Values are views of the rows of one
+    contiguous float32 array, so no float is boxed or copied.
+    '''
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    if matrix.ndim != 2 or len(matrix) != len(ids):
+        raise ValueError("Expected one matrix row per id")
+    metadata = metadata if metadata is not None else [{}] * len(ids)
+    return [VectorData(vector_id, row, meta) for vector_id, row, meta in zip(ids, matrix, metadata)]
+
+
+def stack_values(vectors: Sequence[VectorData]) -> np.ndarray:
+    '''The values of vectors as one contiguous float32 matrix'''
+    if vectors and all(isinstance(vector.values, np.ndarray) for vector in vectors):
+        return np.stack([vector.values for vector in vectors]).astype(np.float32, copy=False)
+    return np.array([vector.values for vector in vectors], dtype=np.float32)
+
 
+def values_list(values: Union[List[float], np.ndarray]) -> List[float]:
+    '''Values as plain floats, for the JSON and gRPC payloads of remote backends'''
+    return values.tolist() if isinstance(values, np.ndarray) else list(values)
+
+
+def project_metadata(metadata: Optional[Dict[str, Any]], fields: Optional[List[str]] = None) -> Dict[str, Any]:
+    '''Keep only the requested metadata fields; None keeps every field'''
+    if not metadata:
+        return {}
+    if fields is None:
+        return dict(metadata)
+    return {field: metadata[field] for field in fields if field in metadata}
 
 
 class AsyncVectorDBStrategy(ABC):
@@ -39,14 +79,63 @@ class AsyncVectorDBStrategy(ABC):
     async def delete_namespace(self, namespace: str, *args, **kwargs) -> bool:
         pass
 
-    @abstractmethod
     async def upsert_vectors(self, namespace: str, vectors: List[VectorData]) -> bool:
+        '''
+        Upsert vectors through the batching pipeline: batches are split by vector count and
+        payload bytes, sent concurrently and retried on failure. The report of the call is
+        kept in `last_upsert_report`.
+        '''
+        pipeline = VectorUpsertPipeline.from_config(self.config.config_dict)
+        report = await pipeline.run(namespace, vectors, self._upsert_batch)
+        self.last_upsert_report: Optional[UpsertReport] = report
+        for batch in report.failed_batches:
+            print(f"Error upserting vectors (batch {batch.index}, {batch.attempts} attempts): {batch.error}")
+        return report.succeeded
+
+    @abstractmethod
+    async def _upsert_batch(self, namespace: str, vectors: List[VectorData]) -> None:
+        '''Send one batch of vectors, raising on failure'''
         pass
 
     @abstractmethod
-    async def query_vectors(self, namespace: str, query_vector: List[float], top_k: int = 5) -> List[VectorData]:
+    async def query_vectors(self, namespace: str, query_vector: List[float], top_k: int = 5,
+                            filter: Optional[Dict[str, Any]] = None) -> List[VectorData]:
+        '''
+        Return the top_k closest vectors whose metadata matches `filter`, a Pinecone-style
+        expression ($eq, $in, $gt, $gte, $lt, $lte, $and, $or; see vector_filter).
+        '''
         pass
 
+    async def query_vectors_batch(self, namespace: str, query_vectors: List[List[float]], top_k: int = 5,
+                                  include_values: bool = False, fields: Optional[List[str]] = None,
+                                  filter: Optional[Dict[str, Any]] = None) -> List[List[VectorData]]:
+        '''
+        Run several queries against one namespace, one result list per query vector.
+        Matches carry values only with `include_values` and only the metadata `fields`
+        asked for (all of them when None). Backends override this to batch the queries.
+        '''
+        results = await asyncio.gather(*(self.query_vectors(namespace, vector, top_k, filter=filter)
+                                         for vector in query_vectors))
+        return [
+            [VectorData(match.id, match.values if include_values else [], project_metadata(match.metadata, fields),
+                        match.score) for match in matches]
+            for matches in results
+        ]
+
+    async def query_namespaces(self, namespaces: List[str], query_vector: List[float], top_k: int = 5,
+                               weights: Optional[Dict[str, float]] = None, timeout: Optional[float] = None,
+                               namespace_timeout: Optional[float] = None, merge: str = 'score',
+                               filter: Optional[Dict[str, Any]] = None) -> 'FederatedResult':
+        '''
+        Query several namespaces of this backend concurrently and merge them into one top_k.
+        Namespaces that time out are left out and reported (see federated_search).
+        '''
+        from src.storage.federated_search import FederatedSource, federated_query
+        sources = [FederatedSource(self, namespace, (weights or {}).get(namespace, 1.0), namespace_timeout,
+                                   filter=filter, metric=self.config.config_dict.get('metric', 'cosine'))
+                   for namespace in namespaces]
+        return await federated_query(sources, query_vector, top_k, timeout, merge)
+
     @abstractmethod
     async def delete_vectors(self, namespace: str, vector_ids: List[str]) -> bool:
         pass
@@ -56,15 +145,31 @@ class AsyncPineconeStrategy(AsyncVectorDBStrategy):
     '''Pinecone Strategy Implementation'''
     def __init__(self, config: VectorDBConfig):
         self.config = config
-        self.pc: Optional[Pinecone] = None
+        self.pc = None
+        self.index = None
 
     async def initialize(self) -> None:
-        '''Initialize the Pinecone client with the API key'''
-        self.pc = Pinecone(api_key=self.config.config_dict['api_key'])
+        '''
+        Initialize the Pinecone client and open the async index once.
+        The index keeps a pool of HTTP connections that is shared by every call;
+        `connection_pool_maxsize` and `timeout` in the config tune it.
+        '''
+        if self.index is not None:
+            return
+        client_options = {
+            key: self.config.config_dict[key]
+            for key in ('connection_pool_maxsize', 'timeout')
+            if self.config.config_dict.get(key) is not None
+        }
+        from pinecone import Pinecone
+        self.pc = Pinecone(api_key=self.config.config_dict['api_key'], **client_options)
+        self.index = self.pc.IndexAsyncio(host=self.config.config_dict['host'])
 
     async def cleanup(self) -> None:
-        '''No explicit cleanup is required for Pinecone'''
-        pass
+        '''Close the shared async index and its connection pool'''
+        if self.index is not None:
+            await self.index.close()
+            self.index = None
 
     async def create_namespace(self, namespace: str, *args, **kwargs) -> bool:
         '''Pinecone automatically creates namespaces during upsert'''
@@ -72,52 +177,75 @@ class AsyncPineconeStrategy(AsyncVectorDBStrategy):
 
     async def delete_namespace(self, namespace: str, *args, **kwargs) -> bool:
         try:
-            async with self.pc.IndexAsyncio(host=self.config.config_dict['host']) as idx:
-                # Delete all records within the namespace
-                await idx.delete(delete_all=True, namespace=namespace)
+            # Delete all records within the namespace
+            await self.index.delete(delete_all=True, namespace=namespace)
             return True
         except Exception as e:
             print(f"Error deleting namespace: {e}")
             return False
 
-    async def upsert_vectors(self, namespace: str, vectors: List[VectorData]) -> bool:
-        try:
-            records = []
-            for v in vectors:
-                # Create a record merging vector and metadata.
-                record = {"id": v.id, "values": v.values, "metadata": v.metadata}
-                records.append(record)
-            async with self.pc.IndexAsyncio(host=self.config.config_dict['host']) as idx:
-                await idx.upsert(namespace=namespace, vectors=records)
-            return True
-        except Exception as e:
-            print(f"Error upserting vectors: {e}")
-            return False
+    async def _upsert_batch(self, namespace: str, vectors: List[VectorData]) -> None:
+        # Create records merging vector and metadata.
+        records = [{"id": v.id, "values": values_list(v.values), "metadata": v.metadata} for v in vectors]
+        await self.index.upsert(namespace=namespace, vectors=records, show_progress=False)
 
-    async def query_vectors(self, namespace: str, query_vector: List[float], top_k: int = 5) -> List[VectorData]:
+    async def query_vectors(self, namespace: str, query_vector: List[float], top_k: int = 5,
+                            filter: Optional[Dict[str, Any]] = None) -> List[VectorData]:
         try:
-            async with self.pc.IndexAsyncio(host=self.config.config_dict['host']) as idx:
-                # Assume query_records returns a dict with a "matches" key.
-                response = await idx.query(namespace=namespace, 
-                                           vector=query_vector, 
-                                           top_k=top_k, 
-                                           include_values=True, 
-                                           include_metadata=True
-                                        )
-                matches = response.get("matches", [])
-                results = [
-                    VectorData(match["id"], match["values"], match.get("metadata", {}))
-                    for match in matches
-                ]
+            # Assume query_records returns a dict with a "matches" key.
+            # The filter syntax is Pinecone's own, so it is pushed down as is.
+            response = await self.index.query(namespace=namespace, 
+                                              vector=query_vector, 
+                                              top_k=top_k, 
+                                              filter=filter,
+                                              include_values=True, 
+                                              include_metadata=True
+                                            )
+            matches = response.get("matches", [])
+            results = [
+                VectorData(match["id"], match["values"], match.get("metadata", {}), match.get("score"))
+                for match in matches
+            ]
             return results
         except Exception as e:
             print(f"Error querying vectors: {e}")
             return []
 
+    async def query_vectors_batch(self, namespace: str, query_vectors: List[List[float]], top_k: int = 5,
+                                  include_values: bool = False, fields: Optional[List[str]] = None,
+                                  filter: Optional[Dict[str, Any]] = None) -> List[List[VectorData]]:
+        '''
+        Pinecone takes one vector per query request, so the queries are sent concurrently
+        over the shared connection pool (at most `query_concurrency` at a time). Values and
+        metadata are only requested when needed; `fields` is applied to the response.
+        '''
+        semaphore = asyncio.Semaphore(self.config.config_dict.get('query_concurrency', 10))
+        include_metadata = fields is None or len(fields) > 0
+
+        async def query(vector: List[float]) -> List[VectorData]:
+            async with semaphore:
+                try:
+                    response = await self.index.query(namespace=namespace,
+                                                      vector=vector,
+                                                      top_k=top_k,
+                                                      filter=filter,
+                                                      include_values=include_values,
+                                                      include_metadata=include_metadata
+                                                    )
+                except Exception as e:
+                    print(f"Error querying vectors: {e}")
+                    return []
+            return [
+                VectorData(match["id"], (match.get("values") or []) if include_values else [],
+                           project_metadata(match.get("metadata"), fields), match.get("score"))
+                for match in response.get("matches", [])
+            ]
+
+        return list(await asyncio.gather(*(query(vector) for vector in query_vectors)))
+
     async def delete_vectors(self, namespace: str, ids: List[str]) -> bool:
         try:
-            async with self.pc.IndexAsyncio(host=self.config.config_dict['host']) as idx:
-                await idx.delete(ids=ids, namespace=namespace)
+            await self.index.delete(ids=ids, namespace=namespace)
             return True
         except Exception as e:
             print(f"Error deleting vectors: {e}")
@@ -130,6 +258,20 @@ class AsyncVectorDBFactory:
     def create_strategy(config: VectorDBConfig) -> AsyncVectorDBStrategy:
         db_type = config.config_dict.get('db_type')
         if db_type == 'pinecone':
-            return AsyncPineconeStrategy(config)
+            strategy = AsyncPineconeStrategy(config)
+        elif db_type == 'local':
+            from src.storage.local_vector_store import AsyncLocalVectorStrategy
+            strategy = AsyncLocalVectorStrategy(config)
+        elif db_type == 'milvus':
+            from src.storage.milvus_vector_store import AsyncMilvusStrategy
+            strategy = AsyncMilvusStrategy(config)
         else:
-            raise ValueError(f"Unsupported database type: {db_type}")
\ No newline at end of file
+            raise ValueError(f"Unsupported database type: {db_type}")
+
+        if config.config_dict.get('query_cache'):
+            from src.storage.vector_cache import CachedVectorDBStrategy
+            strategy = CachedVectorDBStrategy(strategy, config)
+        if config.config_dict.get('hybrid_search'):
+            from src.storage.hybrid_search import HybridSearchStrategy
+            strategy = HybridSearchStrategy(strategy, config)
+        return strategy
\ No newline at end of file
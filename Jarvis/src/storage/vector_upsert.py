@@ -0,0 +1,157 @@
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional
+import numpy as np
+
+if TYPE_CHECKING:
+    from src.storage.vector_store import VectorData
+
+
+# Pinecone accepts at most 1000 vectors and 2MB per upsert request
+DEFAULT_MAX_BATCH_VECTORS = 100
+DEFAULT_MAX_BATCH_BYTES = 2 * 1024 * 1024
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 0.5
+# Upper bound of a float in a JSON array: repr of a float64 (at most 24 chars) and ", "
+JSON_FLOAT_BYTES = 26
+
+
+@dataclass
+class BatchReport:
+    '''Outcome of one upsert batch'''
+    index: int
+    vectors: int
+    bytes: int
+    attempts: int = 0
+    latency_ms: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class UpsertReport:
+    '''Per-batch latencies and totals of one upsert_vectors call'''
+    batches: List[BatchReport] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def succeeded(self) -> bool:
+        return all(batch.succeeded for batch in self.batches)
+
+    @property
+    def failed_batches(self) -> List[BatchReport]:
+        return [batch for batch in self.batches if not batch.succeeded]
+
+    @property
+    def vectors(self) -> int:
+        return sum(batch.vectors for batch in self.batches)
+
+    def __str__(self):
+        latencies = sorted(batch.latency_ms for batch in self.batches) or [0.0]
+        retries = sum(max(batch.attempts - 1, 0) for batch in self.batches)
+        return (
+            f"{self.vectors} vectors in {len(self.batches)} batches, {len(self.failed_batches)} failed, "
+            f"{retries} retries, {self.elapsed:.2f}s (batch p50={latencies[len(latencies) // 2]:.1f}ms "
+            f"max={latencies[-1]:.1f}ms)"
+        )
+
+
+def record_size(vector: 'VectorData') -> int:
+    '''
+    Size in bytes of the JSON record sent for a vector. Array values are not serialized
+    here: their size is bounded by JSON_FLOAT_BYTES per float instead.
+    '''
+    if isinstance(vector.values, np.ndarray):
+        return (len(json.dumps({"id": vector.id, "values": [], "metadata": vector.metadata}))
+                + vector.values.size * JSON_FLOAT_BYTES)
+    return len(json.dumps({"id": vector.id, "values": vector.values, "metadata": vector.metadata}))
+
+
+def split_batches(vectors: List['VectorData'], max_batch_vectors: int, max_batch_bytes: int) -> List[List['VectorData']]:
+    '''
+    Split vectors into batches holding at most `max_batch_vectors` vectors and `max_batch_bytes`
+    bytes of payload. A single vector larger than the byte limit gets a batch of its own.
+    '''
+    batches: List[List['VectorData']] = []
+    batch: List['VectorData'] = []
+    batch_bytes = 0
+    for vector in vectors:
+        size = record_size(vector)
+        if batch and (len(batch) >= max_batch_vectors or batch_bytes + size > max_batch_bytes):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(vector)
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class VectorUpsertPipeline:
+    '''
+    Sends upserts as size-aware batches with bounded concurrency.
+
+    Failed batches are retried on their own with exponential backoff and jitter; the
+    batches that went through are never resent. Options are read from the strategy
+    config dict: upsert_batch_size, upsert_max_batch_bytes, upsert_concurrency,
+    upsert_max_retries and upsert_retry_backoff.
+    '''
+
+    def __init__(self,
+                 max_batch_vectors: int = DEFAULT_MAX_BATCH_VECTORS,
+                 max_batch_bytes: int = DEFAULT_MAX_BATCH_BYTES,
+                 concurrency: int = DEFAULT_CONCURRENCY,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 retry_backoff: float = DEFAULT_RETRY_BACKOFF):
+        self.max_batch_vectors = max_batch_vectors
+        self.max_batch_bytes = max_batch_bytes
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+    @classmethod
+    def from_config(cls, config_dict: Dict[str, Any]) -> 'VectorUpsertPipeline':
+        return cls(
+            max_batch_vectors=config_dict.get('upsert_batch_size', DEFAULT_MAX_BATCH_VECTORS),
+            max_batch_bytes=config_dict.get('upsert_max_batch_bytes', DEFAULT_MAX_BATCH_BYTES),
+            concurrency=config_dict.get('upsert_concurrency', DEFAULT_CONCURRENCY),
+            max_retries=config_dict.get('upsert_max_retries', DEFAULT_MAX_RETRIES),
+            retry_backoff=config_dict.get('upsert_retry_backoff', DEFAULT_RETRY_BACKOFF),
+        )
+
+    async def run(self, namespace: str, vectors: List['VectorData'],
+                  send_batch: Callable[[str, List['VectorData']], Awaitable[None]]) -> UpsertReport:
+        '''Upsert `vectors` through `send_batch`, which must raise when a batch fails'''
+        report = UpsertReport()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        batches = split_batches(vectors, self.max_batch_vectors, self.max_batch_bytes)
+
+        async def send(index: int, batch: List['VectorData']) -> BatchReport:
+            batch_report = BatchReport(index=index, vectors=len(batch), bytes=sum(record_size(v) for v in batch))
+            for attempt in range(self.max_retries + 1):
+                if attempt:
+                    await asyncio.sleep(self.retry_backoff * 2 ** (attempt - 1) * (0.5 + random.random()))
+                batch_report.attempts = attempt + 1
+                async with semaphore:
+                    start_time = time.perf_counter()
+                    try:
+                        await send_batch(namespace, batch)
+                        batch_report.error = None
+                    except Exception as e:
+                        batch_report.error = str(e) or type(e).__name__
+                    batch_report.latency_ms = (time.perf_counter() - start_time) * 1000
+                if batch_report.succeeded:
+                    break
+            return batch_report
+
+        start_time = time.perf_counter()
+        report.batches = list(await asyncio.gather(*(send(i, batch) for i, batch in enumerate(batches))))
+        report.elapsed = time.perf_counter() - start_time
+        return report
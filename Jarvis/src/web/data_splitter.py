@@ -1,6 +1,9 @@
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.docstore.document import Document
-from typing import List
+from typing import List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from src.web.dedup import ChunkDeduplicator, DedupResult
 
 
 
@@ -38,6 +41,27 @@ class TextSplitter:
         return self.splitter.split_documents(documents)
 
 
+    def split_and_deduplicate(self, documents: List[Document], namespace: str,
+                              deduplicator: Optional["ChunkDeduplicator"] = None) -> "DedupResult":
+        """
+        Splits the documents and drops the chunks that are near-duplicates of chunks already
+        stored in the namespace, before they are embedded. Once the chunks kept are upserted,
+        pass the ids that were stored to `deduplicator.commit` so later runs recognise them.
+
+        Args:
+            documents (List[Document]): List of documents to split.
+            namespace (str): The namespace the chunks will be stored in.
+            deduplicator (Optional[ChunkDeduplicator]): The deduplicator holding the index of the
+                namespace; an in-memory one by default, which only drops repeats within `documents`.
+
+        Returns:
+            DedupResult: The chunks to embed, their ids and the dedup report.
+        """
+        from src.web.dedup import ChunkDeduplicator
+        deduplicator = deduplicator or ChunkDeduplicator()
+        return deduplicator.check(namespace, self.split_documents(documents))
+
+
 
 if __name__ == "__main__":
     documents = []
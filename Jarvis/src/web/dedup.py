@@ -0,0 +1,420 @@
+"""
+Near-duplicate chunk detection between splitting and embedding.
+
+Crawled pages and PDFs repeat navigation, headers and overlapping splitter windows, and
+each copy costs an embedding call, a stored vector and noise in retrieval. ChunkDeduplicator
+drops chunks that are near-duplicates of a chunk seen before in the same namespace:
+
+    MinHash   every chunk gets a signature of `num_perm` minimum hashes over its word
+              shingles; two signatures agree on a position with probability equal to the
+              Jaccard similarity of the chunks' shingle sets
+    LSH       signatures are cut into `bands` bands; chunks sharing any band are candidates,
+              so a lookup only reads the few chunks that collide instead of the whole index,
+              and a candidate is a duplicate when its estimated similarity reaches `threshold`
+
+Band keys and signatures are kept per namespace in SQLite, so content repeated across
+documents and across runs is recognised. Checking and indexing are two steps: check()
+filters the chunks and returns a DedupReport with the ratio of chunks dropped, and
+commit() indexes the chunks kept once their vectors are stored, so a failed embedding or
+upsert never leaves chunks in the index that the vector store does not hold.
+"""
+import hashlib
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+import numpy as np
+from langchain.docstore.document import Document
+from src.llm.llm_embeddings import LocalEmbeddingsGenerator
+
+
+DEFAULT_NUM_PERM = 128
+DEFAULT_BANDS = 16
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_SHINGLE_SIZE = 5
+# Shingles hashed at once, bounds the (shingles, num_perm) matrix
+SHINGLE_BLOCK = 16384
+# Keys per SELECT, below SQLite's bound parameter limit
+LOOKUP_CHUNK = 500
+
+Chunk = Union[str, Document]
+
+
+def chunk_text(chunk: Chunk) -> str:
+    return chunk if isinstance(chunk, str) else chunk.page_content
+
+
+def content_id(text: str) -> str:
+    """
+    Default id of a chunk: the sha256 of its words, so the same chunk gets the same id
+    whatever its whitespace and case.
+    """
+    words = LocalEmbeddingsGenerator.TOKEN_PATTERN.findall(text.lower())
+    return hashlib.sha256(' '.join(words).encode('utf-8')).hexdigest()
+
+
+def splitmix64(values: np.ndarray) -> np.ndarray:
+    """
+    The splitmix64 finalizer, a bijective bit mixer: every salt turns it into an independent
+    looking permutation of the 64-bit shingle hashes. Linear (a * x + b) mod p families would
+    need 128-bit products here, and their 64-bit shortcuts correlate the permutations.
+    """
+    with np.errstate(over='ignore'):
+        values = (values ^ (values >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+        values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+        return values ^ (values >> np.uint64(31))
+
+
+@dataclass
+class DedupReport:
+    total: int = 0
+    kept: int = 0
+    duplicates: int = 0
+    # Chunks without any word, dropped as well
+    empty: int = 0
+    # Id of every duplicate -> id of the chunk it duplicates
+    matches: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def dedup_ratio(self) -> float:
+        """Share of the chunks dropped"""
+        return (self.duplicates + self.empty) / self.total if self.total else 0.0
+
+
+@dataclass
+class DedupResult:
+    chunks: List[Chunk]
+    ids: List[str]
+    report: DedupReport
+
+
+class LSHIndex:
+    """
+    SQLite tables of the band keys and signatures of the chunks kept, per namespace.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Open (and create) the index.
+
+        Args:
+            path (Optional[str]): The SQLite database file; None keeps the index in memory.
+        """
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+        else:
+            self.connection = sqlite3.connect(':memory:', check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS chunks ('
+            'namespace TEXT NOT NULL, chunk_id TEXT NOT NULL, signature BLOB NOT NULL, '
+            'PRIMARY KEY (namespace, chunk_id))'
+        )
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS bands (namespace TEXT NOT NULL, band_key INTEGER NOT NULL, chunk_id TEXT NOT NULL)'
+        )
+        self.connection.execute('CREATE INDEX IF NOT EXISTS bands_lookup ON bands (namespace, band_key)')
+        self.connection.commit()
+        self._lock = threading.Lock()
+
+    def candidates(self, namespace: str, band_keys: Iterable[int]) -> Dict[int, List[str]]:
+        """
+        Chunks sharing band keys.
+
+        Args:
+            namespace (str): The namespace to look in.
+            band_keys (Iterable[int]): The band keys to look up.
+
+        Returns:
+            Dict[int, List[str]]: The band keys found to the ids of their chunks.
+        """
+        keys = list(set(band_keys))
+        found: Dict[int, List[str]] = {}
+        with self._lock:
+            for start in range(0, len(keys), LOOKUP_CHUNK):
+                chunk = keys[start:start + LOOKUP_CHUNK]
+                rows = self.connection.execute(
+                    f"SELECT band_key, chunk_id FROM bands WHERE namespace = ? "
+                    f"AND band_key IN ({','.join('?' * len(chunk))})", [namespace, *chunk]
+                )
+                for band_key, chunk_id in rows:
+                    found.setdefault(band_key, []).append(chunk_id)
+        return found
+
+    def signatures(self, namespace: str, chunk_ids: Iterable[str]) -> Dict[str, np.ndarray]:
+        ids = list(set(chunk_ids))
+        found = {}
+        with self._lock:
+            for start in range(0, len(ids), LOOKUP_CHUNK):
+                chunk = ids[start:start + LOOKUP_CHUNK]
+                rows = self.connection.execute(
+                    f"SELECT chunk_id, signature FROM chunks WHERE namespace = ? "
+                    f"AND chunk_id IN ({','.join('?' * len(chunk))})", [namespace, *chunk]
+                )
+                for chunk_id, blob in rows:
+                    found[chunk_id] = np.frombuffer(blob, dtype=np.uint64)
+        return found
+
+    def add(self, namespace: str, chunk_ids: Sequence[str], signatures: Sequence[np.ndarray],
+            band_keys: Sequence[List[int]]) -> None:
+        """Index chunks in one transaction; chunks indexed before under the same ids are replaced"""
+        with self._lock, self.connection:
+            for start in range(0, len(chunk_ids), LOOKUP_CHUNK):
+                chunk = list(chunk_ids[start:start + LOOKUP_CHUNK])
+                self.connection.execute(
+                    f"DELETE FROM bands WHERE namespace = ? AND chunk_id IN ({','.join('?' * len(chunk))})",
+                    [namespace, *chunk],
+                )
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO chunks (namespace, chunk_id, signature) VALUES (?, ?, ?)',
+                [(namespace, chunk_id, signature.tobytes()) for chunk_id, signature in zip(chunk_ids, signatures)],
+            )
+            self.connection.executemany(
+                'INSERT INTO bands (namespace, band_key, chunk_id) VALUES (?, ?, ?)',
+                [(namespace, key, chunk_id) for chunk_id, keys in zip(chunk_ids, band_keys) for key in keys],
+            )
+
+    def remove(self, namespace: str, chunk_ids: Sequence[str]) -> None:
+        """Forget chunks, e.g. once their vectors are deleted"""
+        with self._lock, self.connection:
+            for start in range(0, len(chunk_ids), LOOKUP_CHUNK):
+                chunk = list(chunk_ids[start:start + LOOKUP_CHUNK])
+                placeholders = ','.join('?' * len(chunk))
+                for table in ('chunks', 'bands'):
+                    self.connection.execute(
+                        f"DELETE FROM {table} WHERE namespace = ? AND chunk_id IN ({placeholders})",
+                        [namespace, *chunk],
+                    )
+
+    def clear(self, namespace: str) -> None:
+        with self._lock, self.connection:
+            for table in ('chunks', 'bands'):
+                self.connection.execute(f"DELETE FROM {table} WHERE namespace = ?", (namespace,))
+
+    def count(self, namespace: str) -> int:
+        with self._lock:
+            return self.connection.execute('SELECT COUNT(*) FROM chunks WHERE namespace = ?',
+                                           (namespace,)).fetchone()[0]
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class ChunkDeduplicator:
+    """
+    MinHash/LSH near-duplicate filter of text chunks, with a persistent index per namespace.
+    """
+
+    def __init__(self, path: Optional[str] = None, num_perm: int = DEFAULT_NUM_PERM, bands: int = DEFAULT_BANDS,
+                 threshold: float = DEFAULT_THRESHOLD, shingle_size: int = DEFAULT_SHINGLE_SIZE, seed: int = 1):
+        """
+        Initializes the deduplicator.
+
+        Args:
+            path (Optional[str]): The SQLite file of the index; None keeps it in memory.
+            num_perm (int): The number of hash permutations in a signature.
+            bands (int): The number of LSH bands, dividing num_perm. More bands find
+                candidates at lower similarities, at the cost of more lookups.
+            threshold (float): The estimated Jaccard similarity from which a chunk is a duplicate.
+            shingle_size (int): The number of consecutive words per shingle.
+            seed (int): The seed of the permutations; an index must always be used with the same one.
+        """
+        if num_perm % bands:
+            raise ValueError("bands must divide num_perm")
+        self.index = LSHIndex(path)
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        # One salt per permutation, mixed into the shingle hashes by splitmix64()
+        self.salts = np.random.default_rng(seed).integers(0, np.iinfo(np.uint64).max, size=num_perm,
+                                                          dtype=np.uint64, endpoint=True)
+        # Namespace -> id -> (signature, band keys) of the chunks checked but not committed yet
+        self.pending: Dict[str, Dict[str, Tuple[np.ndarray, List[int]]]] = {}
+        self._lock = threading.Lock()
+
+    def shingle_hashes(self, texts: Sequence[str]) -> List[np.ndarray]:
+        """
+        Hashes of the word shingles of every text. A text shorter than shingle_size words
+        gets a single shingle of all its words; a text without words gets none.
+
+        Args:
+            texts (Sequence[str]): The texts to shingle.
+
+        Returns:
+            List[np.ndarray]: One uint64 array per text.
+        """
+        words, counts = [], []
+        for text in texts:
+            tokens = LocalEmbeddingsGenerator.TOKEN_PATTERN.findall(text.lower())
+            words.extend(tokens)
+            counts.append(len(tokens))
+        if not words:
+            return [np.empty(0, dtype=np.uint64) for _ in texts]
+        word_hashes = LocalEmbeddingsGenerator.hash_tokens(words)
+        shingles = []
+        start = 0
+        with np.errstate(over='ignore'):
+            for count in counts:
+                hashes = word_hashes[start:start + count]
+                size = min(self.shingle_size, count)
+                # Polynomial combination of the word hashes of every window
+                combined = np.zeros(count - size + 1 if count else 0, dtype=np.uint64)
+                for offset in range(size):
+                    combined = combined * np.uint64(0x100000001b3) + hashes[offset:offset + len(combined)]
+                shingles.append(np.unique(combined))
+                start += count
+        return shingles
+
+    def signatures(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        MinHash signatures of texts.
+
+        Args:
+            texts (Sequence[str]): The texts to sign.
+
+        Returns:
+            np.ndarray: A (len(texts), num_perm) uint64 array; rows of texts without words
+                hold the maximum value.
+        """
+        shingles = self.shingle_hashes(texts)
+        signatures = np.full((len(texts), self.num_perm), np.iinfo(np.uint64).max, dtype=np.uint64)
+        counts = np.array([len(hashes) for hashes in shingles], dtype=np.int64)
+        if not counts.sum():
+            return signatures
+        ends = np.cumsum(counts)
+        starts = ends - counts
+        nonempty = np.flatnonzero(counts)
+        hashes = np.concatenate(shingles)[:, None]
+        position = 0
+        while position < len(nonempty):
+            first = starts[nonempty[position]]
+            # Whole texts per block, at least one
+            stop = max(int(np.searchsorted(ends[nonempty], first + SHINGLE_BLOCK, side='right')), position + 1)
+            rows = nonempty[position:stop]
+            values = splitmix64(hashes[first:ends[rows[-1]]] ^ self.salts)
+            signatures[rows] = np.minimum.reduceat(values, starts[rows] - first, axis=0)
+            position = stop
+        return signatures
+
+    def band_keys(self, signature: np.ndarray) -> List[int]:
+        """One signed 64-bit key per band, salted with the band number"""
+        return [
+            int.from_bytes(hashlib.blake2b(signature[band * self.rows:(band + 1) * self.rows].tobytes(),
+                                           digest_size=8, salt=band.to_bytes(16, 'big')).digest(), 'big', signed=True)
+            for band in range(self.bands)
+        ]
+
+    @staticmethod
+    def similarity(first: np.ndarray, second: np.ndarray) -> float:
+        """Estimated Jaccard similarity of two signatures"""
+        return float(np.mean(first == second))
+
+    def check(self, namespace: str, chunks: Sequence[Chunk], ids: Optional[Sequence[str]] = None) -> DedupResult:
+        """
+        Drops the chunks that are near-duplicates of a chunk indexed in the namespace or of an
+        earlier chunk of the same call. The chunks kept are not indexed yet: pass their ids to
+        commit() once they are stored.
+
+        Args:
+            namespace (str): The namespace the chunks are stored in.
+            chunks (Sequence[Chunk]): The chunks, as strings or Documents.
+            ids (Optional[Sequence[str]]): The ids of the chunks; content hashes by default.
+
+        Returns:
+            DedupResult: The chunks kept in order, their ids and the report.
+        """
+        texts = [chunk_text(chunk) for chunk in chunks]
+        ids = list(ids) if ids is not None else [content_id(text) for text in texts]
+        if len(ids) != len(texts):
+            raise ValueError("ids and chunks must have the same length")
+        signatures = self.signatures(texts)
+        empty = np.all(signatures == np.iinfo(np.uint64).max, axis=1)
+        keys = [[] if empty[row] else self.band_keys(signatures[row]) for row in range(len(texts))]
+
+        # One round trip for the candidates of the whole call
+        stored = self.index.candidates(namespace, (key for row_keys in keys for key in row_keys))
+        stored_signatures = self.index.signatures(namespace, (chunk_id for chunk_ids in stored.values()
+                                                              for chunk_id in chunk_ids))
+        report = DedupReport(total=len(texts))
+        kept_rows: List[int] = []
+        # Band key -> rows kept so far in this call
+        batch: Dict[int, List[int]] = {}
+        for row in range(len(texts)):
+            if empty[row]:
+                report.empty += 1
+                continue
+            match = None
+            for key in keys[row]:
+                for chunk_id in stored.get(key, ()):
+                    signature = stored_signatures.get(chunk_id)
+                    if signature is not None and self.similarity(signatures[row], signature) >= self.threshold:
+                        match = chunk_id
+                        break
+                for other in batch.get(key, ()) if match is None else ():
+                    if self.similarity(signatures[row], signatures[other]) >= self.threshold:
+                        match = ids[other]
+                        break
+                if match is not None:
+                    break
+            if match is not None:
+                report.duplicates += 1
+                report.matches[ids[row]] = match
+                continue
+            kept_rows.append(row)
+            for key in keys[row]:
+                batch.setdefault(key, []).append(row)
+
+        report.kept = len(kept_rows)
+        with self._lock:
+            pending = self.pending.setdefault(namespace, {})
+            for row in kept_rows:
+                pending[ids[row]] = (signatures[row], keys[row])
+        return DedupResult([chunks[row] for row in kept_rows], [ids[row] for row in kept_rows], report)
+
+    def commit(self, namespace: str, ids: Sequence[str]) -> int:
+        """
+        Indexes chunks kept by check(), once they are stored. Ids that were not checked, or
+        were committed already, are ignored.
+
+        Args:
+            namespace (str): The namespace the chunks were checked in.
+            ids (Sequence[str]): The ids of the chunks stored, e.g. those of the vectors upserted.
+
+        Returns:
+            int: The number of chunks indexed.
+        """
+        with self._lock:
+            pending = self.pending.get(namespace, {})
+            entries = [(chunk_id, pending.pop(chunk_id)) for chunk_id in dict.fromkeys(ids) if chunk_id in pending]
+            if not pending:
+                self.pending.pop(namespace, None)
+        if entries:
+            self.index.add(namespace, [chunk_id for chunk_id, _ in entries], [entry[0] for _, entry in entries],
+                           [entry[1] for _, entry in entries])
+        return len(entries)
+
+    def discard(self, namespace: str, ids: Optional[Sequence[str]] = None) -> None:
+        """Drops chunks checked but never stored, all those of the namespace by default"""
+        with self._lock:
+            if ids is None:
+                self.pending.pop(namespace, None)
+                return
+            pending = self.pending.get(namespace, {})
+            for chunk_id in ids:
+                pending.pop(chunk_id, None)
+
+    def forget(self, namespace: str, ids: Sequence[str]) -> None:
+        """Removes chunks from the index of a namespace"""
+        self.index.remove(namespace, ids)
+
+    def clear(self, namespace: str) -> None:
+        """Removes every chunk of a namespace from the index"""
+        self.discard(namespace)
+        self.index.clear(namespace)
+
+    def close(self) -> None:
+        self.index.close()
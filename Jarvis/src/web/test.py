@@ -0,0 +1,86 @@
+import os
+import random
+import tempfile
+import unittest
+from langchain.docstore.document import Document
+from src.web.data_splitter import TextSplitter
+from src.web.dedup import ChunkDeduplicator, DedupReport, content_id
+
+
+def words(count: int, seed: int) -> list:
+    generator = random.Random(seed)
+    return [f"word{generator.randrange(5000)}" for _ in range(count)]
+
+
+class ChunkDeduplicatorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.base = words(200, seed=1)
+        self.text = ' '.join(self.base)
+        # One word in 200 changed and different spacing: well above the 0.8 threshold
+        self.near = '  '.join(self.base[:100] + ['changed'] + self.base[101:])
+        self.other = ' '.join(words(200, seed=2))
+        self.deduplicator = ChunkDeduplicator()
+
+    def tearDown(self):
+        self.deduplicator.close()
+
+    def test_exact_and_near_duplicates_within_a_call(self):
+        result = self.deduplicator.check('docs', [self.text, self.text.upper(), self.near, self.other])
+        self.assertEqual(result.chunks, [self.text, self.other])
+        self.assertEqual((result.report.total, result.report.kept, result.report.duplicates), (4, 2, 2))
+        self.assertEqual(set(result.report.matches.values()), {content_id(self.text)})
+
+    def test_duplicates_across_calls_once_committed(self):
+        first = self.deduplicator.check('docs', [self.text])
+        # Not stored yet: the same content is still kept
+        self.assertEqual(self.deduplicator.check('docs', [self.near]).report.kept, 1)
+        self.assertEqual(self.deduplicator.index.count('docs'), 0)
+
+        self.assertEqual(self.deduplicator.commit('docs', first.ids), 1)
+        self.assertEqual(self.deduplicator.commit('docs', first.ids), 0)
+        second = self.deduplicator.check('docs', [Document(page_content=self.near), self.other])
+        self.assertEqual(second.ids, [content_id(self.other)])
+        self.assertEqual(second.report.matches, {content_id(self.near): content_id(self.text)})
+
+    def test_only_committed_ids_are_indexed(self):
+        result = self.deduplicator.check('docs', [self.text, self.other], ids=['a', 'b'])
+        self.deduplicator.commit('docs', ['b', 'unknown'])
+        self.assertEqual(self.deduplicator.index.count('docs'), 1)
+        self.assertEqual(self.deduplicator.check('docs', [self.text, self.other]).report.kept, 1)
+
+        self.deduplicator.discard('docs')
+        self.assertEqual(self.deduplicator.commit('docs', result.ids), 0)
+
+    def test_namespaces_are_separate(self):
+        self.deduplicator.commit('first', self.deduplicator.check('first', [self.text]).ids)
+        self.assertEqual(self.deduplicator.check('second', [self.text]).report.kept, 1)
+        self.assertEqual(self.deduplicator.check('first', [self.text]).report.kept, 0)
+
+    def test_empty_chunks_and_ratio(self):
+        result = self.deduplicator.check('docs', ['', ' !? ', self.text, self.near, self.other])
+        self.assertEqual((result.report.empty, result.report.duplicates, result.report.kept), (2, 1, 2))
+        self.assertAlmostEqual(result.report.dedup_ratio, 3 / 5)
+        self.assertEqual(DedupReport().dedup_ratio, 0.0)
+
+    def test_index_persists(self):
+        path = os.path.join(tempfile.mkdtemp(), 'dedup.sqlite3')
+        deduplicator = ChunkDeduplicator(path)
+        deduplicator.commit('docs', deduplicator.check('docs', [self.text]).ids)
+        deduplicator.close()
+
+        reopened = ChunkDeduplicator(path)
+        self.assertEqual(reopened.check('docs', [self.near]).report.duplicates, 1)
+        reopened.close()
+
+    def test_split_and_deduplicate(self):
+        paragraph = ' '.join(words(60, seed=3))
+        documents = [Document(page_content=paragraph), Document(page_content=paragraph + '\n\n' + self.other)]
+        result = TextSplitter(chunk_size=500, chunk_overlap=0).split_and_deduplicate(
+            documents, 'docs', self.deduplicator)
+        self.assertGreater(result.report.duplicates, 0)
+        self.assertEqual(len(result.ids), len(set(result.ids)))
+        self.assertEqual(self.deduplicator.index.count('docs'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()